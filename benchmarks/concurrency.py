@@ -0,0 +1,61 @@
+""" Optimistic (occ) vs. pessimistic no-wait locking (lock) transactions on
+a read-mostly workload: each transaction runs 9 selects & 1 update.
+
+Usage (from the root of the repo):
+    python -m benchmarks.concurrency [n_threads] [n_transactions] [n_keys]
+"""
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+from lstore.transaction_worker import TransactionWorker
+from random import choice, randrange, seed
+from time import time
+import shutil
+import sys
+import threading
+
+n_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+n_transactions = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+n_keys = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+path = 'bench_concurrency_db'
+
+print("%d threads x %d transactions on %d keys" % (
+    n_threads, n_transactions, n_keys))
+print("%-5s %9s %9s %9s" % ('mode', 'time', 'commits', 'aborts'))
+for mode in ['lock', 'occ']:
+    seed(0)
+    shutil.rmtree(path, ignore_errors=True)
+    db = Database(cc_mode=mode)
+    db.open(path)
+    table = db.create_table('Grades', 5, 0)
+    query = Query(table)
+    keys = [906659671 + i for i in range(n_keys)]
+    for key in keys:
+        query.insert(key, 93, 0, 0, 0)
+
+    workers = []
+    for _ in range(n_threads):
+        worker = TransactionWorker([])
+        for _ in range(n_transactions):
+            t = Transaction()
+            for _ in range(9):
+                t.add_query(query.select, choice(keys), 0, [1, 1, 1, 1, 1])
+            t.add_query(query.update, choice(keys),
+                        None, randrange(0, 100), None, None, None)
+            worker.add_transaction(t)
+        workers.append(worker)
+
+    threads = [threading.Thread(target=w.run) for w in workers]
+    t0 = time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time() - t0
+
+    commits = sum(w.result for w in workers)
+    print("%-5s %9.3f %9d %9d" % (
+        mode, elapsed, commits, n_threads * n_transactions - commits))
+    db.drop_table('Grades')
+
+shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,65 @@
+""" Trade-off of the partition geometry (records per partition) for scans,
+point lookups & eviction I/O.
+
+Usage (from the root of the repo):
+    python -m benchmarks.geometry [n_records] [buffer_bytes]
+"""
+from lstore.db import Database
+from lstore.query import Query
+from time import process_time
+from random import choice, randrange, seed
+import shutil
+import sys
+
+n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+buffer_size = int(sys.argv[2]) if len(sys.argv) > 2 else 32 * 2**20
+geometries = [('4K', 4096), ('64K', 65536), ('1M', 1048576)]
+path = 'bench_geometry_db'
+
+
+print("%d records; %d bytes of buffer" % (n_records, buffer_size))
+print("%-5s %9s %9s %9s %9s %7s %7s %12s" % (
+    'geom', 'insert', 'scan', 'lookup', 'update', 'loads', 'writes',
+    'bytes_out'))
+for name, max_records in geometries:
+    seed(0)
+    shutil.rmtree(path, ignore_errors=True)
+    db = Database(buffer_size)
+    db.open(path)
+    table = db.create_table('Grades', 5, 0, max_records=max_records)
+    query = Query(table)
+    keys = [906659671 + i for i in range(n_records)]
+
+    t0 = process_time()
+    for key in keys:
+        query.insert(key, 93, 0, 0, 0)
+    t_insert = process_time() - t0
+    # start the measurements with a cold buffer
+    table.buffer.flush()
+    table.buffer.n_loads = table.buffer.n_writes = 0
+    table.buffer.n_bytes_written = 0
+
+    # Full scan, a partition at a time
+    t0 = process_time()
+    sum(sum(cols[0]) for cols in table.iter_columns([0, 1, 0, 0, 0]))
+    t_scan = process_time() - t0
+
+    # Random point lookups
+    t0 = process_time()
+    for i in range(2000):
+        query.select(choice(keys), 0, [1, 1, 1, 1, 1])
+    t_lookup = process_time() - t0
+
+    # Random updates; dirty partitions have to be written back on eviction
+    t0 = process_time()
+    for i in range(2000):
+        query.update(choice(keys), None, randrange(0, 100), None, None, None)
+    table.buffer.flush()
+    t_update = process_time() - t0
+
+    print("%-5s %9.3f %9.3f %9.3f %9.3f %7d %7d %12d" % (
+        name, t_insert, t_scan, t_lookup, t_update, table.buffer.n_loads,
+        table.buffer.n_writes, table.buffer.n_bytes_written))
+    db.drop_table('Grades')
+
+shutil.rmtree(path, ignore_errors=True)
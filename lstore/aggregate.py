@@ -0,0 +1,231 @@
+from collections import Counter
+import pickle
+import threading
+
+# Operations that can be materialized
+OPS = ('sum', 'count', 'min', 'max')
+
+
+class MaterializedAggregate:
+    """ SUM/COUNT/MIN/MAX of one column of a table, kept up to date by every
+        insert, update & delete instead of being computed by reading the
+        records. Optionally grouped into buckets of keys, where bucket b holds
+        the records whose keys are in [b * bucket_size, (b+1) * bucket_size).
+
+    For SUM & COUNT, a bucket is 2 ints. For MIN & MAX, a bucket also counts
+      the occurrences of every value so that deleting the smallest or largest
+      one is possible; the extremes are cached until that happens.
+
+    The share of every partition of the table is kept as well, so that
+      recovery only redoes the partitions written after the checkpoint; see
+      self.reset.
+    """
+
+    def __init__(self, column, ops=OPS, bucket_size=None):
+        """
+        Arguments:
+            - column: int
+                Index of the user column to aggregate.
+            - ops: tuple
+                Operations to materialize; any of 'sum', 'count', 'min', 'max'.
+            - bucket_size: int
+                Number of keys per bucket; a single bucket for the whole table
+                if None.
+        """
+        self.column = column
+        self.ops = tuple(ops)
+        self.bucket_size = bucket_size
+        self.__init_state()
+        self.lock = threading.Lock()
+
+    def __init_state(self):
+        # Key:   bucket
+        # Value: [sum, count] of the bucket
+        self.totals = {}
+        # Key:   bucket
+        # Value: Counter of the values in the bucket; only for min & max
+        self.values = {} if 'min' in self.ops or 'max' in self.ops else None
+        # Key:   bucket
+        # Value: cached (min, max) of the bucket
+        self.extremes = {}
+        # Key:   index of a partition
+        # Value: dict of bucket -> [sum, count, Counter of the values or None]
+        #        of the records in the partition
+        self.parts = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        """
+        Returns:
+            Pickled bytes of a consistent copy of the aggregate.
+        """
+        with self.lock:
+            return pickle.dumps(self)
+
+    def clear(self):
+        with self.lock:
+            self.__init_state()
+
+    def bucket(self, key):
+        """
+        Returns:
+            Bucket of @key
+        """
+        return 0 if self.bucket_size is None else key // self.bucket_size
+
+    def add(self, key, value, part):
+        """ Account for a new record with key @key & @value in the column
+            in partition @part
+        """
+        with self.lock:
+            self.__add(self.bucket(key), value, part)
+
+    def remove(self, key, value, part):
+        """ Account for the deletion of a record with key @key & @value in
+            the column from partition @part
+        """
+        with self.lock:
+            self.__remove(self.bucket(key), value, part)
+
+    def change(self, old_key, old_value, new_key, new_value, part):
+        """ Account for a record of partition @part whose key and/or value
+            changed
+        """
+        old_bucket, new_bucket = self.bucket(old_key), self.bucket(new_key)
+        if old_bucket == new_bucket and old_value == new_value:
+            return
+        with self.lock:
+            self.__remove(old_bucket, old_value, part)
+            self.__add(new_bucket, new_value, part)
+
+    def move(self, key, value, old_part, new_part):
+        """ Account for a record that moved from partition @old_part to
+            @new_part; the aggregate itself doesn't change
+        """
+        if old_part == new_part:
+            return
+        bucket = self.bucket(key)
+        with self.lock:
+            self.__part_remove(old_part, bucket, value)
+            self.__part_add(new_part, bucket, value)
+
+    def reset(self, part):
+        """ Take all records of partition @part out of the aggregate, so
+            that they can be added again as they are on the disk. Used by
+            recovery for partitions written after the checkpoint.
+        """
+        with self.lock:
+            for bucket, (total, count, values) in \
+                    self.parts.pop(part, {}).items():
+                bucket_total = self.totals[bucket]
+                bucket_total[0] -= total
+                bucket_total[1] -= count
+                if bucket_total[1] == 0:
+                    del self.totals[bucket]
+                if self.values is not None:
+                    bucket_values = self.values[bucket]
+                    bucket_values.subtract(values)
+                    for value in [v for v in values if not bucket_values[v]]:
+                        del bucket_values[value]
+                    if not bucket_values:
+                        del self.values[bucket]
+                    self.extremes.pop(bucket, None)
+
+    def partitions(self):
+        """
+        Returns:
+            Indices of the partitions that have records in the aggregate.
+        """
+        with self.lock:
+            return list(self.parts)
+
+    def value(self, op, first=None, last=None):
+        """ Combined @op over the buckets from @first to @last (inclusive),
+            or over all buckets if not given. O(number of buckets).
+        Returns:
+            The aggregate; None for min/max of no records.
+        """
+        with self.lock:
+            buckets = [
+                b for b in self.totals
+                if (first is None or b >= first) and (last is None or b <= last)
+            ]
+            if op == 'sum':
+                return sum(self.totals[b][0] for b in buckets)
+            if op == 'count':
+                return sum(self.totals[b][1] for b in buckets)
+            extremes = [self.__extremes(b) for b in buckets]
+            if not extremes:
+                return None
+            if op == 'min':
+                return min(lo for lo, _ in extremes)
+            return max(hi for _, hi in extremes)
+
+    def __add(self, bucket, value, part):
+        total = self.totals.setdefault(bucket, [0, 0])
+        total[0] += value
+        total[1] += 1
+        if self.values is not None:
+            self.values.setdefault(bucket, Counter())[value] += 1
+            if bucket in self.extremes:
+                lo, hi = self.extremes[bucket]
+                self.extremes[bucket] = (min(lo, value), max(hi, value))
+        self.__part_add(part, bucket, value)
+
+    def __part_add(self, part, bucket, value):
+        share = self.parts.setdefault(part, {}).get(bucket)
+        if share is None:
+            share = self.parts[part][bucket] = [
+                0, 0, None if self.values is None else Counter()]
+        share[0] += value
+        share[1] += 1
+        if share[2] is not None:
+            share[2][value] += 1
+
+    def __part_remove(self, part, bucket, value):
+        shares = self.parts[part]
+        share = shares[bucket]
+        share[0] -= value
+        share[1] -= 1
+        if share[1] == 0:
+            del shares[bucket]
+            if not shares:
+                del self.parts[part]
+        elif share[2] is not None:
+            share[2][value] -= 1
+            if not share[2][value]:
+                del share[2][value]
+
+    def __remove(self, bucket, value, part):
+        self.__part_remove(part, bucket, value)
+        total = self.totals[bucket]
+        total[0] -= value
+        total[1] -= 1
+        if total[1] == 0:
+            del self.totals[bucket]
+        if self.values is not None:
+            values = self.values[bucket]
+            values[value] -= 1
+            if values[value] == 0:
+                del values[value]
+                # the extreme may be gone; found again when needed
+                if value in self.extremes.get(bucket, ()):
+                    del self.extremes[bucket]
+            if not values:
+                del self.values[bucket]
+
+    def __extremes(self, bucket):
+        """ (min, max) of @bucket; O(distinct values) if not cached
+        """
+        if bucket not in self.extremes:
+            values = self.values[bucket]
+            self.extremes[bucket] = (min(values), max(values))
+        return self.extremes[bucket]
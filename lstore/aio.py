@@ -0,0 +1,190 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from lstore.config import Config
+from lstore.query import Query
+from lstore.transaction import Transaction
+
+# Shared by all AsyncQuery objs that aren't given an executor
+_executor = None
+
+
+def default_executor():
+    """ Thread pool that runs the storage work of the async API
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(Config.ASYNC_WORKERS)
+    return _executor
+
+
+class AsyncQuery:
+    """ asyncio version of Query. Every method is a coroutine that runs the
+        storage work of the Query method with the same name on a bounded
+        executor, so the event loop never blocks on bufferpool I/O or locks.
+
+        - Selects issued during the same iteration of the event loop are sent
+          to the executor as one batch (see Table.select_many), so selects on
+          the same partition share a single fetch of it. Identical selects in
+          a batch are coalesced and get the same result list.
+        - Admission follows the pressure on the buffer manager: a storage
+          call only starts once at least Config.ASYNC_HEADROOM of the budget
+          isn't pinned, so that callers wait instead of piling work onto a
+          buffer that can't evict anything. On top of that, at most
+          @max_pending storage calls of this obj are in flight.
+    """
+
+    def __init__(self, table, executor=None,
+                 max_pending=Config.ASYNC_MAX_PENDING):
+        """
+        Arguments:
+            - table: Table
+                Table to perform the queries on.
+            - executor: concurrent.futures.Executor
+                Executor of the storage work; a shared thread pool with
+                Config.ASYNC_WORKERS threads if not given.
+            - max_pending: int
+                Max number of storage calls in flight.
+        """
+        self.table = table
+        self.query = Query(table)
+        self.executor = executor
+        self.__in_flight = asyncio.Semaphore(max_pending)
+        # Key:   (key, indexing_col, query_columns) of a select
+        # Value: asyncio.Future of its result
+        self.__pending_selects = {}
+
+    async def __run(self, func, *args):
+        """ Run @func(*args) on the executor once there's a free slot and
+            headroom in the buffer
+        """
+        async with self.__in_flight:
+            await self.__admit()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor or default_executor(), partial(func, *args))
+
+    async def __admit(self):
+        """ Wait until enough of the buffer isn't pinned
+        """
+        manager = self.table.buffer.manager
+        needed = manager.BUDGET * Config.ASYNC_HEADROOM
+        while manager.headroom() < needed:
+            await asyncio.sleep(Config.ASYNC_POLL)
+
+    async def select(self, key, indexing_col, query_columns, columnar=False):
+        if columnar:
+            return await self.__run(
+                self.query.select, key, indexing_col, query_columns, True)
+
+        request = (key, indexing_col, tuple(query_columns))
+        future = self.__pending_selects.get(request)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            # first select of this iteration; dispatch the batch afterwards
+            if not self.__pending_selects:
+                loop.call_soon(self.__dispatch_selects)
+            future = self.__pending_selects[request] = loop.create_future()
+        return await asyncio.shield(future)
+
+    def __dispatch_selects(self):
+        batch = self.__pending_selects
+        self.__pending_selects = {}
+        asyncio.ensure_future(self.__run_selects(batch))
+
+    async def __run_selects(self, batch):
+        try:
+            results = await self.__run(self.table.select_many, list(batch))
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        for future, result in zip(batch.values(), results):
+            future.set_result(result)
+
+    async def select_range(self, begin, end, indexing_col, query_columns,
+                           columnar=False):
+        return await self.__run(
+            self.query.select_range, begin, end, indexing_col, query_columns,
+            columnar)
+
+    async def insert(self, *columns):
+        return await self.__run(self.query.insert, *columns)
+
+    async def update(self, key, *columns):
+        return await self.__run(self.query.update, key, *columns)
+
+    async def update_batch(self, updates):
+        return await self.__run(self.query.update_batch, updates)
+
+    async def upsert(self, records):
+        return await self.__run(self.query.upsert, records)
+
+    async def delete(self, key):
+        return await self.__run(self.query.delete, key)
+
+    async def increment(self, key, column):
+        return await self.__run(self.query.increment, key, column)
+
+    async def add(self, key, column, delta):
+        return await self.__run(self.query.add, key, column, delta)
+
+    async def add_batch(self, deltas):
+        return await self.__run(self.query.add_batch, deltas)
+
+    async def sum(self, start_range, end_range, aggregate_column_index,
+                  parallel=False):
+        return await self.__run(
+            self.query.sum, start_range, end_range, aggregate_column_index,
+            parallel)
+
+    async def count(self, start_range, end_range, aggregate_column_index,
+                    parallel=False):
+        return await self.__run(
+            self.query.count, start_range, end_range, aggregate_column_index,
+            parallel)
+
+    async def min(self, start_range, end_range, aggregate_column_index,
+                  parallel=False):
+        return await self.__run(
+            self.query.min, start_range, end_range, aggregate_column_index,
+            parallel)
+
+    async def max(self, start_range, end_range, aggregate_column_index,
+                  parallel=False):
+        return await self.__run(
+            self.query.max, start_range, end_range, aggregate_column_index,
+            parallel)
+
+    async def scan(self, query_columns, columnar=False, parallel=False,
+                   where=None):
+        return await self.__run(
+            self.query.scan, query_columns, columnar, parallel, where)
+
+
+class AsyncTransaction(Transaction):
+    """ Transaction whose run is a coroutine:
+
+    q = AsyncQuery(grades_table)
+    t = AsyncTransaction()
+    t.add_query(q.update, 0, *[None, 1, None, 2, None])
+    committed = await t.run()
+    """
+
+    def add_query(self, query, *args):
+        # Methods of AsyncQuery are swapped for their blocking counterparts
+        #   since the whole transaction runs on the executor
+        owner = getattr(query, '__self__', None)
+        if isinstance(owner, AsyncQuery):
+            query = getattr(owner.query, query.__name__)
+        super().add_query(query, *args)
+
+    async def run(self, executor=None):
+        """ Run the transaction on @executor, the shared thread pool if not
+            given.
+        Returns:
+            True if the transaction commits; False on abort.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor or default_executor(), super().run)
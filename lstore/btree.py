@@ -0,0 +1,379 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import os
+
+from lstore.config import Config
+
+# smallest rid; lower bound of the (value, rid) pairs of a value
+MIN_RID = -2**63
+# first word of the header page
+MAGIC = 0x4c42545245450002
+
+
+class Node:
+    """ Node of a DiskBTree. Leaves have sorted (value, rid) pairs as @keys &
+        the page number of the next leaf; inner nodes have separators as
+        @keys & one more page number in @children than keys.
+    """
+    __slots__ = ('leaf', 'keys', 'children', 'next')
+
+    def __init__(self, leaf, keys=None, children=None, next=0):
+        self.leaf = leaf
+        self.keys = keys if keys is not None else []
+        self.children = children if children is not None else []
+        self.next = next
+
+    def pack(self, size):
+        """
+        Returns:
+            The node as @size bytes: leaf flag, number of keys & next leaf,
+                then the flattened keys, then the children.
+        """
+        words = array('q', [self.leaf, len(self.keys), self.next])
+        for value, rid in self.keys:
+            words.append(value)
+            words.append(rid)
+        words.extend(self.children)
+        data = words.tobytes()
+        return data + bytes(size - len(data))
+
+    @classmethod
+    def unpack(cls, data):
+        words = array('q')
+        words.frombytes(data)
+        leaf, n_keys, next = words[0], words[1], words[2]
+        end = 3 + 2 * n_keys
+        keys = list(zip(words[3:end:2], words[4:end:2]))
+        children = [] if leaf else words[end:end + n_keys + 1].tolist()
+        return cls(bool(leaf), keys, children, next)
+
+
+class DiskBTree:
+    """ B+tree index whose nodes are fixed-size pages in a file, so that an
+        index doesn't have to fit in memory. Nodes in memory are charged to
+        the BufferManager like partitions and evicted by the same policy;
+        dirty ones are written back to the file upon eviction.
+
+    Every (value, rid) pair is a key of its own, so a value with many records
+    spans leaves like any other range. Deletes don't merge underfull nodes;
+    the tree only shrinks when it's rebuilt.
+
+    It's a drop-in for the IOBTree of a column in Index: get, items & values
+    return the rids of a value as a list, while add & discard change one rid.
+
+    File layout: slot 0 of the file is the header (magic, generation, number
+    of slots); nodes are written to the other slots. Nodes are numbered by
+    page, and self.slots maps a page to the slot it's in. The slots of the
+    last save are never overwritten: a node written for the first time
+    since the save goes to a free slot, so that the tree as of the save,
+    i.e., as pickled by the checkpoint of the table, survives a crash and
+    only the changes after the checkpoint need to be redone. The slots left
+    behind are reused once the next save is pickled too; see self.save.
+    """
+    PAGE = Config.SIZE_INDEX_PAGE
+    # max keys per node such that a node fits in a page
+    MAX_LEAF = (PAGE // Config.SIZE_INT - 3) // 2
+    MAX_INNER = (PAGE // Config.SIZE_INT - 4) // 3
+
+    def __init__(self, directory, name, manager):
+        """ Create an empty tree in the file @name in @directory
+        Arguments:
+            - manager: BufferManager
+                Buffer manager that decides which nodes stay in memory.
+        """
+        self.name = name
+        self.root = 1
+        self.n_pages = 2
+        self.generation = 0
+        # Key:   page number
+        # Value: slot of the file that has the node; 0 if it's not written
+        self.slots = array('q', [0] * self.n_pages)
+        self.n_slots = 1  # the header is slot 0
+        # slots that can be written
+        self.free = []
+        # slots left behind between the last two saves; only the save
+        #   before the last one has them
+        self.limbo = []
+        self.__init_memory()
+        self.file = open(os.path.join(directory, name), 'w+b')
+        self.__write_header()
+        self.manager = manager
+        manager.register(self)
+        self.__put(self.root, Node(True))
+
+    def __init_memory(self):
+        # Key:   page number
+        # Value: Node obj in memory
+        self.nodes = {}
+        self.dirty = set()
+        # pages written to a new slot since the last save; they're written
+        #   again in place
+        self.fresh = set()
+        # slots left behind since the last save
+        self.retired = []
+        self.n_loads = 0
+        self.n_writes = 0
+
+    def __getstate__(self):
+        """ Save the tree first, so the file matches the pickled state
+        """
+        if self.file is not None:
+            self.save()
+        return {'name': self.name, 'root': self.root,
+                'n_pages': self.n_pages, 'generation': self.generation,
+                'slots': self.slots, 'n_slots': self.n_slots,
+                'free': self.free, 'limbo': self.limbo}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__init_memory()
+        self.file = None
+        self.manager = None
+
+    def attach(self, manager, directory):
+        """ Open the file of an unpickled tree.
+        Returns:
+            False if the file is missing or isn't one the tree was saved to,
+                e.g., one of an older layout; the tree is unusable and needs
+                to be rebuilt. Saves after the one pickled are fine, since
+                they left the slots of the tree as pickled alone.
+        """
+        path = os.path.join(directory, self.name)
+        if not os.path.exists(path):
+            return False
+        self.file = open(path, 'r+b')
+        header = array('q')
+        header.frombytes(self.file.read(3 * Config.SIZE_INT))
+        if (len(header) != 3 or header[0] != MAGIC
+                or header[1] < self.generation):
+            self.file.close()
+            return False
+        self.manager = manager
+        manager.register(self)
+        return True
+
+    def close(self):
+        """ Write the dirty nodes, leave the buffer manager & close the file
+        """
+        if self.file is None:
+            return
+        self.save()
+        self.manager.unregister(self)
+        self.nodes.clear()
+        self.file.close()
+        self.file = None
+
+    def save(self):
+        """ Write the dirty nodes without evicting them & start a new
+            generation, unless nothing changed. The slots left behind before
+            the last save are freed: the last save is pickled by now, since
+            a save is only ever made to pickle the tree, i.e., by
+            self.__getstate__ or upon close.
+        """
+        with self.manager.lock:
+            if not self.dirty and not self.fresh:
+                return
+            for page in sorted(self.dirty):
+                self.__write_node(page, self.nodes[page])
+            self.dirty.clear()
+            self.fresh.clear()
+            self.free += self.limbo
+            self.limbo, self.retired = self.retired, []
+            self.generation += 1
+            self.__write_header()
+
+    def write_back(self, page):
+        """ Called by the buffer manager upon eviction of node @page
+        """
+        node = self.nodes.pop(page)
+        if page in self.dirty:
+            self.dirty.discard(page)
+            self.__write_node(page, node)
+
+    def add(self, value, rid):
+        """ Insert the pair (@value, @rid) if it's not there yet
+        """
+        split = self.__insert(self.root, (value, rid))
+        if split is not None:
+            separator, right = split
+            root = self.__new(Node(False, [separator], [self.root, right]))
+            self.root = root
+
+    def discard(self, value, rid):
+        """ Remove the pair (@value, @rid) if it's there
+        """
+        key = (value, rid)
+        page, node = self.__leaf(key)
+        i = bisect_left(node.keys, key)
+        if i < len(node.keys) and node.keys[i] == key:
+            del node.keys[i]
+            self.__put(page, node)
+
+    def get(self, value, default=None):
+        """
+        Returns:
+            List of the rids of @value; @default if there are none.
+        """
+        rids = [rid for _, rid in self.pairs(value, value)]
+        return rids if rids else default
+
+    def __getitem__(self, value):
+        rids = self.get(value)
+        if rids is None:
+            raise KeyError(value)
+        return rids
+
+    def __setitem__(self, value, rids):
+        """ Make @rids the rids of @value
+        """
+        old = self.get(value, [])
+        for rid in set(old) - set(rids):
+            self.discard(value, rid)
+        for rid in rids:
+            self.add(value, rid)
+
+    def __delitem__(self, value):
+        for rid in self[value]:
+            self.discard(value, rid)
+
+    def pairs(self, begin=None, end=None, excludemax=False):
+        """ Iterate over the (value, rid) pairs in the order of the values,
+            from @begin on until @end; all pairs if not given.
+        """
+        start = (MIN_RID if begin is None else begin, MIN_RID)
+        page, node = self.__leaf(start)
+        i = bisect_left(node.keys, start)
+        while True:
+            for value, rid in node.keys[i:]:
+                if end is not None and (
+                        value > end or excludemax and value == end):
+                    return
+                yield value, rid
+            if not node.next:
+                return
+            node, i = self.__node(node.next), 0
+
+    def items(self, begin=None, end=None, excludemax=False):
+        """ Iterate over (value, list of its rids) like IOBTree.items
+        """
+        current, rids = None, []
+        for value, rid in self.pairs(begin, end, excludemax):
+            if rids and value != current:
+                yield current, rids
+                rids = []
+            current = value
+            rids.append(rid)
+        if rids:
+            yield current, rids
+
+    def values(self, begin=None, end=None, excludemax=False):
+        for _, rids in self.items(begin, end, excludemax):
+            yield rids
+
+    def __insert(self, page, key):
+        """ Insert @key into the subtree of node @page.
+        Returns:
+            (separator, page of the new right sibling) if the node was split;
+                None otherwise.
+        """
+        node = self.__node(page)
+        if node.leaf:
+            i = bisect_left(node.keys, key)
+            if i < len(node.keys) and node.keys[i] == key:
+                return None
+            node.keys.insert(i, key)
+            if len(node.keys) <= self.MAX_LEAF:
+                self.__put(page, node)
+                return None
+            mid = len(node.keys) // 2
+            right = Node(True, node.keys[mid:], next=node.next)
+            node.keys = node.keys[:mid]
+            node.next = self.__new(right)
+            self.__put(page, node)
+            return right.keys[0], node.next
+
+        i = bisect_right(node.keys, key)
+        split = self.__insert(node.children[i], key)
+        if split is None:
+            return None
+        separator, child = split
+        node.keys.insert(i, separator)
+        node.children.insert(i + 1, child)
+        if len(node.keys) <= self.MAX_INNER:
+            self.__put(page, node)
+            return None
+        mid = len(node.keys) // 2
+        separator = node.keys[mid]
+        right = Node(False, node.keys[mid + 1:], node.children[mid + 1:])
+        node.keys = node.keys[:mid]
+        node.children = node.children[:mid + 1]
+        self.__put(page, node)
+        return separator, self.__new(right)
+
+    def __leaf(self, key):
+        """
+        Returns:
+            (page, Node obj) of the leaf where @key belongs.
+        """
+        page = self.root
+        node = self.__node(page)
+        while not node.leaf:
+            page = node.children[bisect_right(node.keys, key)]
+            node = self.__node(page)
+        return page, node
+
+    def __node(self, page):
+        """ Node @page, read from the disk if it's not in memory
+        """
+        with self.manager.lock:
+            node = self.nodes.get(page)
+            if node is None:
+                self.file.seek(self.slots[page] * self.PAGE)
+                node = Node.unpack(self.file.read(self.PAGE))
+                self.nodes[page] = node
+                self.n_loads += 1
+            self.manager.touch(self, page, self.PAGE)
+            return node
+
+    def __put(self, page, node):
+        """ Mark node @page as changed. It may have been evicted since it was
+            read, so it's put back in memory.
+        """
+        with self.manager.lock:
+            self.nodes[page] = node
+            self.dirty.add(page)
+            self.manager.touch(self, page, self.PAGE)
+
+    def __new(self, node):
+        """
+        Returns:
+            Page number of the new node @node.
+        """
+        page = self.n_pages
+        self.n_pages += 1
+        self.slots.append(0)
+        self.__put(page, node)
+        return page
+
+    def __write_node(self, page, node):
+        """ Write node @page to its slot, or to a new one if its slot is
+            part of the last save
+        """
+        if page not in self.fresh:
+            if self.slots[page]:
+                self.retired.append(self.slots[page])
+            if self.free:
+                self.slots[page] = self.free.pop()
+            else:
+                self.slots[page] = self.n_slots
+                self.n_slots += 1
+            self.fresh.add(page)
+        self.file.seek(self.slots[page] * self.PAGE)
+        self.file.write(node.pack(self.PAGE))
+        self.n_writes += 1
+
+    def __write_header(self):
+        header = array('q', [MAGIC, self.generation, self.n_slots])
+        self.file.seek(0)
+        self.file.write(header.tobytes())
+        self.file.flush()
@@ -1,111 +1,654 @@
+import queue
 import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
+from lstore.config import Config
 from lstore.partition import Partition
 import os
 import pickle
 
 
-# TODO:
-#   mark dirty and add
+def dump_atomic(obj, path):
+    """ Pickle @obj to @path such that a crash leaves either the old or the
+        new file, never a partial one.
+    Returns:
+        Number of bytes written
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(obj, f)
+        size = f.tell()
+    os.replace(tmp, path)
+    return size
+
+
+class BufferManager:
+    """ Buffer manager shared by the Bufferpools of all tables in a Database.
+
+    Every partition in memory, no matter which table it belongs to, is charged
+    against one memory budget in bytes. When the budget is reached, a victim
+    is picked across table boundaries by global recency and frequency:
+    the least recently used partitions are looked at first, and the least
+    frequently used among them is evicted. Partitions that are passed over get
+    their frequency halved so that old hot partitions eventually age out.
+
+    A Bufferpool can optionally be registered with a quota in bytes. A table
+    over its quota evicts its own partitions first before taking memory from
+    the others.
+
+    Pinned partitions are never evicted; see Bufferpool.pin.
+    """
+
+    def __init__(self, budget=Config.SIZE_BUFFER):
+        """
+        Arguments:
+            - budget: int
+                Memory budget in bytes of all the partitions in memory.
+        """
+        self.BUDGET = budget
+        # Reentrant since evicting from a bufferpool calls back into the
+        #   manager.
+        self.lock = threading.RLock()
+
+        # Key:   (Bufferpool obj, idx_part)
+        # Value: access frequency
+        # Sorted from least to most recently used
+        self.LRU = OrderedDict()
+        # Key:   (Bufferpool obj, idx_part)
+        # Value: size of the partition in bytes when it was last accessed
+        self.sizes = {}
+        self.used = 0  # bytes used by all partitions in memory
+
+        # Key:   Bufferpool obj
+        # Value: quota in bytes; None for no quota
+        self.quotas = {}
+        # Key:   Bufferpool obj
+        # Value: bytes used by the partitions of that bufferpool
+        self.usage = {}
+        # Key:   (Bufferpool obj, idx_part)
+        # Value: number of times the partition is pinned
+        self.pins = {}
+        # notified whenever a partition gets unpinned for good
+        self.unpinned = threading.Condition(self.lock)
+
+    def register(self, pool, quota=None):
+        """ Register @pool to share this buffer manager.
+        Arguments:
+            - pool: Bufferpool
+                Bufferpool of a table.
+            - quota: int
+                Optional max number of bytes that @pool can keep in memory.
+        """
+        with self.lock:
+            self.quotas[pool] = quota
+            self.usage.setdefault(pool, 0)
+
+    def unregister(self, pool):
+        """ Forget about @pool without writing its partitions back.
+        """
+        with self.lock:
+            for key in [k for k in self.LRU if k[0] is pool]:
+                self.__forget(key)
+            self.quotas.pop(pool, None)
+            self.usage.pop(pool, None)
+
+    def discard(self, pool, idx_part):
+        """ Forget about partition @idx_part of @pool without writing it back.
+        """
+        with self.lock:
+            if (pool, idx_part) in self.LRU:
+                self.__forget((pool, idx_part))
+
+    def pin(self, pool, idx_part):
+        """ Keep partition @idx_part of @pool in memory until unpin()
+        """
+        with self.lock:
+            key = (pool, idx_part)
+            self.pins[key] = self.pins.get(key, 0) + 1
+
+    def unpin(self, pool, idx_part):
+        with self.lock:
+            key = (pool, idx_part)
+            self.pins[key] -= 1
+            if not self.pins[key]:
+                del self.pins[key]
+                self.unpinned.notify_all()
+
+    def headroom(self):
+        """
+        Returns:
+            Bytes of the budget that aren't pinned, i.e., that new partitions
+                can take by evicting others; negative if more than the budget
+                is pinned.
+        """
+        with self.lock:
+            pinned = sum(self.sizes.get(key, 0) for key in self.pins)
+            return self.BUDGET - pinned
+
+    def touch(self, pool, idx_part, size):
+        """ Mark partition @idx_part of @pool as just used, and charge @size
+            bytes for it. Partitions are evicted if the budget or the quota of
+            @pool is exceeded.
+        Returns:
+            True if the partition was already in memory; False if it was not
+              and the caller needs to load it.
+        """
+        with self.lock:
+            key = (pool, idx_part)
+            hit = key in self.LRU
+            if hit:
+                self.LRU[key] += 1
+                self.LRU.move_to_end(key)
+                self.__charge(key, size - self.sizes[key])
+            else:
+                self.LRU[key] = 1
+                self.sizes[key] = 0
+                self.__charge(key, size)
+            self.__make_room(pool, keep=key)
+            return hit
+
+    def evict(self, pool=None):
+        """ Evict one partition picked by recency and frequency, optionally
+            only among the partitions of @pool.
+        Returns:
+            False if there was nothing to evict.
+        """
+        with self.lock:
+            key = self.__victim(pool)
+            if key is None:
+                return False
+            self.__forget(key)
+            key[0].write_back(key[1])
+            return True
+
+    def flush(self, pool=None):
+        """ Evict all partitions, or only those of @pool, from memory.
+            Waits until none of them is pinned, so must not be called while
+            holding a pin.
+        """
+        with self.lock:
+            while any(pool is None or key[0] is pool for key in self.pins):
+                self.unpinned.wait()
+            while self.evict(pool):
+                pass
+
+    def __make_room(self, pool, keep):
+        """ Evict until both the quota of @pool and the global budget are
+            respected. The partition @keep is never evicted.
+        """
+        quota = self.quotas.get(pool)
+        while quota is not None and self.usage[pool] > quota:
+            key = self.__victim(pool, keep)
+            if key is None:
+                break
+            self.__forget(key)
+            key[0].write_back(key[1])
+
+        while self.used > self.BUDGET:
+            key = self.__victim(None, keep)
+            if key is None:
+                break
+            self.__forget(key)
+            key[0].write_back(key[1])
+
+    def __victim(self, pool=None, keep=None):
+        """ Among the Config.EVICT_WINDOW least recently used candidates, pick
+            the least frequently used one. Candidates passed over are aged.
+        """
+        window = []
+        for key in self.LRU:
+            if key == keep or key in self.pins or (
+                    pool is not None and key[0] is not pool):
+                continue
+            window.append(key)
+            if len(window) == Config.EVICT_WINDOW:
+                break
+        if not window:
+            return None
+
+        victim = min(window, key=lambda k: self.LRU[k])
+        for key in window:
+            if key != victim:
+                self.LRU[key] >>= 1
+        return victim
+
+    def __charge(self, key, size):
+        self.sizes[key] += size
+        self.usage[key[0]] = self.usage.get(key[0], 0) + size
+        self.used += size
+
+    def __forget(self, key):
+        self.__charge(key, -self.sizes[key])
+        del self.LRU[key]
+        del self.sizes[key]
+
 
 class Bufferpool:
-    def __init__(self, size, n_cols, key_column, path):
+    def __init__(self, manager, n_cols, key_column, path, quota=None,
+                 max_records=Config.MAX_RECORDS, sparse_tails=False,
+                 cumulative=True):
+        """
+        Arguments:
+            - manager: BufferManager
+                Buffer manager that decides which partitions stay in memory.
+                It's usually shared by all tables in the Database.
+            - n_cols: int
+                Number of columns INCLUDING meta-columns & user columns
+            - key_column: int
+                Index of the column that has the keys.
+            - path: str
+                Path of the table on the disk.
+            - quota: int
+                Optional max number of bytes of this table in memory.
+            - max_records: int
+                Number of records per page of the partitions.
+            - sparse_tails: bool
+                Tail layout of the partitions; see Partition.
+            - cumulative: bool
+                Whether tail records are cumulative; see Partition.
+        """
         self.PATH = path  # path of the table
-        self.MAX_PARTITIONS = size
         self.N_TOTAL_COLS = n_cols
         self.COL_KEY = key_column
-        self.__lock = threading.Lock()
+        self.MAX_RECORDS = max_records
+        self.SPARSE_TAILS = sparse_tails
+        self.CUMULATIVE = cumulative
+        self.manager = manager
         # Vals:
         #    - Partition obj: partition is in bufferpool
         #    - None: partition on disk
-        # EX: MAX_PARTITIONS = 2
-        # [None, None, Partition obj, Partition obj, None]
+        # EX: [None, None, Partition obj, Partition obj, None]
         self.partitions = []
+        self.manager.register(self, quota)
+        # number of partitions read from & written to the disk
+        self.n_loads = 0
+        self.n_writes = 0
+        self.n_bytes_written = 0
+        self.n_prefetched = 0
+
+        # Prefetching:
+        # Key:   index of a partition being loaded by the I/O thread
+        # Value: threading.Event set once it's done
+        self.loading = {}
+        # Key:   index of a partition
+        # Value: number of times it has been written to the disk; a prefetch
+        #        that raced with a write is dropped
+        self.versions = {}
+        self.__io_queue = None  # started upon the first prefetch
+
+        # Every write of a partition to the disk gets the next sequence number
+        #   and is logged to this file as "seq idx_part", so that recovery
+        #   knows which partitions changed after a checkpoint.
+        self.PATH_WRITES = os.path.join(path, 'writes')
+        self.seq = 0
+        # Key:   index of a partition on the disk
+        # Value: Partition.summary() as of when it left memory; partitions
+        #        in memory are asked directly
+        self.PATH_ZONES = os.path.join(path, 'zones')
+        self.summaries = {}
+        # for sequential access detection
+        self.__last_access = None
+        self.__n_sequential = 0
+        # partitions before this one have already been prefetched
+        self.__readahead_to = 0
 
-        # index of the partitions in the buffer sorted by least recently used
-        # This is the core of tracking what partitions are in the BP
-        # Max Length = MAX_PARTITIONS
-        # EX: means partition 3 was least recently used
-        # [3, 2]
-        self.LRU = []
-        # TODO: implmenet PIN PAGE
-        self.pin_pages = {}
         # if cannot find the table on disk; initialize one
         if not os.path.exists(path):
             os.makedirs(path)
             self.new_partition()
         # table files found, initialize self.partitions
         else:
-            self.partitions = [None] * len(os.listdir(self.PATH))
+            # partition files are named by their index; ignore index, meta,
+            #   etc.
+            on_disk = {int(f) for f in os.listdir(self.PATH) if f.isdigit()}
+            n_parts = max(on_disk) + 1 if on_disk else 0
+            self.partitions = [None] * n_parts
+            # a partition created after the last checkpoint that never made
+            #   it to the disk before a crash; its records are lost
+            for idx_part in range(n_parts):
+                if idx_part not in on_disk:
+                    p = self.make_partition()
+                    self.partitions[idx_part] = p
+                    self.manager.touch(self, idx_part, p.size())
+            writes = self.__read_writes()
+            if writes:
+                self.seq = writes[-1][0]
+            if os.path.exists(self.PATH_ZONES):
+                with open(self.PATH_ZONES, 'rb') as f:
+                    self.summaries = pickle.load(f)
+            # crashed before any partition made it to the disk
+            if n_parts == 0:
+                self.new_partition()
 
     def __getitem__(self, idx_part):
         """ Return the partition with index @idx_part
             If partition not in BP
-                partition will be added to buffer pool
-            if partition is in
-                idx_part in LRU move to the end
-            X LRU
-            X dirty[idx]
-            X Partitions[idx]
-        """
-        with self.__lock:
-            # print(self.LRU, self.partitions)
-            # convert negative index to non neg
+                partition will be loaded from the disk, or waited for if it's
+                being prefetched
+            The file is read outside of the lock of the buffer manager, so
+                that a miss doesn't hold up the other tables; other readers of
+                the partition wait for it like for a prefetch.
+            The buffer manager is told about the access either way, which may
+                evict partitions of this or other tables.
+            After Config.READAHEAD_TRIGGER accesses in a row to consecutive
+                partitions, the ones up to Config.READAHEAD ahead are
+                prefetched; the next window is requested once half of the
+                last one has been read.
+        """
+        while True:
+            with self.manager.lock:
+                # convert negative index to non neg
+                if idx_part < 0:
+                    idx_part += len(self.partitions)
+                # trying to access a partition that doesn't exist
+                if idx_part >= len(self.partitions):
+                    raise IndexError
+
+                p = self.partitions[idx_part]
+                if p is not None:
+                    self.manager.touch(self, idx_part, p.size())
+                    self.__detect_sequential(idx_part)
+                    return p
+                loading = self.loading.get(idx_part)
+                if loading is None:
+                    self.loading[idx_part] = threading.Event()
+                    version = self.versions.get(idx_part, 0)
+            if loading is not None:
+                # the I/O thread or another reader is on it; wait outside of
+                #   the lock, then look again
+                loading.wait()
+                continue
+            try:
+                path = os.path.join(self.PATH, str(idx_part))
+                with open(path, 'rb') as f:
+                    p = pickle.load(f)
+            except BaseException:
+                with self.manager.lock:
+                    self.loading.pop(idx_part).set()
+                raise
+            with self.manager.lock:
+                try:
+                    # dropped if the partition was written in the meantime;
+                    #   look again
+                    if (idx_part < len(self.partitions)
+                            and self.partitions[idx_part] is None
+                            and self.versions.get(idx_part, 0) == version):
+                        self.partitions[idx_part] = p
+                        self.n_loads += 1
+                finally:
+                    self.loading.pop(idx_part).set()
+
+    def pin(self, idx_part):
+        """ Fetch partition @idx_part like self[idx_part] & keep it in memory
+            until unpin(), so that a batch of work on it neither looks it up
+            again nor has it written back halfway.
+        Arguments:
+            - idx_part: int
+                Index of the partition; must not be negative, since the pin
+                is kept by index.
+        Returns:
+            The Partition obj.
+        """
+        while True:
+            p = self[idx_part]
+            with self.manager.lock:
+                # evicted again before it got pinned
+                if self.partitions[idx_part] is p:
+                    self.manager.pin(self, idx_part)
+                    return p
+
+    def unpin(self, idx_part):
+        self.manager.unpin(self, idx_part)
+
+    @contextmanager
+    def pinned(self, idx_part):
+        """ Context manager that pins partition @idx_part for the duration of
+            a write, so that the write isn't made to a partition the buffer
+            manager already wrote back & dropped. Negative indices count from
+            the end as of the call.
+        Yields:
+            The Partition obj.
+        """
+        with self.manager.lock:
             if idx_part < 0:
                 idx_part += len(self.partitions)
-            # trying to access a partition that doesn't exist
-            if idx_part >= len(self.partitions):
-                raise IndexError
-            # If already in the LRU array, move it to the end
-            # Don't need to care about limit since we are not adding things here
-            if idx_part in self.LRU:
-                self.LRU.remove(idx_part)
-                self.LRU.append(idx_part)
-                assert(len(self.LRU) <= self.MAX_PARTITIONS)
-            # not in the LRU, load from the disk
-            else:
-                # if buffer limit reached, evict
-                if len(self.LRU) == self.MAX_PARTITIONS:
-                    self.__evict()
-                # buffer has space now, just append to the end
-                self.LRU.append(idx_part)
-                with open(os.path.join(self.PATH, str(idx_part)), 'rb') as f:
-                    self.partitions[idx_part] = pickle.load(f)
+        p = self.pin(idx_part)
+        try:
+            yield p
+        finally:
+            self.unpin(idx_part)
+
+    def prefetch(self, partition_ids):
+        """ Load the partitions @partition_ids in the background. Partitions
+            that are already in memory or on their way are skipped.
+        Arguments:
+            - partition_ids: iterable
+                Indices of the partitions, in the order they'll be needed.
+        """
+        with self.manager.lock:
+            todo = []
+            for idx_part in partition_ids:
+                if idx_part < 0:
+                    idx_part += len(self.partitions)
+                if (0 <= idx_part < len(self.partitions)
+                        and self.partitions[idx_part] is None
+                        and idx_part not in self.loading):
+                    self.loading[idx_part] = threading.Event()
+                    todo.append(idx_part)
+            if todo and self.__io_queue is None:
+                self.__io_queue = queue.Queue()
+                threading.Thread(target=self.__io_loop,
+                                 args=(self.__io_queue,),
+                                 name='prefetch %s' % self.PATH,
+                                 daemon=True).start()
+            io_queue = self.__io_queue
+        for idx_part in todo:
+            io_queue.put(idx_part)
+
+    def close(self):
+        """ Stop the I/O thread once it's done with the partitions already
+            requested; a later prefetch starts a new one.
+        """
+        with self.manager.lock:
+            io_queue, self.__io_queue = self.__io_queue, None
+        if io_queue is not None:
+            io_queue.put(None)
 
-            return self.partitions[idx_part]
+    def __io_loop(self, io_queue):
+        """ Body of the I/O thread: read the partition files outside of the
+            lock, then hand them over to the buffer manager. Stops upon None.
+        """
+        while True:
+            idx_part = io_queue.get()
+            if idx_part is None:
+                return
+            with self.manager.lock:
+                version = self.versions.get(idx_part, 0)
+            p = None
+            try:
+                path = os.path.join(self.PATH, str(idx_part))
+                with open(path, 'rb') as f:
+                    p = pickle.load(f)
+            except Exception:
+                # e.g., a truncated file; the readers waiting on it load it
+                #   themselves and get the error
+                pass
+            with self.manager.lock:
+                try:
+                    if (p is not None
+                            and idx_part < len(self.partitions)
+                            and self.partitions[idx_part] is None
+                            and self.versions.get(idx_part, 0) == version):
+                        self.partitions[idx_part] = p
+                        self.n_loads += 1
+                        self.n_prefetched += 1
+                        self.manager.touch(self, idx_part, p.size())
+                finally:
+                    self.loading.pop(idx_part).set()
+
+    def __detect_sequential(self, idx_part):
+        if self.__last_access is not None:
+            if idx_part == self.__last_access + 1:
+                self.__n_sequential += 1
+            elif idx_part != self.__last_access:
+                self.__n_sequential = 0
+                self.__readahead_to = 0
+        self.__last_access = idx_part
+        if self.__n_sequential < Config.READAHEAD_TRIGGER:
+            return
+        # the next window is requested once half of the last one is read
+        if self.__readahead_to - idx_part <= Config.READAHEAD // 2:
+            end = idx_part + 1 + Config.READAHEAD
+            self.prefetch(range(max(idx_part + 1, self.__readahead_to), end))
+            self.__readahead_to = end
+
+    def summary(self, idx_part):
+        """ Summary of partition @idx_part without loading it
+        Returns:
+            See Partition.summary; None if unknown.
+        """
+        with self.manager.lock:
+            p = self.partitions[idx_part]
+            if p is not None:
+                return p.summary()
+            return self.summaries.get(idx_part)
+
+    def may_hold(self, idx_part, column, begin, end):
+        """ Whether partition @idx_part may have live records whose values in
+            @column (INCLUDING meta-cols) are between @begin and @end (both
+            inclusive) according to its zone map. Never loads the partition.
+        """
+        summary = self.summary(idx_part)
+        if summary is None:
+            return True
+        if summary['n_records'] == summary['n_deleted']:
+            return False
+        zone = summary['zones'][column - Config.N_META_COLS]
+        return zone is not None and zone[0] <= end and zone[1] >= begin
 
     def new_partition(self):
         """ Add a new partition to the DB. New partition will be added to the
-        BP and marked as dirty. If BP's limit is reached, the LRU partition
-        will be evicted.
+        BP and marked as dirty. If the budget is reached, partitions will be
+        evicted by the buffer manager.
+        """
+        with self.manager.lock:
+            idx_part = len(self.partitions)
+            p = self.make_partition()
+            self.partitions.append(p)
+            self.manager.touch(self, idx_part, p.size())
+
+    def make_partition(self):
+        """
+        Returns:
+            A new empty Partition obj with the layout of this table; it's not
+                added to the bufferpool.
+        """
+        return Partition(n_cols=self.N_TOTAL_COLS, key_column=self.COL_KEY,
+                         max_records=self.MAX_RECORDS,
+                         sparse_tails=self.SPARSE_TAILS,
+                         cumulative=self.CUMULATIVE)
+
+    def replace(self, idx_part, partition):
+        """ Put @partition at @idx_part in place of the current one, which is
+            dropped without being written back. @partition is written to the
+            disk upon eviction.
         """
-        idx_part = len(self.partitions)
+        with self.manager.lock:
+            partition.set_dirty()
+            self.partitions[idx_part] = partition
+            self.summaries.pop(idx_part, None)
+            self.manager.touch(self, idx_part, partition.size())
 
-        # It is definitely not in the LRU, no need to check
-        # if buffer limit reached, evict
-        if len(self.LRU) == self.MAX_PARTITIONS:
-            self.__evict()
-        self.LRU.append(idx_part)
-        # Now BP has space, add the new partition
-        self.partitions.append(
-            Partition(n_cols=self.N_TOTAL_COLS, key_column=self.COL_KEY))
+    def truncate(self, n_parts):
+        """ Drop all partitions from index @n_parts on, both from memory and
+            the disk.
+        """
+        with self.manager.lock:
+            for idx_part in range(n_parts, len(self.partitions)):
+                self.manager.discard(self, idx_part)
+                path = os.path.join(self.PATH, str(idx_part))
+                if os.path.exists(path):
+                    os.remove(path)
+                self.summaries.pop(idx_part, None)
+            del self.partitions[n_parts:]
 
     def flush(self):
-        while len(self.LRU) > 0:
-            self.__evict()
+        self.manager.flush(self)
 
-    def __evict(self):
-        """ Evict the LRU partition.
-            - idx = LRU[0] is removed;
+    def write_back(self, idx_evict):
+        """ Called by the buffer manager upon eviction of @idx_evict.
             - partitions[idx] is marked as clean
                 - write to disk if dirty
             - partitions[idx] will be replaced with None
         """
-        idx_evict = self.LRU.pop(0)
         if self.partitions[idx_evict].is_dirty():
             self.partitions[idx_evict].merge()
-            self.partitions[idx_evict].set_clean()
             # it's dirty; # write to disk
-            with open(os.path.join(self.PATH, str(idx_evict)), 'wb') as f:
-                pickle.dump(self.partitions[idx_evict], f)
+            self.__write(idx_evict)
+        self.summaries[idx_evict] = self.partitions[idx_evict].summary()
         self.partitions[idx_evict] = None
+
+    def checkpoint(self):
+        """ Write all dirty partitions in memory to the disk without evicting
+            them. Tail records are kept as they are, so readers running at the
+            same time aren't affected.
+        """
+        with self.manager.lock:
+            for idx_part, p in enumerate(self.partitions):
+                if p is not None and p.is_dirty():
+                    self.__write(idx_part)
+            summaries = {
+                idx_part: self.summary(idx_part)
+                for idx_part in range(len(self.partitions))
+            }
+        # zone maps are only ever wider than the partitions on the disk, or
+        #   the partitions are read again upon recovery
+        dump_atomic(summaries, self.PATH_ZONES)
+
+    def writes_since(self, seq):
+        """
+        Returns:
+            Set of the indices of the partitions written to the disk after the
+                sequence number @seq.
+        """
+        return {idx_part for s, idx_part in self.__read_writes() if s > seq}
+
+    def trim_writes(self, seq):
+        """ Forget about the writes up to the sequence number @seq
+        """
+        with self.manager.lock:
+            writes = [(s, idx) for s, idx in self.__read_writes() if s > seq]
+            tmp = self.PATH_WRITES + '.tmp'
+            with open(tmp, 'w') as f:
+                f.writelines('%d %d\n' % w for w in writes)
+            os.replace(tmp, self.PATH_WRITES)
+
+    def __write(self, idx_part):
+        """ Write partition @idx_part to the disk & log the write. Queries
+            write to partitions without the lock of the buffer manager, so
+            the partition is latched to keep their writes out of the file
+            until they're done.
+        """
+        p = self.partitions[idx_part]
+        path = os.path.join(self.PATH, str(idx_part))
+        with p.latch:
+            p.set_clean()
+            self.n_bytes_written += dump_atomic(p, path)
+        self.n_writes += 1
+        self.versions[idx_part] = self.versions.get(idx_part, 0) + 1
+        self.seq += 1
+        with open(self.PATH_WRITES, 'a') as f:
+            f.write('%d %d\n' % (self.seq, idx_part))
+
+    def __read_writes(self):
+        """
+        Returns:
+            List of (seq, idx_part) in the log of writes.
+        """
+        if not os.path.exists(self.PATH_WRITES):
+            return []
+        with open(self.PATH_WRITES) as f:
+            # a crash can leave the last line incomplete
+            lines = [line.split() for line in f if line.endswith('\n')]
+        return [(int(s), int(idx)) for s, idx in lines]
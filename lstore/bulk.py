@@ -0,0 +1,214 @@
+""" Streaming import & export of tables to flat files:
+    - CSV: a record per line, with an int for each user column
+    - raw columns: a file per user column, with the values as little-endian
+        int64 one after another
+Files are processed a chunk of Config.BULK_CHUNK records at a time, so the
+memory used doesn't grow with the size of the files. Records are inserted
+with Table.insert_columns & read with Table.iter_columns, never one by one.
+"""
+from array import array
+from collections import deque
+from itertools import islice
+import csv
+import io
+import sys
+
+from lstore.config import Config
+from lstore.parallel import executor
+
+
+def parse_csv(text, n_cols):
+    """ Parse the lines of CSV @text, each with @n_cols ints. Module-level so
+        that it can be sent to the process pool.
+    Returns:
+        List with an array of the values of each column.
+    """
+    columns = [array('q') for _ in range(n_cols)]
+    for row in csv.reader(io.StringIO(text)):
+        if not row:
+            continue
+        if len(row) != n_cols:
+            raise ValueError('expected %d fields, got %r' % (n_cols, row))
+        for values, field in zip(columns, row):
+            values.append(int(field))
+    return columns
+
+
+def format_csv(columns):
+    """ Inverse of parse_csv
+    """
+    rows = zip(*[map(str, values) for values in columns])
+    return ''.join(','.join(row) + '\n' for row in rows)
+
+
+def csv_width(path, header=False):
+    """
+    Returns:
+        Number of fields of the first record of the CSV file @path.
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        if header:
+            next(reader, None)
+        for row in reader:
+            if row:
+                return len(row)
+    raise ValueError('no records in %s' % path)
+
+
+def import_csv(table, path, header=False, parallel=False, progress=None,
+               chunk_size=Config.BULK_CHUNK):
+    """ Insert the records of the CSV file @path into @table.
+    Arguments:
+        - header: bool
+            Skip the first line.
+        - parallel: bool
+            Parse the chunks in the process pool while this process inserts.
+        - progress: function
+            Called with the number of records inserted so far after every
+                chunk.
+        - chunk_size: int
+            Number of lines per chunk.
+    Returns:
+        Number of records inserted.
+    """
+    def chunks():
+        with open(path, newline='') as f:
+            if header:
+                next(f, None)
+            while True:
+                lines = list(islice(f, chunk_size))
+                if not lines:
+                    return
+                yield ''.join(lines)
+
+    n_cols = table.num_columns
+    parsed = _map(parse_csv, chunks(), parallel, n_cols)
+    return _insert(table, parsed, progress)
+
+
+def import_columns(table, paths, progress=None, chunk_size=Config.BULK_CHUNK):
+    """ Insert the records in the raw column files @paths, one per user
+        column of @table, into it.
+    Arguments:
+        - progress: function
+            Called with the number of records inserted so far after every
+                chunk.
+        - chunk_size: int
+            Number of records per chunk.
+    Returns:
+        Number of records inserted.
+    """
+    if len(paths) != table.num_columns:
+        raise ValueError('expected %d column files' % table.num_columns)
+
+    def chunks():
+        files = [open(path, 'rb') for path in paths]
+        try:
+            while True:
+                columns = []
+                for f in files:
+                    values = array('q')
+                    values.frombytes(f.read(chunk_size * Config.SIZE_INT))
+                    if sys.byteorder == 'big':
+                        values.byteswap()
+                    columns.append(values)
+                if not columns[0]:
+                    return
+                yield columns
+        finally:
+            for f in files:
+                f.close()
+
+    return _insert(table, chunks(), progress)
+
+
+def export_csv(table, path, query_columns=None, parallel=False,
+               progress=None):
+    """ Write the live records of @table to the CSV file @path, a partition
+        at a time.
+    Arguments:
+        - query_columns: list
+            List of boolean values for the columns to write; all if None.
+        - parallel: bool
+            Format the partitions in the process pool while this process
+                reads the next ones.
+        - progress: function
+            Called with the number of records written so far after every
+                partition.
+    Returns:
+        Number of records written.
+    """
+    if query_columns is None:
+        query_columns = [1] * table.num_columns
+    n_records = 0
+    with open(path, 'w', newline='') as f:
+        for n, text in _map(_format, table.iter_columns(query_columns),
+                            parallel):
+            f.write(text)
+            n_records += n
+            if progress is not None:
+                progress(n_records)
+    return n_records
+
+
+def export_columns(table, paths, progress=None):
+    """ Write every user column of the live records of @table to a raw column
+        file in @paths, a partition at a time.
+    Arguments:
+        - progress: function
+            Called with the number of records written so far after every
+                partition.
+    Returns:
+        Number of records written.
+    """
+    if len(paths) != table.num_columns:
+        raise ValueError('expected %d column files' % table.num_columns)
+    n_records = 0
+    files = [open(path, 'wb') for path in paths]
+    try:
+        for columns in table.iter_columns([1] * table.num_columns):
+            for f, values in zip(files, columns):
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                f.write(values.tobytes())
+            n_records += len(columns[0])
+            if progress is not None:
+                progress(n_records)
+    finally:
+        for f in files:
+            f.close()
+    return n_records
+
+
+def _format(columns):
+    """ (number of records, @columns formatted as CSV)
+    """
+    return len(columns[0]) if columns else 0, format_csv(columns)
+
+
+def _insert(table, chunks, progress):
+    n_records = 0
+    for columns in chunks:
+        n_records += table.insert_columns(columns)
+        if progress is not None:
+            progress(n_records)
+    return n_records
+
+
+def _map(func, items, parallel, *args):
+    """ Iterate over @func(item, *args) for @items in order. If @parallel,
+        they're computed by the process pool with at most Config.BULK_WINDOW
+        of them in flight, which bounds the memory used.
+    """
+    if not parallel:
+        for item in items:
+            yield func(item, *args)
+        return
+    window = deque()
+    for item in items:
+        window.append(executor().submit(func, item, *args))
+        if len(window) >= Config.BULK_WINDOW:
+            yield window.popleft().result()
+    while window:
+        yield window.popleft().result()
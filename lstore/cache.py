@@ -0,0 +1,151 @@
+from collections import OrderedDict
+import threading
+
+from lstore.config import Config
+
+
+class FrequencySketch:
+    """ Count-min sketch of how often keys were asked for. Counters are halved
+        every time @sample_size keys have been counted, so old popularity
+        fades away.
+    """
+    DEPTH = 4
+
+    def __init__(self, width, sample_size):
+        self.width = max(width, 16)
+        self.sample_size = sample_size
+        self.rows = [[0] * self.width for _ in range(self.DEPTH)]
+        self.n_counted = 0
+
+    def increment(self, key):
+        for i, row in enumerate(self.rows):
+            row[hash((i, key)) % self.width] += 1
+        self.n_counted += 1
+        if self.n_counted >= self.sample_size:
+            for row in self.rows:
+                row[:] = [c >> 1 for c in row]
+            self.n_counted //= 2
+
+    def estimate(self, key):
+        return min(
+            row[hash((i, key)) % self.width] for i, row in enumerate(self.rows)
+        )
+
+
+class RecordCache:
+    """ Bounded cache of fully resolved records, i.e., the values that
+        Partition.read returns, so a hot key is served by a dict lookup
+        instead of a trip through the bufferpool & the tail records.
+
+    Key:   (rid, query_columns as a tuple)
+    Value: tuple of the values read
+
+    Eviction is LRU with TinyLFU admission: once the cache is full, a new
+      entry only gets in if it has been asked for more often than the least
+      recently used entry that it would replace. A scan of cold records thus
+      doesn't flush the hot ones.
+
+    Writes call invalidate(rid), which drops every entry of the record. A
+      read racing with a write can't put a stale value back: put() is given
+      the generation of the record taken before the read, and is ignored if
+      the record was invalidated in the meantime.
+    """
+    # number of generation counters; records share them modulo this number
+    N_GENERATIONS = 4096
+
+    def __init__(self, capacity=Config.CACHE_RECORDS):
+        """
+        Arguments:
+            - capacity: int
+                Max number of entries.
+        """
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # Key:   rid
+        # Value: set of the keys of its entries
+        self.by_rid = {}
+        self.sketch = FrequencySketch(capacity * 4, capacity * 10)
+        self.generations = [0] * self.N_GENERATIONS
+        self.hits = 0
+        self.misses = 0
+        self.n_evictions = 0
+        self.n_rejected = 0
+
+    def generation(self, rid):
+        """ Take before reading record @rid; pass on to put()
+        """
+        return self.generations[rid % self.N_GENERATIONS]
+
+    def get(self, rid, query_columns):
+        """
+        Returns:
+            The cached values of @query_columns of @rid; None on a miss.
+        """
+        key = (rid, query_columns)
+        with self.lock:
+            self.sketch.increment(key)
+            vals = self.entries.get(key)
+            if vals is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return vals
+
+    def put(self, rid, query_columns, vals, generation):
+        """ Cache @vals read for @query_columns of @rid, unless the record got
+            invalidated since @generation was taken.
+        """
+        key = (rid, query_columns)
+        with self.lock:
+            if self.generation(rid) != generation or key in self.entries:
+                return
+            if len(self.entries) >= self.capacity:
+                victim = next(iter(self.entries))
+                if self.sketch.estimate(key) <= self.sketch.estimate(victim):
+                    self.n_rejected += 1
+                    return
+                self.__remove(victim)
+                self.n_evictions += 1
+            self.entries[key] = tuple(vals)
+            self.by_rid.setdefault(rid, set()).add(key)
+
+    def invalidate(self, rids):
+        """ Drop all entries of the records @rids
+        """
+        with self.lock:
+            for rid in rids:
+                self.generations[rid % self.N_GENERATIONS] += 1
+                for key in self.by_rid.pop(rid, ()):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.generations = [g + 1 for g in self.generations]
+            self.entries.clear()
+            self.by_rid.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict with the number of 'hits', 'misses', 'evictions', entries
+                'rejected' by admission, current 'size', & the 'hit_rate'.
+        """
+        with self.lock:
+            n = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.n_evictions,
+                'rejected': self.n_rejected,
+                'size': len(self.entries),
+                'hit_rate': self.hits / n if n else 0.0,
+            }
+
+    def __remove(self, key):
+        del self.entries[key]
+        keys = self.by_rid[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.by_rid[key[0]]
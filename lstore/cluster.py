@@ -0,0 +1,84 @@
+from bisect import bisect_left, bisect_right
+
+
+class KeyDirectory:
+    """ Partition-level key directory of a clustered table.
+
+    Each partition owns a range of keys: partition parts[i] owns the keys in
+      [bounds[i], bounds[i+1]). New records are placed in the partition that
+      owns their key, and a full partition is split into two at the median
+      key.
+    Ex: bounds = [0, 500, 900], parts = [0, 2, 1]
+        Keys 0-499 go to partition 0, 500-899 to 2, and 900+ to 1.
+
+    Independently of ownership, ranges keeps the smallest & largest key that
+      each partition actually holds (updates of the key column can take a
+      record out of its owned range). Range queries prune partitions with it.
+    """
+
+    def __init__(self):
+        self.bounds = [0]
+        self.parts = [0]
+        # Key:   index of a partition
+        # Value: [smallest key, largest key] in the partition
+        self.ranges = {}
+
+    def route(self, key):
+        """
+        Returns:
+            Index of the partition that owns @key
+        """
+        return self.parts[bisect_right(self.bounds, key) - 1]
+
+    def cover(self, idx_part, key):
+        """ Extend the range of partition @idx_part to include @key
+        """
+        lo_hi = self.ranges.get(idx_part)
+        if lo_hi is None:
+            self.ranges[idx_part] = [key, key]
+        elif key < lo_hi[0]:
+            lo_hi[0] = key
+        elif key > lo_hi[1]:
+            lo_hi[1] = key
+
+    def set_range(self, idx_part, keys):
+        """ Set the range of partition @idx_part to the one of @keys
+        """
+        if keys:
+            self.ranges[idx_part] = [min(keys), max(keys)]
+        else:
+            self.ranges.pop(idx_part, None)
+
+    def split(self, idx_part, split_key, new_part):
+        """ Partition @new_part takes over the keys from @split_key on that
+            were owned by @idx_part.
+        """
+        i = bisect_right(self.bounds, split_key)
+        assert self.parts[i - 1] == idx_part
+        self.bounds.insert(i, split_key)
+        self.parts.insert(i, new_part)
+
+    def add(self, idx_part, keys):
+        """ Register partition @idx_part, which isn't in the directory yet, as
+            the owner from the smallest of @keys on. Used upon recovery for
+            partitions that were split off after the last checkpoint.
+        """
+        if idx_part in self.parts or not keys:
+            return
+        i = bisect_left(self.bounds, min(keys))
+        if i < len(self.bounds) and self.bounds[i] == min(keys):
+            self.parts[i] = idx_part
+        else:
+            self.bounds.insert(i, min(keys))
+            self.parts.insert(i, idx_part)
+
+    def partitions(self, begin, end):
+        """
+        Returns:
+            Sorted indices of the partitions that may hold keys between
+                @begin and @end (both inclusive).
+        """
+        return sorted(
+            idx_part for idx_part, (lo, hi) in self.ranges.items()
+            if lo <= end and hi >= begin
+        )
@@ -10,12 +10,45 @@ class Config:
     COL_ENC = 3
     N_META_COLS = 4
     MARK_1ST_BIT = 9223372036854775808  # 2^63
-    # config for MemPage
+    # config for MemPage; defaults of the per-table geometry
     SIZE_PAGE = 4096  # size of a page in bytes
     SIZE_INT = 8  # size of an int in bytes accepted
-    MAX_RECORDS = 512  # Maximum number of records per page
+    MAX_RECORDS = SIZE_PAGE // SIZE_INT  # Maximum number of records per page
     # bufferpool
-    SIZE_BUFFER = 128  # number of partitions in the bufferpool
+    SIZE_BUFFER = 128 * 2**20  # bytes of memory shared by all bufferpools
+    EVICT_WINDOW = 8  # number of LRU partitions considered upon eviction
+    READAHEAD = 4  # number of partitions prefetched upon sequential access
+    READAHEAD_TRIGGER = 2  # consecutive partitions to detect sequential access
+    CHECKPOINT_INTERVAL = 60  # seconds between periodic checkpoints
+    # tail records of tables with non-cumulative updates
+    MAX_CHAIN = 8  # tail records read per record before folding the chain
+    # parallel scans & aggregates
+    N_PROCESSES = None  # number of worker processes; None for all CPUs
+    # concurrency control of transactions: 'lock' (no-wait 2PL) or 'occ'
+    CC_MODE = 'lock'
+    # retries of aborted transactions in TransactionWorker
+    TXN_MAX_ATTEMPTS = 5  # 1 for no retries
+    TXN_BACKOFF = 0.001  # seconds before the 1st retry; doubles each time
+    TXN_MAX_BACKOFF = 0.1  # cap of the backoff in seconds
+    TXN_LOCK_POLL = 0.0005  # seconds between checks of conflicting locks
+    TXN_BATCH = 64  # due transactions run together; 1 for one at a time
+    # asyncio front end
+    ASYNC_WORKERS = 8  # number of threads doing the storage work
+    ASYNC_MAX_PENDING = 64  # storage calls in flight before callers wait
+    ASYNC_HEADROOM = 0.1  # unpinned fraction of the buffer to start a call
+    ASYNC_POLL = 0.001  # seconds between checks of the headroom
+    # secondary indexes
+    INDEX_BATCH = 1024  # changes buffered per column before they're applied
+    SIZE_INDEX_PAGE = 4096  # bytes of a node of the disk-resident indexes
+    DISK_INDEX = False  # keep the key index of new tables on the disk
+    # bulk import & export
+    BULK_CHUNK = 65536  # records parsed or formatted at a time
+    BULK_WINDOW = 8  # chunks in the process pool at a time
+    # cache of resolved records for hot keys
+    CACHE_RECORDS = 0  # max number of cached records per table; 0 for none
+    # sharded deployment
+    N_SHARDS = None  # number of shard processes; None for all CPUs
+    SHARD_TRANSPORT = 'pipe'  # IPC between router & shards: 'pipe' or 'unix'
 
 
 def init():
@@ -1,12 +1,28 @@
 import os
 import pickle
+import threading
+from lstore import bulk
+from lstore.bufferpool import BufferManager
+from lstore.config import Config
 from lstore.table import Table
 
 
 class Database():
-    def __init__(self):
+    def __init__(self, buffer_size=Config.SIZE_BUFFER,
+                 cc_mode=Config.CC_MODE):
+        """
+        Arguments:
+            - buffer_size: int
+                Memory budget in bytes shared by the bufferpools of all tables.
+            - cc_mode: str
+                Default concurrency control of the transactions on the tables:
+                'lock' or 'occ'.
+        """
         self.tables = {}
         self.path = None
+        self.buffer = BufferManager(buffer_size)
+        self.cc_mode = cc_mode
+        self.__stop_checkpoints = None  # threading.Event of the checkpointer
 
     def open(self, path):
         if not os.path.exists(path):
@@ -14,10 +30,36 @@ class Database():
         self.path = path
 
     def close(self):
+        self.stop_checkpoints()
         for key in self.tables:
             self.tables[key].close()
 
-    def create_table(self, name, num_columns, key):
+    def checkpoint(self):
+        """ Take a fuzzy checkpoint of every table. See Table.checkpoint.
+        """
+        for table in list(self.tables.values()):
+            table.checkpoint()
+
+    def start_checkpoints(self, interval=Config.CHECKPOINT_INTERVAL):
+        """ Checkpoint all tables every @interval seconds in the background,
+            which bounds the work of recovery after a crash.
+        """
+        self.stop_checkpoints()
+        stop = self.__stop_checkpoints = threading.Event()
+
+        def checkpointer():
+            while not stop.wait(interval):
+                self.checkpoint()
+        threading.Thread(target=checkpointer, daemon=True).start()
+
+    def stop_checkpoints(self):
+        if self.__stop_checkpoints is not None:
+            self.__stop_checkpoints.set()
+            self.__stop_checkpoints = None
+
+    def create_table(self, name, num_columns, key, quota=None,
+                     max_records=Config.MAX_RECORDS, clustered=False,
+                     sparse_tails=False, cumulative=True):
         """ Creates a new table
         Arguments:
             - name: str
@@ -26,21 +68,93 @@ class Database():
                 Number of Columns: all columns are integer
             - key: int
                 Index of table key in columns
+            - quota: int
+                Optional max number of bytes that the table can hold in the
+                shared bufferpool.
+            - max_records: int
+                Number of records per partition of the table.
+            - clustered: bool
+                Partition the records by key range. See Table.
+            - sparse_tails: bool
+                Tail records only store the updated columns. See Table.
+            - cumulative: bool
+                Cumulative or non-cumulative tail records. See Table.
         Returns:
             Table obj of the table that was added to the DB.
         """
-        table = Table(name, num_columns, key, self.path)
+        table = Table(name, num_columns, key, self.path, self.buffer, quota,
+                      max_records, clustered, sparse_tails, cumulative)
+        table.cc_mode = self.cc_mode
         self.tables[name] = table
         return table
 
-    def get_table(self, name):
+    def get_table(self, name, quota=None):
         with open(os.path.join(self.path, name, 'meta'), 'rb') as f:
-            num_columns, key = pickle.load(f)
+            meta = pickle.load(f)
+        # tables written before the geometry & layout were configurable
+        defaults = [Config.MAX_RECORDS, False, False, True]
+        num_columns, key, max_records, clustered, sparse_tails, cumulative = \
+            meta + defaults[len(meta) - 2:]
 
-        table = Table(name, num_columns, key, self.path)
+        table = Table(name, num_columns, key, self.path, self.buffer, quota,
+                      max_records, clustered, sparse_tails, cumulative)
+        table.cc_mode = self.cc_mode
         self.tables[name] = table
         return table
 
+    def import_csv(self, name, path, key=0, header=False, **options):
+        """ Stream the CSV file @path into table @name, which is created
+            with a column per field & @key as the key column if it doesn't
+            exist. See bulk.import_csv for @options.
+        Returns:
+            Number of records imported.
+        """
+        table = self.__bulk_table(
+            name, lambda: bulk.csv_width(path, header), key)
+        return bulk.import_csv(table, path, header, **options)
+
+    def import_columns(self, name, paths, key=0, **options):
+        """ Stream the raw int64 column files @paths, one per column, into
+            table @name, which is created with @key as the key column if it
+            doesn't exist. See bulk.import_columns for @options.
+        Returns:
+            Number of records imported.
+        """
+        table = self.__bulk_table(name, lambda: len(paths), key)
+        return bulk.import_columns(table, paths, **options)
+
+    def export_csv(self, name, path, **options):
+        """ Stream the records of table @name to the CSV file @path. See
+            bulk.export_csv for @options.
+        Returns:
+            Number of records exported.
+        """
+        return bulk.export_csv(self.__table(name), path, **options)
+
+    def export_columns(self, name, paths, **options):
+        """ Stream the columns of table @name to a raw int64 file each in
+            @paths. See bulk.export_columns for @options.
+        Returns:
+            Number of records exported.
+        """
+        return bulk.export_columns(self.__table(name), paths, **options)
+
+    def __table(self, name):
+        """ Table @name, loaded from the disk if it isn't open yet
+        """
+        if name not in self.tables:
+            return self.get_table(name)
+        return self.tables[name]
+
+    def __bulk_table(self, name, num_columns, key):
+        """ Table @name; created with @num_columns() columns if it doesn't
+            exist
+        """
+        if name in self.tables or \
+                os.path.exists(os.path.join(self.path, name, 'meta')):
+            return self.__table(name)
+        return self.create_table(name, num_columns(), key)
+
     def drop_table(self, name):
         """ Deletes the specified table from DB
         Arguments:
@@ -48,4 +162,7 @@ class Database():
                 Name of the table to be deleted.
         """
         if name in self.tables.keys():
+            self.buffer.unregister(self.tables[name].buffer)
+            self.tables[name].index.close()
+            self.tables[name].buffer.close()
             del self.tables[name]
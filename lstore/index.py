@@ -1,5 +1,9 @@
 from BTrees.IOBTree import IOBTree
 from itertools import chain
+from operator import itemgetter
+import os
+import pickle
+from lstore.btree import DiskBTree
 from lstore.config import Config
 
 
@@ -18,15 +22,111 @@ class Index:
         # number of records for each column
         self.counts = [0] * table.num_columns
         # create indexing for the key column upon initialization
-        self.create_index(table.COL_KEY - Config.N_META_COLS)
+        self.create_index(table.COL_KEY - Config.N_META_COLS,
+                          on_disk=Config.DISK_INDEX)
         # list of columns that have been initialized indexing but still need to
         #   read from the DB
         self.to_be_indexed = []
+        # Covering indexes
+        # Key:   indexed column
+        # Value: (included columns, IOBTree of rid -> tuple of their values)
+        self.covering = {}
+        # list of covering indexes that still need to read from the DB
+        self.to_be_covered = []
+        self.__init_pending()
         self.__lock = None
 
+    def __init_pending(self):
+        # Changes of the records not yet applied to the trees, one dict for
+        #   each column. Lookups merge them in.
+        # Key:   rid
+        # Value: (value of the rid in the tree, current value or None if the
+        #         record is deleted)
+        self.pending = [{} for _ in range(self.table.num_columns)]
+        # Key:   current value in self.pending
+        # Value: set of the rids that have it
+        self.incoming = [{} for _ in range(self.table.num_columns)]
+        # number of changes of a column buffered before they're applied
+        self.batch_size = Config.INDEX_BATCH
+
     def init_lock(self, lock):
         self.__lock = lock
 
+    def __getstate__(self):
+        # The table & the lock aren't pickled; set them again after loading
+        #   with self.table = table & self.init_lock
+        state = self.__dict__.copy()
+        state['table'] = None
+        state['_Index__lock'] = None
+        # IOBTrees pickle their chain of buckets recursively, which overflows
+        #   the stack for large indices; they're pickled as dicts instead
+        state['I'] = [
+            dict(tree.items()) if isinstance(tree, IOBTree) else tree
+            for tree in self.I
+        ]
+        state['covering'] = {
+            column: (include, dict(payload.items()))
+            for column, (include, payload) in self.covering.items()
+        }
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.I = [IOBTree(t) if type(t) is dict else t for t in self.I]
+        if 'covering' in state:
+            self.covering = {
+                column: (include, IOBTree(payload))
+                for column, (include, payload) in self.covering.items()
+            }
+        # indices pickled before covering indexes & buffered changes
+        if 'covering' not in state:
+            self.covering = {}
+            self.to_be_covered = []
+        if 'pending' not in state:
+            self.pending = [{} for _ in self.I]
+            self.incoming = [{} for _ in self.I]
+            self.batch_size = Config.INDEX_BATCH
+
+    def attach(self):
+        """ Open the DiskBTrees after the index was loaded. They're as of
+            the checkpoint like the rest of the index, even after a crash;
+            see DiskBTree. Those whose files are missing or unusable are
+            rebuilt from the table.
+        """
+        manager = self.table.buffer.manager
+        for column, tree in enumerate(self.I):
+            if not isinstance(tree, DiskBTree):
+                continue
+            if not tree.attach(manager, self.table.PATH_TABLE):
+                self.I[column] = self.__new_tree(column, on_disk=True)
+                self.counts[column] = 0
+                self.pending[column].clear()
+                self.incoming[column].clear()
+                if column not in self.to_be_indexed:
+                    self.to_be_indexed.append(column)
+
+    def close(self):
+        """ Write the DiskBTrees & release their memory
+        """
+        with self.__lock:
+            for tree in self.I:
+                if isinstance(tree, DiskBTree):
+                    tree.close()
+
+    def __new_tree(self, column, on_disk):
+        if not on_disk:
+            return IOBTree()
+        return DiskBTree(self.table.PATH_TABLE, 'index_%d' % column,
+                         self.table.buffer.manager)
+
+    def snapshot(self):
+        """
+        Returns:
+            Pickled bytes of a consistent copy of the index.
+        """
+        with self.__lock:
+            return pickle.dumps(self)
+
     def insert(self, column, value, rid):
         """ Insert @rid with key @value.
         Arguments:
@@ -42,15 +142,32 @@ class Index:
 
             if self.I[column] is not None:
                 self.counts[column] += 1
-                try:
-                    # assume value exists
-                    self.I[column][value].append(rid)
-                except KeyError:
-                    # value doesn't yet exist, so create one
-                    self.I[column][value] = [rid]
+                self.__add(self.I[column], value, rid)
             else:
                 raise KeyError
 
+    def insert_columns(self, rids, columns):
+        """ Index new records given column-wise while holding the lock only
+            once, as self.insert does for each indexed column & self.change
+            for the covering indexes.
+        Arguments:
+            - rids: range
+                RIDs of the records.
+            - columns: list
+                Values of every user column of the records.
+        """
+        with self.__lock:
+            self.__index_from_db()
+            for column, tree in enumerate(self.I):
+                if tree is None:
+                    continue
+                self.counts[column] += len(rids)
+                for value, rid in zip(columns[column], rids):
+                    self.__add(tree, value, rid)
+            for include, payload in self.covering.values():
+                for rid, vals in zip(rids, zip(*[columns[c] for c in include])):
+                    payload[rid] = vals
+
     def delete(self, column, value, rid):
         """ Delete @rid from key @value.
         Arguments:
@@ -63,8 +180,8 @@ class Index:
         """
         with self.__lock:
             self.__index_from_db()
-            if self.I[column]:
-                self.I[column][value].remove(rid)
+            if self.I[column] is not None:
+                self.__remove(self.I[column], value, rid)
 
     def update(self, column, old_value, new_value, rid):
         """ Remove @rid from key @old_value, and insert @rid to key @new_value
@@ -95,9 +212,30 @@ class Index:
         with self.__lock:
             self.__index_from_db()
             try:
-                return self.I[column][value]
+                rids = self.I[column][value]
             except KeyError:
-                return []
+                rids = []
+            return self.__merge(column, value, rids)
+
+    def locate_many(self, column, values):
+        """ Locate the RIDs of the records that match each of @values in
+            @column while holding the lock only once.
+        Arguments:
+            - column: int
+                Column index (aka which column) to perform the operation on.
+            - values: list
+                Values to look for.
+        Returns:
+            List with a list of RIDs for each value in @values. The lists are
+                copies, so they're safe to iterate while the index changes.
+        """
+        with self.__lock:
+            self.__index_from_db()
+            tree = self.I[column]
+            return [
+                list(self.__merge(column, value, tree.get(value, ())))
+                for value in values
+            ]
 
     def locate_range(self, column, begin, end):
         """ Locate the RIDs of the records that have values between @begin and
@@ -114,26 +252,298 @@ class Index:
                 @begin and @end.
         """
         with self.__lock:
+            if self.pending[column]:
+                return [rid for _, rid in self.__range(column, begin, end)]
             return list(
                 chain.from_iterable(
                     self.I[column].values(begin, end, excludemax=True)
                 )
             )
 
-    def create_index(self, column):
+    def remap(self, mapping, first_rid, n_records):
+        """ Change the RIDs of all indices after the table got compacted.
+        Arguments:
+            - mapping: dict
+                Key: old RID; Value: new RID of the records from @first_rid
+                on that are still alive.
+            - first_rid: int
+                RIDs from @first_rid on that aren't in @mapping belong to
+                deleted records and are removed. Smaller RIDs stay the same.
+            - n_records: int
+                Number of records left in the table.
+        """
+        with self.__lock:
+            self.__index_from_db()
+            self.__apply_all()
+            for column, tree in enumerate(self.I):
+                if tree is None:
+                    continue
+                for value, rids in list(tree.items()):
+                    new_rids = [
+                        mapping.get(rid, rid) for rid in rids
+                        if rid < first_rid or rid in mapping
+                    ]
+                    if new_rids:
+                        tree[value] = new_rids
+                    else:
+                        del tree[value]
+                self.counts[column] = n_records
+            for include, payload in self.covering.values():
+                kept = {
+                    mapping.get(rid, rid): vals
+                    for rid, vals in payload.items()
+                    if rid < first_rid or rid in mapping
+                }
+                payload.clear()
+                payload.update(kept)
+
+    def move(self, moves):
+        """ Change the RIDs of records that were moved within the table.
+        Arguments:
+            - moves: list
+                List of (old RID, new RID, columns) where @columns has all
+                user columns of the record. A new RID may be the old RID of
+                another record in @moves.
+        """
+        with self.__lock:
+            self.__index_from_db()
+            self.__apply_all()
+            for column, tree in enumerate(self.I):
+                if tree is None:
+                    continue
+                # remove all old RIDs first so none is taken for a new one
+                for old_rid, _, columns in moves:
+                    self.__remove(tree, columns[column], old_rid)
+                for _, new_rid, columns in moves:
+                    self.__add(tree, columns[column], new_rid)
+            for include, payload in self.covering.values():
+                for old_rid, _, _ in moves:
+                    payload.pop(old_rid, None)
+                for _, new_rid, columns in moves:
+                    payload[new_rid] = tuple(columns[c] for c in include)
+
+    def reindex(self, partitions, records, n_records):
+        """ Replace the entries of all RIDs in @partitions by @records, which
+            are read from those partitions. Used by recovery for partitions
+            that changed after the index was checkpointed.
+        Arguments:
+            - partitions: set
+                Indices of the partitions.
+            - records: list
+                List of (rid, columns) of the live records in @partitions,
+                where @columns has all user columns.
+            - n_records: int
+                Number of records in the table.
+        """
+        max_records = self.table.MAX_RECORDS
+        with self.__lock:
+            self.__index_from_db()
+            self.__apply_all()
+            for column, tree in enumerate(self.I):
+                if tree is None:
+                    continue
+                for value, rids in list(tree.items()):
+                    kept = [
+                        rid for rid in rids
+                        if (rid - 1) // max_records not in partitions
+                    ]
+                    if not kept:
+                        del tree[value]
+                    elif len(kept) != len(rids):
+                        tree[value] = kept
+                for rid, columns in records:
+                    self.__add(tree, columns[column], rid)
+                self.counts[column] = n_records
+            for include, payload in self.covering.values():
+                for rid in list(payload.keys()):
+                    if (rid - 1) // max_records in partitions:
+                        del payload[rid]
+                for rid, columns in records:
+                    payload[rid] = tuple(columns[c] for c in include)
+
+    def create_index(self, column, include=(), on_disk=False):
         """ Create index on column @column
+        Arguments:
+            - include: tuple
+                Other columns whose values are stored in the index along with
+                the RIDs, so that selects that only project @column & these
+                are answered without reading the records.
+            - on_disk: bool
+                Keep the index in a DiskBTree, whose nodes are paged in & out
+                by the buffer manager, instead of all in memory.
         """
         if self.I[column] is None:
-            self.I[column] = IOBTree()
+            self.I[column] = self.__new_tree(column, on_disk)
             # Queue the column to be indexed
             if max(self.counts) != 0 and column not in self.to_be_indexed:
                 self.to_be_indexed.append(column)
+        if include:
+            with self.__lock:
+                self.covering[column] = (tuple(include), IOBTree())
+                if self.table.max_rid() and column not in self.to_be_covered:
+                    self.to_be_covered.append(column)
 
     def drop_index(self, column):
         """ Delete index on column @column
         """
         with self.__lock:
+            if isinstance(self.I[column], DiskBTree):
+                self.I[column].close()
+                os.remove(os.path.join(self.table.PATH_TABLE,
+                                       self.I[column].name))
             self.I[column] = None
+            self.covering.pop(column, None)
+            self.pending[column].clear()
+            self.incoming[column].clear()
+
+    def maintained_eh(self):
+        """ whether writes need the old values of the records, i.e., a column
+            other than the key is indexed or an index is covering
+        """
+        key = self.table.COL_KEY - Config.N_META_COLS
+        return bool(self.covering) or any(
+            tree is not None for i, tree in enumerate(self.I) if i != key
+        )
+
+    def change(self, rid, columns, old_columns=None, skip=None):
+        """ Keep the indexes up to date with a write of the record @rid: a
+            new record if @old_columns is None, a deleted one if @columns is
+            None, and an update otherwise. New records are added to the trees
+            by self.insert; other changes are buffered & applied in batches.
+        Arguments:
+            - columns: list
+                All user columns of the record after the write.
+            - old_columns: list
+                All user columns of the record before the write.
+            - skip: int
+                Column whose index entry is maintained by the caller, i.e.,
+                the key column.
+        """
+        with self.__lock:
+            self.__index_from_db()
+            if old_columns is not None:
+                for column, tree in enumerate(self.I):
+                    if tree is None or column == skip:
+                        continue
+                    new_value = None if columns is None else columns[column]
+                    if old_columns[column] != new_value:
+                        self.__stage(
+                            column, rid, old_columns[column], new_value)
+            for include, payload in self.covering.values():
+                if columns is None:
+                    payload.pop(rid, None)
+                else:
+                    payload[rid] = tuple(columns[c] for c in include)
+
+    def flush(self):
+        """ Apply all buffered changes to the trees
+        """
+        with self.__lock:
+            self.__apply_all()
+
+    def __stage(self, column, rid, old_value, new_value):
+        """ Buffer the change of @rid from @old_value to @new_value in
+            @column; changes of the same rid are combined into one.
+        """
+        pending, incoming = self.pending[column], self.incoming[column]
+        if rid in pending:
+            old_value, current = pending.pop(rid)
+            if current is not None:
+                incoming[current].discard(rid)
+                if not incoming[current]:
+                    del incoming[current]
+        if old_value != new_value:
+            pending[rid] = (old_value, new_value)
+            if new_value is not None:
+                incoming.setdefault(new_value, set()).add(rid)
+        if len(pending) >= self.batch_size:
+            self.__apply(column)
+
+    def __apply(self, column):
+        """ Apply the buffered changes of @column to its tree in the order of
+            the values, so that neighbouring leaves are changed in a row
+        """
+        pending = self.pending[column]
+        if not pending:
+            return
+        tree = self.I[column]
+        changes = sorted(pending.items(), key=lambda item: item[1][0])
+        for rid, (old_value, _) in changes:
+            self.__remove(tree, old_value, rid)
+        changes = sorted(
+            ((new_value, rid) for rid, (_, new_value) in pending.items()
+             if new_value is not None),
+            key=itemgetter(0)
+        )
+        for new_value, rid in changes:
+            self.__add(tree, new_value, rid)
+        pending.clear()
+        self.incoming[column].clear()
+
+    def __apply_all(self):
+        for column, pending in enumerate(self.pending):
+            if pending:
+                self.__apply(column)
+
+    def __merge(self, column, value, rids):
+        """ @rids under @value in the tree of @column with the buffered
+            changes merged in
+        """
+        pending = self.pending[column]
+        if not pending:
+            return rids
+        merged = [rid for rid in rids if rid not in pending]
+        merged += self.incoming[column].get(value, ())
+        return merged
+
+    def __range(self, column, begin, end):
+        """ (value, rid) of the records with values between @begin (inclusive)
+            and @end (exclusive) in @column, sorted by value, with the
+            buffered changes merged in
+        """
+        pending = self.pending[column]
+        matches = [
+            (value, rid)
+            for value, rids in self.I[column].items(
+                begin, end, excludemax=True)
+            for rid in rids if rid not in pending
+        ]
+        if pending:
+            matches += [
+                (value, rid)
+                for value, rids in self.incoming[column].items()
+                if begin <= value < end
+                for rid in rids
+            ]
+            matches.sort(key=itemgetter(0))
+        return matches
+
+    def locate_covered(self, column, begin, end, query_columns):
+        """ Read @query_columns of the records with values between @begin
+            (inclusive) and @end (exclusive) in @column from its covering
+            index.
+        Returns:
+            List of (rid, values of @query_columns); None if the index
+                doesn't cover all of @query_columns.
+        """
+        cover = self.covering.get(column)
+        if cover is None:
+            return None
+        include, payload = cover
+        wanted = [i for i, q in enumerate(query_columns) if q]
+        if any(i != column and i not in include for i in wanted):
+            return None
+        pos = {col: i for i, col in enumerate(include)}
+        with self.__lock:
+            self.__index_from_db()
+            results = []
+            for value, rid in self.__range(column, begin, end):
+                vals = payload[rid]
+                results.append((rid, [
+                    value if i == column else vals[pos[i]]
+                    for i in wanted
+                ]))
+            return results
 
     def indexed_eh(self, column):
         """ whether @column is indexed
@@ -141,26 +551,71 @@ class Index:
         with self.__lock:
             return self.I[column] is not None
 
+    @staticmethod
+    def __add(tree, value, rid):
+        """ Add @rid to @value in @tree, an IOBTree or a DiskBTree
+        """
+        if isinstance(tree, DiskBTree):
+            tree.add(value, rid)
+            return
+        try:
+            # assume value exists
+            tree[value].append(rid)
+        except KeyError:
+            # value doesn't yet exist, so create one
+            tree[value] = [rid]
+
+    @staticmethod
+    def __remove(tree, value, rid):
+        """ Remove @rid from @value in @tree if it's there
+        """
+        if isinstance(tree, DiskBTree):
+            tree.discard(value, rid)
+            return
+        rids = tree.get(value)
+        if rids is not None and rid in rids:
+            rids.remove(rid)
+            if not rids:
+                del tree[value]
+
     def __index_from_db(self):
         """ add data from db to indexing
         """
         # need to read from DB for those columns that just initialized indexing
         if len(self.to_be_indexed) > 0:
             self.to_be_indexed.sort()
-            query_cols = [0] * Config.N_META_COLS
+            # read the RID as well to skip the tombstones
+            query_cols = [
+                1 if i == Config.COL_RID else 0
+                for i in range(Config.N_META_COLS)
+            ]
             query_cols += [
                 1 if i in self.to_be_indexed else 0
                 for i in range(self.table.num_columns)
             ]
-            for rid in range(1, max(self.counts)+1):
-                for i, val in enumerate(self.table[rid, query_cols]):
+            for rid in range(1, self.table.max_rid()+1):
+                is_alive, *vals = self.table[rid, query_cols]
+                if not is_alive:
+                    continue
+                for i, val in enumerate(vals):
                     column = self.to_be_indexed[i]
                     self.counts[column] += 1
-                    try:
-                        # assume value exists
-                        self.I[column][val].append(rid)
-                    except KeyError:
-                        # value doesn't yet exist, so create one
-                        self.I[column][val] = [rid]
+                    self.__add(self.I[column], val, rid)
 
             self.to_be_indexed = []
+
+        if len(self.to_be_covered) > 0:
+            query_cols = [
+                1 if i == Config.COL_RID else 0
+                for i in range(Config.N_META_COLS)
+            ]
+            query_cols += [1] * self.table.num_columns
+            covers = [self.covering[column] for column in self.to_be_covered]
+            for rid in range(1, self.table.max_rid()+1):
+                is_alive, *vals = self.table[rid, query_cols]
+                if not is_alive:
+                    continue
+                for include, payload in covers:
+                    payload[rid] = tuple(vals[c] for c in include)
+
+            self.to_be_covered = []
@@ -2,18 +2,20 @@ from lstore.config import *
 
 
 class MemPage:
-    def __init__(self):
+    def __init__(self, max_records=Config.MAX_RECORDS):
         """
         All data are assumed to be 64-bit (8-byte) integers.
-        A page has a size of 4096 bytes, thus, it can hold 512 ints which can be
-        visualized as a flatten 512x8 matrix where each row represents an int:
+        A page holds @max_records ints, thus, by default it has a size of 4096
+        bytes and can hold 512 ints which can be visualized as a flatten 512x8
+        matrix where each row represents an int:
 
         int0:   byte0 byte1 byte2 byte3 byte4 byte5 byte6 byte7
         int1:   byte0 byte1 byte2 byte3 byte4 byte5 byte6 byte7
                 ...
         int512: byte0 byte1 byte2 byte3 byte4 byte5 byte6 byte7
         """
-        self.data = bytearray(Config.SIZE_PAGE)
+        self.MAX_RECORDS = max_records
+        self.data = bytearray(max_records * Config.SIZE_INT)
 
     def __setitem__(self, key, value):
         """ Overload [] operator for assignment.
@@ -28,7 +30,7 @@ class MemPage:
         Raise:
             IndexError: if @key not in range
         """
-        if 0 <= key < Config.MAX_RECORDS:
+        if 0 <= key < self.MAX_RECORDS:
             self.data[key * 8:(key + 1) * 8] = value.to_bytes(
                 Config.SIZE_INT, 'big')
         else:
@@ -45,7 +47,7 @@ class MemPage:
         Raise:
             IndexError: if @key not in range
         """
-        if 0 <= key < Config.MAX_RECORDS:
+        if 0 <= key < self.MAX_RECORDS:
             return int.from_bytes(self.data[key * 8:(key + 1) * 8], 'big')
         else:
             raise IndexError
@@ -1,3 +1,4 @@
+from lstore.config import Config
 from lstore.mempage import MemPage
 
 
@@ -10,8 +11,8 @@ class Page:
     base_page[0, [1,1,0,0,1]]        # read 1+ values at row 0 column 0, 1, 4
     """
 
-    def __init__(self, n_cols):
-        self.data = [MemPage() for _ in range(n_cols)]
+    def __init__(self, n_cols, max_records=Config.MAX_RECORDS):
+        self.data = [MemPage(max_records) for _ in range(n_cols)]
         self.N_COLS = n_cols
 
     def __setitem__(self, key, value):
@@ -0,0 +1,180 @@
+from concurrent.futures import ProcessPoolExecutor
+from lstore.config import Config
+from lstore.record import ColumnarResult
+import os
+import pickle
+
+# Shared by all tables; started upon the first parallel query
+_executor = None
+
+# How the partial results of the partitions are combined
+COMBINE = {
+    'sum': sum,
+    'count': sum,
+    'min': min,
+    'max': max,
+}
+
+
+def executor():
+    """ Process pool that runs the partition tasks
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(Config.N_PROCESSES)
+    return _executor
+
+
+def shutdown():
+    """ Stop the worker processes
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def run_partitions(bufferpool, func, tasks, *args, parallel=True):
+    """ Run @func(partition, slots, *args) on every partition in @tasks.
+        If @parallel, every partition is fanned out to the process pool:
+        the workers load the partitions on the disk from their files, and
+        the partitions in the bufferpool are sent to them as pickled copies
+        taken under the latch of the partition.
+        Results are not isolated from writes running at the same time.
+    Arguments:
+        - bufferpool: Bufferpool
+            Bufferpool of the table.
+        - func: function
+            Module-level function so it can be sent to the workers.
+        - tasks: dict
+            Key:   index of a partition
+            Value: list of indices in the partition to process, or None for
+                   all live records.
+        - parallel: bool
+            If False, every partition is processed by this process.
+    Returns:
+        List of results of @func in no particular order.
+    """
+    if not parallel:
+        results = []
+        idx_parts = list(tasks)
+        for i, idx_part in enumerate(idx_parts):
+            # overlap the loading of the next partitions with the work on
+            #   this one
+            bufferpool.prefetch(idx_parts[i + 1:i + 1 + Config.READAHEAD])
+            results.append(func(bufferpool[idx_part], tasks[idx_part], *args))
+        return results
+
+    futures = []
+    buffered = []
+    with bufferpool.manager.lock:
+        for idx_part, slots in tasks.items():
+            p = bufferpool.partitions[idx_part]
+            if p is None:
+                path = os.path.join(bufferpool.PATH, str(idx_part))
+                futures.append(
+                    executor().submit(_load_n_run, path, func, slots, args))
+            else:
+                buffered.append((p, slots))
+    # pickled outside of the lock of the buffer manager; an evicted
+    #   partition is still whole
+    for p, slots in buffered:
+        with p.latch:
+            data = pickle.dumps(p)
+        futures.append(executor().submit(_unpickle_n_run, data, func, slots,
+                                         args))
+    return [future.result() for future in futures]
+
+
+def _load_n_run(path, func, slots, args):
+    """ Worker: read the partition file at @path, then run @func on it
+    """
+    with open(path, 'rb') as f:
+        partition = pickle.load(f)
+    return func(partition, slots, *args)
+
+
+def _unpickle_n_run(data, func, slots, args):
+    """ Worker: unpickle the copy @data of a partition, then run @func on it
+    """
+    return func(pickle.loads(data), slots, *args)
+
+
+def _live_slots(partition, slots):
+    if slots is None:
+        slots = range(partition.count_base_rec)
+    return [idx for idx in slots if not partition.is_deleted(idx)]
+
+
+def aggregate_partition(partition, slots, column, op, key_column=None,
+                        begin=None, end=None):
+    """ Partial aggregate of @column (INCLUDING meta-cols) over @slots. If
+        @key_column is given, only records whose values in it are between
+        @begin and @end (both inclusive) are aggregated.
+    Returns:
+        Partial result of @op; None for min/max of no records.
+    """
+    query_columns = [0] * partition.N_COLS
+    query_columns[column] = 1
+    if key_column is None:
+        vals = [
+            partition.read(idx, query_columns)[0]
+            for idx in _live_slots(partition, slots)
+        ]
+    else:
+        query_columns[key_column] = 1
+        # positions of the key & the value in what's read
+        pos_key = int(column < key_column)
+        pos_val = int(key_column < column)
+        vals = []
+        for idx in _live_slots(partition, slots):
+            read = partition.read(idx, query_columns)
+            if begin <= read[pos_key] <= end:
+                vals.append(read[pos_val])
+    if op == 'count':
+        return len(vals)
+    if op in ('min', 'max') and not vals:
+        return None
+    return COMBINE[op](vals)
+
+
+def scan_partition(partition, slots, query_columns, where=None):
+    """ Read @query_columns (INCLUDING meta-cols) of @slots, optionally only
+        of the records matching @where = (column, begin, end), i.e., whose
+        values in column (INCLUDING meta-cols) are between begin and end
+        (both inclusive).
+    Returns:
+        ColumnarResult of the live records; RIDs included.
+    """
+    n_cols = sum(1 for q in query_columns if q)
+    result = ColumnarResult(n_cols)
+    query_columns = list(query_columns)
+    query_columns[Config.COL_RID] = 1
+    # position of the RID among the values that are read
+    pos_rid = sum(1 for q in query_columns[:Config.COL_RID] if q)
+    added_rid = n_cols < sum(query_columns)
+    if where is not None:
+        column, begin, end = where
+        filter_columns = [0] * partition.N_COLS
+        filter_columns[column] = 1
+    for idx in _live_slots(partition, slots):
+        if where is not None and \
+                not begin <= partition.read(idx, filter_columns)[0] <= end:
+            continue
+        vals = partition.read(idx, query_columns)
+        result.rids.append(vals[pos_rid])
+        if added_rid:
+            del vals[pos_rid]
+        for arr, val in zip(result.columns, vals):
+            arr.append(val)
+    return result
+
+
+def combine_partials(op, partials):
+    """ Combine the partial results of aggregate_partition
+    """
+    if op in ('min', 'max'):
+        partials = [x for x in partials if x is not None]
+        if not partials:
+            return None
+    return COMBINE[op](partials)
@@ -1,10 +1,72 @@
+from array import array
+from functools import lru_cache, wraps
+from lstore.mempage import MemPage
 from lstore.page import Page
 from time import time
 from lstore.config import Config
+import sys
+import threading
+
+# typecodes of the items of Partition.tail_map, from the narrowest
+MAP_TYPECODES = 'HIQ'
+
+
+def encode(columns):
+    """ Schema encoding in base-10 of an update of user columns @columns,
+        where a column has its bit set if it's not None.
+        Notice that encoding only covers userdefined columns.
+    """
+    enc_bin_list = [0 if col is None else 1 for col in columns]
+    return sum(x << i for i, x in enumerate(reversed(enc_bin_list)))
+
+
+def to_page(values):
+    """ Bytes of the ints @values as they're laid out in a MemPage
+    """
+    values = array('q', values)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_page(data):
+    """ Inverse of to_page
+    Returns:
+        array of the ints in the bytes @data of a MemPage.
+    """
+    values = array('q')
+    values.frombytes(data)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def latched(method):
+    """ Run @method of a Partition while holding its latch, so that the
+        partition is never pickled halfway through a write
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.latch:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+@lru_cache(maxsize=None)
+def ranks(enc, n_cols):
+    """ Rank of every column set in the schema encoding @enc among the set
+        ones, which is where the column is in a map of the sparse tail layout.
+    Returns:
+        dict with the index of a column (INCLUDING meta-cols) as the key.
+    """
+    cols = [i for i in range(Config.N_META_COLS, n_cols)
+            if enc >> (n_cols - 1 - i) & 1]
+    return {col: rank for rank, col in enumerate(cols)}
 
 
 class Partition:
-    def __init__(self, n_cols, key_column):
+    def __init__(self, n_cols, key_column, max_records=Config.MAX_RECORDS,
+                 sparse_tails=False, cumulative=True):
         """
         Partition holds the following attributes:
         base_page: 1-d list of Page obj
@@ -30,27 +92,99 @@ class Partition:
                 Number of columns INCLUDING meta-columns & user columns
             - key_column: int
                 Index of the column that has the keys.
+            - max_records: int
+                Number of records per page, i.e., the geometry of the
+                partition. Defaults to Config.MAX_RECORDS (512).
+            - sparse_tails: bool
+                Sparse tail layout: instead of full rows, a tail record only
+                stores the columns it updates, each appended to the tail
+                segment of its column:
+                tail_meta: list of Page obj
+                    IDR, RID, TS & ENC of every tail record, plus the start of
+                    its map in tail_map.
+                tail_segs: 2-d list of MemPage obj
+                    Values of each user column, in the order they were
+                    written.
+                tail_map: array of int
+                    For every tail record, the positions in tail_segs of the
+                    latest values of the columns set in its ENC, in column
+                    order. Reads stay one hop like with full rows, but only
+                    positions are copied forward instead of values. Items
+                    are 2 bytes, widened to 4 or 8 once a position doesn't
+                    fit.
+            - cumulative: bool
+                If True, a tail record has the latest values of all columns
+                updated so far, so a read looks at the latest tail record
+                only. If False, it only has the columns of its own update,
+                which makes updates cheaper; a read walks back the chain of
+                tail records of the record instead. Once a chain is longer
+                than Config.MAX_CHAIN, it's folded into one cumulative tail
+                record.
         """
         self.N_COLS = n_cols
         self.COL_KEY = key_column
+        self.MAX_RECORDS = max_records
+        self.SPARSE_TAILS = sparse_tails
+        self.CUMULATIVE = cumulative
 
         self.count_base_rec = 0     # Number of base records
         self.count_tail_rec = 0     # Number of tail records
+        self.count_deleted = 0      # Number of tombstones in the base page
         self.__dirty = True         # Whether there has been a modification
 
-        self.base_page = Page(n_cols)
-        self.tail_pages = [Page(n_cols)]
+        self.base_page = Page(n_cols, max_records)
+        self.__init_tails()
 
         # list of records that have been updated in the base page
         self.updated_idxs = set()
+        # Key:   index of a record in the base page
+        # Value: length of its chain of tail records if not self.CUMULATIVE
+        self.chain_lens = {}
+
+        # Zone map: [min, max] of each user column; None if no record yet.
+        #   Widened by writes & updates, and made exact again upon merge.
+        self.zones = [None] * (n_cols - Config.N_META_COLS)
+        # held by the writes & while the partition is pickled
+        self.latch = threading.RLock()
+
+    def __init_tails(self):
+        if not self.SPARSE_TAILS:
+            self.tail_pages = [Page(self.N_COLS, self.MAX_RECORDS)]
+            return
+        self.tail_pages = []
+        self.tail_meta = [Page(Config.N_META_COLS + 1, self.MAX_RECORDS)]
+        n_user = self.N_COLS - Config.N_META_COLS
+        self.tail_segs = [[] for _ in range(n_user)]
+        self.tail_seg_counts = [0] * n_user
+        self.tail_map = array(MAP_TYPECODES[0])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['latch']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.latch = threading.RLock()
+        # partitions written before the sparse tail layout
+        if 'SPARSE_TAILS' not in state:
+            self.SPARSE_TAILS = False
+        if 'CUMULATIVE' not in state:
+            self.CUMULATIVE = True
+            self.chain_lens = {}
+        # partitions written before zone maps were kept
+        if 'zones' not in state:
+            self.zones = [None] * (self.N_COLS - Config.N_META_COLS)
+            self.__rebuild_zones()
 
     def has_capacity(self):
         """
         Returns:
             True if there's space in self.base_page
         """
-        return self.count_base_rec < Config.MAX_RECORDS
+        return self.count_base_rec < self.MAX_RECORDS
 
+    @latched
     def write(self, *columns):
         """ Write @columns to the next availale position in self.base_page
 
@@ -63,8 +197,76 @@ class Partition:
         self.base_page[self.count_base_rec] = columns
         self.count_base_rec += 1
         self.__dirty = True
+        self.__widen(columns[Config.N_META_COLS:])
         return True
 
+    @latched
+    def write_columns(self, rid, columns, start=0):
+        """ Append records column-wise straight into the bytes of the base
+            pages, as self.write would for every record but at once.
+        Arguments:
+            - rid: int
+                RID of the first record; the others follow.
+            - columns: list
+                array of the values of each user column, from @start on.
+            - start: int
+                Position of the first record to write in @columns.
+        Returns:
+            Number of records written, which is less than given once the
+                base page is full.
+        """
+        first = self.count_base_rec
+        n = min(len(columns[0]) - start, self.MAX_RECORDS - first)
+        if n <= 0:
+            return 0
+        span = slice(first * Config.SIZE_INT, (first + n) * Config.SIZE_INT)
+        base = self.base_page.data
+        zeros = bytes(n * Config.SIZE_INT)
+        base[Config.COL_IDR].data[span] = zeros
+        base[Config.COL_RID].data[span] = to_page(range(rid, rid + n))
+        base[Config.COL_TS].data[span] = to_page([int(time())]) * n
+        base[Config.COL_ENC].data[span] = zeros
+        for i, values in enumerate(columns):
+            values = values[start:start + n]
+            base[Config.N_META_COLS + i].data[span] = to_page(values)
+            lo, hi = min(values), max(values)
+            zone = self.zones[i]
+            if zone is None:
+                self.zones[i] = [lo, hi]
+            else:
+                zone[0], zone[1] = min(zone[0], lo), max(zone[1], hi)
+        self.count_base_rec += n
+        self.__dirty = True
+        return n
+
+    def read_columns(self, query_columns):
+        """ Read the live records column-wise. Columns are sliced straight
+            from the bytes of the base pages; only records with tail records
+            are read one by one.
+        Arguments:
+            - query_columns: list
+                List of boolean values INCLUDING THE META-COLS for the columns
+                to return.
+        Returns:
+            List with an array of the values of each queried column.
+        """
+        n_bytes = self.count_base_rec * Config.SIZE_INT
+        base = self.base_page.data
+        columns = [
+            from_page(base[i].data[:n_bytes])
+            for i, q in enumerate(query_columns) if q
+        ]
+        for idx in self.updated_idxs:
+            for values, val in zip(columns, self.read(idx, query_columns)):
+                values[idx] = val
+        if self.count_deleted:
+            rids = from_page(base[Config.COL_RID].data[:n_bytes])
+            columns = [
+                array('q', (v for v, rid in zip(values, rids) if rid))
+                for values in columns
+            ]
+        return columns
+
     def read(self, idx, query_columns):
         """ Read the data at the index for the query_columns
         Arguments:
@@ -75,30 +277,82 @@ class Partition:
                 to return.
         """
         tid = self.base_page[idx, Config.COL_IDR]
-        result = []
+        base = self.base_page.data
+        if tid and not self.CUMULATIVE:
+            return self.__read_chain(idx, tid, query_columns)
+        if tid and self.SPARSE_TAILS:
+            which_tp, where_in_tp = self.__get_tail_page_idx(tid)
+            enc = self.tail_meta[which_tp].data[Config.COL_ENC][where_in_tp]
+            start = self.tail_meta[which_tp].data[-1][where_in_tp]
+            rank = ranks(enc, self.N_COLS)
+            return [
+                self.__seg_value(i, self.tail_map[start + rank[i]])
+                if i in rank else base[i][idx]
+                for i, query_this_column in enumerate(query_columns)
+                if query_this_column
+            ]
         # There's an indirection aka tid != 0
         if tid:
             which_tp, where_in_tp = self.__get_tail_page_idx(tid)
-            tp = self.tail_pages[which_tp]
-            enc = tp[where_in_tp, Config.COL_ENC]
-            enc = [int(i) for i in list(format(enc, '0%db' % self.N_COLS))]
-
-            for i, query_this_column in enumerate(query_columns):
-                if query_this_column:
-                    # If there has been an update, take it from TP
-                    if enc[i]:
-                        result.append(tp[where_in_tp, i])
-                    # if not, take it from BP
-                    else:
-                        result.append(self.base_page[idx, i])
+            tp = self.tail_pages[which_tp].data
+            enc = tp[Config.COL_ENC][where_in_tp]
+            last = self.N_COLS - 1
+            # If there has been an update (bit of the column in the encoding
+            #   is set), take it from TP; if not, take it from BP
+            return [
+                tp[i][where_in_tp] if enc >> (last - i) & 1 else base[i][idx]
+                for i, query_this_column in enumerate(query_columns)
+                if query_this_column
+            ]
         # No indirection: just read the base page
-        else:
-            for i, query_this_column in enumerate(query_columns):
-                if query_this_column:
-                    result.append(self.base_page[idx, i])
+        return [
+            base[i][idx]
+            for i, query_this_column in enumerate(query_columns)
+            if query_this_column
+        ]
+
+    def __read_chain(self, idx, tid, query_columns):
+        """ self.read for non-cumulative tail records: walk back from the
+            latest tail record @tid until every queried column that has ever
+            been updated is found.
+        """
+        last = self.N_COLS - 1
+        ever = self.base_page[idx, Config.COL_ENC]
+        # Key: column; Value: latest value in the tail records
+        found = {}
+        pending = [
+            i for i, q in enumerate(query_columns)
+            if q and ever >> (last - i) & 1
+        ]
+        # IDR of the 1st tail record is the RID of the base record
+        while pending and not tid & Config.MARK_1ST_BIT:
+            which_tp, where_in_tp = self.__get_tail_page_idx(tid)
+            if self.SPARSE_TAILS:
+                meta = self.tail_meta[which_tp].data
+                enc = meta[Config.COL_ENC][where_in_tp]
+                start = meta[-1][where_in_tp]
+                rank = ranks(enc, self.N_COLS)
+                for i in [i for i in pending if i in rank]:
+                    found[i] = self.__seg_value(
+                        i, self.tail_map[start + rank[i]])
+                    pending.remove(i)
+            else:
+                tp = self.tail_pages[which_tp].data
+                meta = tp
+                enc = tp[Config.COL_ENC][where_in_tp]
+                for i in [i for i in pending if enc >> (last - i) & 1]:
+                    found[i] = tp[i][where_in_tp]
+                    pending.remove(i)
+            tid = meta[Config.COL_IDR][where_in_tp]
 
-        return result
+        base = self.base_page.data
+        return [
+            found[i] if i in found else base[i][idx]
+            for i, query_this_column in enumerate(query_columns)
+            if query_this_column
+        ]
 
+    @latched
     def update(self, idx, rid, *columns):
         """ Update records with the specified key.
 
@@ -110,30 +364,140 @@ class Partition:
                 a column, no update will be made to it.
                 Ex: [None, None, None, 14]
         """
+        self.__append_tail(idx, rid, columns, encode(columns), int(time()))
+
+    @latched
+    def update_many(self, updates):
+        """ Append the tail records of many updates at once. The timestamp is
+            taken once and the schema encoding is computed once for each
+            distinct set of updated columns.
+
+        Arguments:
+            - updates: list
+                List of (idx, rid, columns) where the elements are the
+                arguments of self.update.
+        """
+        ts = int(time())
+        encodings = {}
+        for idx, rid, columns in updates:
+            mask = tuple(col is None for col in columns)
+            try:
+                enc = encodings[mask]
+            except KeyError:
+                enc = encodings[mask] = encode(columns)
+            self.__append_tail(idx, rid, columns, enc, ts)
+
+    @latched
+    def add_many(self, deltas):
+        """ Add deltas to the current values of records. Each record is read
+            and gets a single tail record with the new values, one after the
+            other, so the same record can appear more than once.
+
+        Arguments:
+            - deltas: list
+                List of (idx, rid, columns) where @columns has the value to
+                add to each user column, or None to leave it alone.
+                Ex: [None, 1, None, -5]
+        Returns:
+            List with the new user columns written for each element of
+                @deltas; None for the columns left alone.
+        """
+        ts = int(time())
+        encodings = {}
+        results = []
+        for idx, rid, columns in deltas:
+            mask = tuple(col is None for col in columns)
+            try:
+                enc, query_columns = encodings[mask]
+            except KeyError:
+                query_columns = [0] * Config.N_META_COLS
+                query_columns += [0 if col is None else 1 for col in columns]
+                enc = encode(columns)
+                encodings[mask] = enc, query_columns
+
+            old = iter(self.read(idx, query_columns))
+            new = tuple(
+                None if delta is None else next(old) + delta
+                for delta in columns
+            )
+            self.__append_tail(idx, rid, new, enc, ts)
+            results.append(new)
+        return results
+
+    def __append_tail(self, idx, rid, columns, enc, ts):
+        """ Write the tail record of an update with the schema encoding @enc
+            & timestamp @ts, and point the base record at it.
+        """
         self.updated_idxs.add(idx)
         self.__dirty = True
-        # Get encoding in base-10
-        # Also, notice that encoding only covers userdefined columns
-        enc_bin_list = [0 if col is None else 1 for col in columns]
-        enc = sum(x << i for i, x in enumerate(reversed(enc_bin_list)))
+        self.__widen(columns)
+        if self.SPARSE_TAILS:
+            self.__append_sparse_tail(idx, rid, columns, enc, ts)
+        elif not self.CUMULATIVE:
+            self.__append_delta_tail(idx, rid, columns, enc, ts)
+        else:
+            self.__append_full_tail(idx, rid, columns, enc, ts)
+
+        if not self.CUMULATIVE:
+            n = self.chain_lens[idx] = self.chain_lens.get(idx, 0) + 1
+            if n > Config.MAX_CHAIN:
+                self.__fold_chain(idx, rid, ts)
+
+    def __fold_chain(self, idx, rid, ts):
+        """ Append a tail record with the latest values of every column ever
+            updated for the record at @idx, which ends the walks of the reads
+            at it. Tail records are append-only, so reads running at the same
+            time are unaffected.
+        """
+        enc = self.base_page[idx, Config.COL_ENC]
+        query_columns = [0] * Config.N_META_COLS
+        query_columns += [1] * (self.N_COLS - Config.N_META_COLS)
+        last = self.N_COLS - 1
+        columns = [
+            val if enc >> (last - i) & 1 else None
+            for i, val in enumerate(self.read(idx, query_columns),
+                                    Config.N_META_COLS)
+        ]
+        if self.SPARSE_TAILS:
+            self.__append_sparse_tail(idx, rid, columns, enc, ts)
+        else:
+            self.__append_delta_tail(idx, rid, columns, enc, ts)
+        self.chain_lens[idx] = 1
 
+    def __append_delta_tail(self, idx, rid, columns, enc, ts):
+        """ Write a non-cumulative tail record with full rows: only the
+            columns of @enc are set.
+        """
+        tid = self.base_page[idx, Config.COL_IDR]
+        if len(self.tail_pages)*self.MAX_RECORDS <= self.count_tail_rec:
+            self.tail_pages.append(Page(self.N_COLS, self.MAX_RECORDS))
+        new_tid = self.count_tail_rec + 1
+        back = tid if tid else rid + Config.MARK_1ST_BIT
+        # the base record keeps track of all columns ever updated
+        ever = enc | self.base_page[idx, Config.COL_ENC]
+        which_tp, where_in_tp = self.__get_tail_page_idx(new_tid)
+        #   IDR    RID        TS     ENC   *usercolumns
+        #   back   new_tid    ts     enc   columns
+        self.tail_pages[which_tp][where_in_tp] = \
+            [back, new_tid, ts, enc] + list(columns)
+        self.base_page[idx] = [new_tid, None, None, ever]
+        self.count_tail_rec += 1
+
+    def __append_full_tail(self, idx, rid, columns, enc, ts):
+        """ Write a cumulative tail record with full rows
+        """
         tid = self.base_page[idx, Config.COL_IDR]
         # add a new one if there's not enough space in self.tail_pages
-        if len(self.tail_pages)*Config.MAX_RECORDS <= self.count_tail_rec:
-            self.tail_pages.append(Page(self.N_COLS))
+        if len(self.tail_pages)*self.MAX_RECORDS <= self.count_tail_rec:
+            self.tail_pages.append(Page(self.N_COLS, self.MAX_RECORDS))
 
+        # The tail record is written before the base record points at it, so
+        #   reads running at the same time never see an empty one
         # if there's an indirection; aka tid isn't 0
         if tid:
-            ts = int(time())
             new_tid = self.count_tail_rec + 1
             old_enc = self.base_page[idx, Config.COL_ENC]
             new_enc = enc | old_enc
-            # Base Page:
-            #   IDR        RID    TS     ENC      *usercolumns
-            #   new_tid    None   None   new_enc   None
-            cols = [new_tid, None, None, new_enc]
-            cols += [None] * len(columns)
-            self.base_page[idx] = cols
 
             # Tail Page:
             # IDR in tail page that points to base page has a first bit of
@@ -154,17 +518,17 @@ class Partition:
 
             which_tp, where_in_tp = self.__get_tail_page_idx(new_tid)
             self.tail_pages[which_tp][where_in_tp] = cols_to_write
+
+            # Base Page:
+            #   IDR        RID    TS     ENC      *usercolumns
+            #   new_tid    None   None   new_enc   None
+            cols = [new_tid, None, None, new_enc]
+            cols += [None] * len(columns)
+            self.base_page[idx] = cols
         # no indirection
         else:
             # intiialize tid as the tid of the latest slot in tail page
             tid = self.count_tail_rec + 1
-            ts = int(time())
-            # Base Page:
-            #   IDR    RID    TS     ENC   *usercolumns
-            #   tid    None   None   enc   None
-            cols = [tid, None, None, enc]
-            cols += [None] * len(columns)
-            self.base_page[idx] = cols
 
             # Tail Page:
             # IDR in tail page that points to base page has a first bit of
@@ -173,19 +537,132 @@ class Partition:
             #   rid    tid    ts     enc   columns
             which_tp, where_in_tp = self.__get_tail_page_idx(tid)
             # meta_cols for tail_page
-            cols = (rid+Config.MARK_1ST_BIT, tid, ts, enc) + columns
+            cols = (rid+Config.MARK_1ST_BIT, tid, ts, enc) + tuple(columns)
             self.tail_pages[which_tp][where_in_tp] = cols
 
+            # Base Page:
+            #   IDR    RID    TS     ENC   *usercolumns
+            #   tid    None   None   enc   None
+            cols = [tid, None, None, enc]
+            cols += [None] * len(columns)
+            self.base_page[idx] = cols
+
+        self.count_tail_rec += 1
+
+    def __append_sparse_tail(self, idx, rid, columns, enc, ts):
+        """ self.__append_tail for the sparse tail layout
+        """
+        tid = self.base_page[idx, Config.COL_IDR]
+        new_tid = self.count_tail_rec + 1
+        which_tp, where_in_tp = self.__get_tail_page_idx(new_tid)
+        if which_tp == len(self.tail_meta):
+            self.tail_meta.append(
+                Page(Config.N_META_COLS + 1, self.MAX_RECORDS))
+
+        ever = enc | self.base_page[idx, Config.COL_ENC]
+        if tid and not self.CUMULATIVE:
+            old_enc = 0
+            back = tid
+        elif tid:
+            # positions of the columns updated before are copied forward
+            which_prev, where_prev = self.__get_tail_page_idx(tid)
+            prev = self.tail_meta[which_prev]
+            old_enc = prev[where_prev, Config.COL_ENC]
+            old_start = prev[where_prev, Config.N_META_COLS]
+            old_rank = ranks(old_enc, self.N_COLS)
+            back = tid
+        else:
+            old_enc = 0
+            back = rid + Config.MARK_1ST_BIT
+        new_enc = enc | old_enc
+
+        start = len(self.tail_map)
+        for col in ranks(new_enc, self.N_COLS):
+            val = columns[col - Config.N_META_COLS]
+            if val is None:
+                self.tail_map.append(self.tail_map[old_start + old_rank[col]])
+            else:
+                self.__map_append(self.__seg_append(col, val))
+
+        #   IDR    RID        TS     ENC       map
+        #   back   new_tid    ts     new_enc   start
+        self.tail_meta[which_tp][where_in_tp] = \
+            [back, new_tid, ts, new_enc, start]
+        self.base_page[idx] = [new_tid, None, None, ever]
         self.count_tail_rec += 1
 
+    def __seg_append(self, col, val):
+        """ Append @val to the tail segment of column @col (INCLUDING
+            meta-cols)
+        Returns:
+            Position of @val in the segment
+        """
+        j = col - Config.N_META_COLS
+        pos = self.tail_seg_counts[j]
+        seg = self.tail_segs[j]
+        if pos == len(seg) * self.MAX_RECORDS:
+            seg.append(MemPage(self.MAX_RECORDS))
+        seg[-1][pos % self.MAX_RECORDS] = val
+        self.tail_seg_counts[j] += 1
+        return pos
+
+    def __map_append(self, pos):
+        """ Append the position @pos to self.tail_map, widening its items
+            first if @pos doesn't fit. Reads running at the same time keep
+            the old array, which has all the positions they can reach.
+        """
+        if pos >> 8 * self.tail_map.itemsize:
+            typecode = next(code for code in MAP_TYPECODES
+                            if not pos >> 8 * array(code).itemsize)
+            self.tail_map = array(typecode, self.tail_map)
+        self.tail_map.append(pos)
+
+    def __seg_value(self, col, pos):
+        """ Value at @pos in the tail segment of column @col (INCLUDING
+            meta-cols)
+        """
+        seg = self.tail_segs[col - Config.N_META_COLS]
+        return seg[pos // self.MAX_RECORDS][pos % self.MAX_RECORDS]
+
+    @latched
     def delete(self, idx):
-        self.base_page[idx] = [0] + [None] * (self.N_COLS - 1)
+        """ Leave a tombstone at @idx: both the indirection and the RID are set
+            to 0. The slot is only reclaimed by Table.vacuum.
+        Returns:
+            True if the record was alive before.
+        """
+        if self.is_deleted(idx):
+            return False
+        self.base_page[idx] = [0, 0] + [None] * (self.N_COLS - 2)
         if idx in self.updated_idxs:
             self.updated_idxs.remove(idx)
+        self.count_deleted += 1
+        self.__dirty = True
+        return True
+
+    def is_deleted(self, idx):
+        """ Whether the record at @idx has a tombstone
+        """
+        return self.base_page[idx, Config.COL_RID] == 0
 
+    @latched
     def merge(self):
         """ merge tail pages with base page
         """
+        if self.SPARSE_TAILS or not self.CUMULATIVE:
+            query_columns = [0] * Config.N_META_COLS
+            query_columns += [1] * (self.N_COLS - Config.N_META_COLS)
+            while len(self.updated_idxs) > 0:
+                idx = self.updated_idxs.pop()
+                merged_rec = [0, None, None, 0]
+                merged_rec += self.read(idx, query_columns)
+                self.base_page[idx] = merged_rec
+            self.count_tail_rec = 0
+            self.chain_lens = {}
+            self.__init_tails()
+            self.__rebuild_zones()
+            return
+
         # for every base page index that has been updated
         while len(self.updated_idxs) > 0:
             # base page idx of the record that has been updated
@@ -212,7 +689,64 @@ class Partition:
             self.base_page[idx] = merged_rec
         # clear tail page
         self.count_tail_rec = 0
-        self.tail_pages = [Page(self.N_COLS)]
+        self.tail_pages = [Page(self.N_COLS, self.MAX_RECORDS)]
+        self.__rebuild_zones()
+
+    def summary(self):
+        """ Metadata of the partition that's kept in memory even when the
+            partition itself is on the disk.
+        Returns:
+            dict with the number of base records 'n_records', of tombstones
+                'n_deleted', & a copy of the zone map 'zones'.
+        """
+        return {
+            'n_records': self.count_base_rec,
+            'n_deleted': self.count_deleted,
+            'zones': [None if z is None else list(z) for z in self.zones],
+        }
+
+    def __widen(self, columns):
+        """ Widen the zone map to include the user column values @columns;
+            None values are skipped.
+        """
+        for i, val in enumerate(columns):
+            if val is None:
+                continue
+            zone = self.zones[i]
+            if zone is None:
+                self.zones[i] = [val, val]
+            elif val < zone[0]:
+                zone[0] = val
+            elif val > zone[1]:
+                zone[1] = val
+
+    def __rebuild_zones(self):
+        """ Compute the exact zone map of the live records
+        """
+        query_columns = [0] * Config.N_META_COLS
+        query_columns += [1] * (self.N_COLS - Config.N_META_COLS)
+        rows = [
+            self.read(idx, query_columns)
+            for idx in range(self.count_base_rec) if not self.is_deleted(idx)
+        ]
+        self.zones = [
+            [min(vals), max(vals)] if vals else None
+            for vals in (zip(*rows) if rows else [()] * len(self.zones))
+        ]
+
+    def size(self):
+        """
+        Returns:
+            Number of bytes held by the pages of this partition
+        """
+        size_page = self.MAX_RECORDS * Config.SIZE_INT
+        if self.SPARSE_TAILS:
+            n_pages = self.N_COLS
+            n_pages += len(self.tail_meta) * (Config.N_META_COLS + 1)
+            n_pages += sum(len(seg) for seg in self.tail_segs)
+            return n_pages * size_page + \
+                len(self.tail_map) * self.tail_map.itemsize
+        return (1 + len(self.tail_pages)) * self.N_COLS * size_page
 
     def is_dirty(self):
         return self.__dirty
@@ -220,6 +754,9 @@ class Partition:
     def set_clean(self):
         self.__dirty = False
 
+    def set_dirty(self):
+        self.__dirty = True
+
     def __get_tail_page_idx(self, tid):
         """ Internal Method for info for where to find a record in tail page
             based on @tid.
@@ -227,5 +764,5 @@ class Partition:
             which_tail_page, where_in_that_tail_page_in_terms_of_starting_idx
         """
         tid -= 1
-        rem = tid % Config.MAX_RECORDS
-        return int((tid - rem) / Config.MAX_RECORDS), rem
+        rem = tid % self.MAX_RECORDS
+        return int((tid - rem) / self.MAX_RECORDS), rem
@@ -18,24 +18,49 @@ class Query:
         self.table.delete(key)
 
     def insert(self, *columns):
-        self.table.insert(*columns)
+        return self.table.insert(*columns)
 
-    def select(self, key, indexing_col, query_columns):
-        return self.table.select(key, indexing_col, query_columns)
+    def select(self, key, indexing_col, query_columns, columnar=False):
+        return self.table.select(key, indexing_col, query_columns, columnar)
+
+    def select_range(self, begin, end, indexing_col, query_columns,
+                     columnar=False):
+        return self.table.select_range(
+            begin, end, indexing_col, query_columns, columnar)
 
     def update(self, key, *columns):
         self.table.update(key, *columns)
 
+    def update_batch(self, updates):
+        return self.table.update_many(updates)
+
+    def upsert(self, records):
+        return self.table.upsert(records)
+
     def increment(self, key, column):
         return self.table.increment(key, column)
 
+    def add(self, key, column, delta):
+        return self.table.add(key, column, delta)
+
+    def add_batch(self, deltas):
+        return self.table.add_many(deltas)
+
     """
     :param start_range: int         # Start of the key range to aggregate
     :param end_range: int           # End of the key range to aggregate
     :param aggregate_columns: int  # Index of desired column to aggregate
     """
 
-    def sum(self, start_range, end_range, aggregate_column_index):
+    def sum(self, start_range, end_range, aggregate_column_index,
+            parallel=False):
+        # clustered tables only read the partitions of the range, and
+        #   materialized sums don't read the records at all
+        if parallel or self.table.key_dir is not None or \
+                self.table.materialized(aggregate_column_index, 'sum'):
+            return self.table.aggregate(
+                start_range, end_range, aggregate_column_index, 'sum',
+                parallel)
         indexing_col = self.table.COL_KEY - Config.N_META_COLS
         query_columns = [0] * self.table.num_columns
         query_columns[aggregate_column_index] = 1
@@ -47,3 +72,22 @@ class Query:
             result = results[0]
             total += result.columns[0]
         return total
+
+    def count(self, start_range, end_range, aggregate_column_index,
+              parallel=False):
+        return self.table.aggregate(
+            start_range, end_range, aggregate_column_index, 'count', parallel)
+
+    def min(self, start_range, end_range, aggregate_column_index,
+            parallel=False):
+        return self.table.aggregate(
+            start_range, end_range, aggregate_column_index, 'min', parallel)
+
+    def max(self, start_range, end_range, aggregate_column_index,
+            parallel=False):
+        return self.table.aggregate(
+            start_range, end_range, aggregate_column_index, 'max', parallel)
+
+    def scan(self, query_columns, columnar=False, parallel=False,
+             where=None):
+        return self.table.scan(query_columns, columnar, parallel, where)
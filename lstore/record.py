@@ -0,0 +1,30 @@
+from array import array
+
+
+class Record:
+    # No per-record __dict__; a select allocates one of these for every match
+    __slots__ = ('rid', 'key', 'columns')
+
+    def __init__(self, rid, key, columns):
+        self.rid = rid
+        self.key = key
+        self.columns = columns
+    def getcolumnvalue(self, index):
+        return self.columns[index]
+
+
+class ColumnarResult:
+    """ Result of a select in columnar mode.
+        - rids: array of the RIDs of the matching records
+        - columns: list of arrays, one for each queried column, where
+            columns[j][i] is the value of the j-th queried column of the
+            record rids[i].
+    """
+    __slots__ = ('rids', 'columns')
+
+    def __init__(self, n_cols):
+        self.rids = array('Q')
+        self.columns = [array('Q') for _ in range(n_cols)]
+
+    def __len__(self):
+        return len(self.rids)
@@ -0,0 +1,455 @@
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Client, Listener
+from lstore.config import Config
+from lstore.db import Database
+from lstore.parallel import combine_partials
+from lstore.query import Query
+from lstore.record import ColumnarResult
+import os
+import tempfile
+import threading
+
+
+class PipeTransport:
+    """ Router-shard IPC over a multiprocessing pipe.
+
+    A transport has 2 methods:
+        - listen(): called by the router before a shard is started.
+            Returns (endpoint, accept) where the picklable endpoint is handed
+            to the shard process, and accept() returns the connection of the
+            router once the shard has connected.
+        - connect(endpoint): called by the shard process.
+            Returns the connection of the shard.
+    Connections only need send, recv & close as in multiprocessing.connection.
+    """
+
+    def listen(self):
+        router, shard = Pipe()
+        return shard, lambda: router
+
+    def connect(self, endpoint):
+        return endpoint
+
+
+class UnixSocketTransport:
+    """ Router-shard IPC over Unix domain sockets. See PipeTransport.
+    """
+
+    def __init__(self, directory=None):
+        """
+        Arguments:
+            - directory: str
+                Where the socket files are created; a temporary directory if
+                not given.
+        """
+        self.directory = directory
+
+    def listen(self):
+        directory = self.directory or tempfile.mkdtemp()
+        fd, address = tempfile.mkstemp(suffix='.sock', dir=directory)
+        os.close(fd)
+        os.remove(address)
+        listener = Listener(address, 'AF_UNIX')
+
+        def accept():
+            conn = listener.accept()
+            listener.close()
+            return conn
+        return address, accept
+
+    def connect(self, endpoint):
+        return Client(endpoint, 'AF_UNIX')
+
+
+TRANSPORTS = {
+    'pipe': PipeTransport,
+    'unix': UnixSocketTransport,
+}
+
+
+def _serve(transport, endpoint, path, buffer_size, cc_mode):
+    """ Main loop of a shard process: a Database of its own that runs the
+        requests of the router one at a time.
+
+    Requests are (table name, method, args). With a table name, @method of
+      the Query of that table is called; without, @method of the Database.
+      Creating or opening a table returns its (num_columns, key).
+    Replies are (True, result) or (False, exception).
+    """
+    conn = transport.connect(endpoint)
+    db = Database(buffer_size, cc_mode)
+    db.open(path)
+    # Key: table name; Value: Query obj of the table
+    queries = {}
+    while True:
+        try:
+            name, method, args = conn.recv()
+        except EOFError:
+            break
+        try:
+            if name is not None:
+                result = getattr(queries[name], method)(*args)
+            elif method in ('create_table', 'get_table'):
+                table = getattr(db, method)(*args)
+                queries[table.name] = Query(table)
+                result = (table.num_columns,
+                          table.COL_KEY - Config.N_META_COLS)
+            else:
+                if method == 'drop_table':
+                    queries.pop(args[0], None)
+                result = getattr(db, method)(*args)
+            reply = (True, result)
+        except Exception as e:
+            reply = (False, e)
+        conn.send(reply)
+        if name is None and method == 'close':
+            break
+    conn.close()
+
+
+class Shard:
+    """ Router side of a shard process
+    """
+
+    def __init__(self, conn, process):
+        self.conn = conn
+        self.process = process
+        # one request at a time per connection
+        self.lock = threading.Lock()
+
+
+class ShardedDatabase:
+    """ Database whose tables are hash-partitioned by key across shard
+        processes on this machine. Every shard owns a Database, and so its own
+        Tables & Bufferpools, under a directory of its own. Use ShardedQuery
+        on the tables it returns:
+
+    db = ShardedDatabase(n_shards=4)
+    db.open('./ECS165')
+    grades_table = db.create_table('Grades', 5, 0)
+    q = ShardedQuery(grades_table)
+
+    Transactions are not supported across shards.
+    """
+
+    def __init__(self, n_shards=Config.N_SHARDS,
+                 buffer_size=Config.SIZE_BUFFER, cc_mode=Config.CC_MODE,
+                 transport=Config.SHARD_TRANSPORT):
+        """
+        Arguments:
+            - n_shards: int
+                Number of shard processes; number of CPUs if None.
+            - buffer_size: int
+                Memory budget in bytes, split evenly among the shards.
+            - cc_mode: str
+                Concurrency control within the shards: 'lock' or 'occ'.
+            - transport: str or transport obj
+                'pipe', 'unix', or an obj with the interface of
+                PipeTransport.
+        """
+        self.n_shards = n_shards or os.cpu_count()
+        self.buffer_size = buffer_size
+        self.cc_mode = cc_mode
+        if isinstance(transport, str):
+            transport = TRANSPORTS[transport]()
+        self.transport = transport
+        self.shards = []
+        self.tables = {}
+        self.path = None
+
+    def open(self, path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = path
+        for i in range(self.n_shards):
+            endpoint, accept = self.transport.listen()
+            process = Process(
+                target=_serve,
+                args=(self.transport, endpoint,
+                      os.path.join(path, 'shard%d' % i),
+                      self.buffer_size // self.n_shards, self.cc_mode),
+                daemon=True
+            )
+            process.start()
+            self.shards.append(Shard(accept(), process))
+
+    def close(self):
+        self.call({i: (None, 'close', ()) for i in range(self.n_shards)})
+        for shard in self.shards:
+            shard.conn.close()
+            shard.process.join()
+        self.shards = []
+
+    def checkpoint(self):
+        self.call({i: (None, 'checkpoint', ()) for i in range(self.n_shards)})
+
+    def create_table(self, name, num_columns, key, *args):
+        """ Creates a new table on every shard. @args are passed on to
+            Database.create_table.
+        Returns:
+            ShardedTable obj of the table.
+        """
+        self.call({
+            i: (None, 'create_table', (name, num_columns, key) + args)
+            for i in range(self.n_shards)
+        })
+        table = ShardedTable(self, name, num_columns, key)
+        self.tables[name] = table
+        return table
+
+    def get_table(self, name, quota=None):
+        metas = self.call({
+            i: (None, 'get_table', (name, quota))
+            for i in range(self.n_shards)
+        })
+        num_columns, key = metas[0]
+        table = ShardedTable(self, name, num_columns, key)
+        self.tables[name] = table
+        return table
+
+    def drop_table(self, name):
+        self.call({
+            i: (None, 'drop_table', (name,)) for i in range(self.n_shards)
+        })
+        self.tables.pop(name, None)
+
+    def call(self, requests):
+        """ Scatter-gather: send the requests to their shards, then wait for
+            all replies, so the shards work on them at the same time.
+        Arguments:
+            - requests: dict
+                Key:   index of a shard
+                Value: (table name, method, args); see _serve
+        Returns:
+            dict with the index of a shard as the key & the result of its
+                request as the value.
+        Raises:
+            The exception of the first shard that failed, once all replies
+                are in.
+        """
+        order = sorted(requests)
+        # locks are taken in order so concurrent callers don't deadlock
+        for i in order:
+            self.shards[i].lock.acquire()
+        try:
+            for i in order:
+                self.shards[i].conn.send(requests[i])
+            replies = {i: self.shards[i].conn.recv() for i in order}
+        finally:
+            for i in order:
+                self.shards[i].lock.release()
+
+        for i in order:
+            ok, result = replies[i]
+            if not ok:
+                raise result
+        return {i: result for i, (_, result) in replies.items()}
+
+
+class ShardedTable:
+    """ Router side of a table of ShardedDatabase
+    """
+
+    def __init__(self, db, name, num_columns, key):
+        self.db = db
+        self.name = name
+        self.num_columns = num_columns
+        self.key = key
+
+    def shard_of(self, key):
+        """
+        Returns:
+            Index of the shard that owns @key
+        """
+        return hash(key) % self.db.n_shards
+
+    def call(self, shard, method, *args):
+        """ Run Query.@method(*args) of this table on one shard
+        """
+        return self.db.call({shard: (self.name, method, args)})[shard]
+
+    def broadcast(self, method, *args):
+        """ Run Query.@method(*args) of this table on all shards
+        Returns:
+            List of results in shard order.
+        """
+        results = self.db.call({
+            i: (self.name, method, args) for i in range(self.db.n_shards)
+        })
+        return [results[i] for i in range(self.db.n_shards)]
+
+    def scatter(self, method, items, key_of):
+        """ Group @items by the shard of their keys & run Query.@method(group)
+            on the shards at the same time.
+        Returns:
+            List of results in shard order.
+        """
+        groups = {}
+        for item in items:
+            groups.setdefault(self.shard_of(key_of(item)), []).append(item)
+        if not groups:
+            return []
+        results = self.db.call({
+            i: (self.name, method, (group,)) for i, group in groups.items()
+        })
+        return [results[i] for i in sorted(results)]
+
+
+class ShardedQuery:
+    """ Query API over a ShardedTable. Queries on a key go to the shard that
+        owns it; range queries, aggregates & scans are sent to all shards and
+        their results are combined. RIDs in the results are local to their
+        shards.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.COL = table.key
+
+    def delete(self, key):
+        self.table.call(self.table.shard_of(key), 'delete', key)
+
+    def insert(self, *columns):
+        """
+        Returns:
+            RID of the new record in the shard that owns its key.
+        """
+        return self.table.call(
+            self.table.shard_of(columns[self.COL]), 'insert', *columns)
+
+    def select(self, key, indexing_col, query_columns, columnar=False):
+        if indexing_col == self.COL:
+            return self.table.call(
+                self.table.shard_of(key), 'select', key, indexing_col,
+                query_columns, columnar)
+        return self.__gather(self.table.broadcast(
+            'select', key, indexing_col, query_columns, columnar), columnar)
+
+    def select_range(self, begin, end, indexing_col, query_columns,
+                     columnar=False):
+        """ Results are grouped by shard
+        """
+        return self.__gather(self.table.broadcast(
+            'select_range', begin, end, indexing_col, query_columns,
+            columnar), columnar)
+
+    def update(self, key, *columns):
+        new_key = columns[self.COL]
+        if self.__moves(key, new_key):
+            self.__move(key, columns)
+        else:
+            self.table.call(self.table.shard_of(key), 'update', key, *columns)
+
+    def update_batch(self, updates):
+        updates = list(updates)
+        local = [u for u in updates if not self.__moves(u[0], u[1][self.COL])]
+        n = sum(self.table.scatter('update_batch', local, lambda u: u[0]))
+        for key, columns in updates:
+            if self.__moves(key, columns[self.COL]):
+                n += self.__move(key, columns)
+        return n
+
+    def upsert(self, records):
+        records = list(records)
+        local = [r for r in records if not self.__moves(r[0], r[1][self.COL])]
+        n = sum(self.table.scatter('upsert', local, lambda r: r[0]))
+        for key, columns in records:
+            if self.__moves(key, columns[self.COL]) and \
+                    not self.__move(key, columns):
+                self.insert(*[0 if col is None else col for col in columns])
+                n += 1
+        return n
+
+    def increment(self, key, column):
+        return self.add(key, column, 1)
+
+    def add(self, key, column, delta):
+        columns = [None] * self.table.num_columns
+        columns[column] = delta
+        return self.add_batch([(key, columns)]) > 0
+
+    def add_batch(self, deltas):
+        deltas = list(deltas)
+        local = [d for d in deltas if not d[1][self.COL]]
+        n = sum(self.table.scatter('add_batch', local, lambda d: d[0]))
+        # deltas of the key itself may move the record to another shard
+        for key, columns in deltas:
+            if not columns[self.COL]:
+                continue
+            all_cols = [1] * self.table.num_columns
+            found = self.select(key, self.COL, all_cols)
+            if not found:
+                continue
+            new_columns = [
+                None if delta is None else old + delta
+                for old, delta in zip(found[0].columns, columns)
+            ]
+            self.update(key, *new_columns)
+            n += 1
+        return n
+
+    def sum(self, start_range, end_range, aggregate_column_index,
+            parallel=False):
+        return sum(self.table.broadcast(
+            'sum', start_range, end_range, aggregate_column_index, parallel))
+
+    def count(self, start_range, end_range, aggregate_column_index,
+              parallel=False):
+        return combine_partials('count', self.table.broadcast(
+            'count', start_range, end_range, aggregate_column_index,
+            parallel))
+
+    def min(self, start_range, end_range, aggregate_column_index,
+            parallel=False):
+        return combine_partials('min', self.table.broadcast(
+            'min', start_range, end_range, aggregate_column_index, parallel))
+
+    def max(self, start_range, end_range, aggregate_column_index,
+            parallel=False):
+        return combine_partials('max', self.table.broadcast(
+            'max', start_range, end_range, aggregate_column_index, parallel))
+
+    def scan(self, query_columns, columnar=False, parallel=False,
+             where=None):
+        """ Results are grouped by shard
+        """
+        return self.__gather(self.table.broadcast(
+            'scan', query_columns, columnar, parallel, where), columnar)
+
+    def __moves(self, key, new_key):
+        """ Whether changing @key to @new_key moves a record to another shard
+        """
+        return new_key is not None and \
+            self.table.shard_of(new_key) != self.table.shard_of(key)
+
+    def __move(self, key, columns):
+        """ Update the record of @key with @columns, which change its key to
+            one owned by another shard: the record is deleted from its shard
+            & inserted into the other. Not atomic.
+        Returns:
+            1 if the record was moved; 0 if there's no record of @key.
+        """
+        all_cols = [1] * self.table.num_columns
+        found = self.select(key, self.COL, all_cols)
+        if not found:
+            return 0
+        new_columns = [
+            old if new is None else new
+            for old, new in zip(found[0].columns, columns)
+        ]
+        self.delete(key)
+        self.insert(*new_columns)
+        return 1
+
+    @staticmethod
+    def __gather(results, columnar):
+        """ Concatenate the results of the shards
+        """
+        if not columnar:
+            return [record for result in results for record in result]
+        merged = ColumnarResult(len(results[0].columns))
+        for result in results:
+            merged.rids.extend(result.rids)
+            for arr, part in zip(merged.columns, result.columns):
+                arr.extend(part)
+        return merged
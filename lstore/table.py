@@ -1,23 +1,24 @@
-from lstore.bufferpool import Bufferpool
+from lstore.bufferpool import Bufferpool, BufferManager, dump_atomic
 from lstore.partition import *
 from lstore.index import Index
-from time import time
+from lstore.cluster import KeyDirectory
+from lstore.aggregate import MaterializedAggregate, OPS
+from lstore.cache import RecordCache
+from lstore.record import Record, ColumnarResult
+from lstore.parallel import run_partitions, aggregate_partition, \
+    scan_partition, combine_partials
+from bisect import bisect_left, bisect_right
+from contextlib import nullcontext
+from time import sleep, time
 import os
 import pickle
 import threading
 
 
-class Record:
-    def __init__(self, rid, key, columns):
-        self.rid = rid
-        self.key = key
-        self.columns = columns
-    def getcolumnvalue(self, index):
-        return self.columns[index]
-
-
 class Table:
-    def __init__(self, name, num_columns, key, path):
+    def __init__(self, name, num_columns, key, path, buffer=None, quota=None,
+                 max_records=Config.MAX_RECORDS, clustered=False,
+                 sparse_tails=False, cumulative=True):
         """
         Table consists of 4 meta-columns (indirection, RID, Timestamp, &
         schema encoding) and user-defined columns.
@@ -36,13 +37,37 @@ class Table:
                 Human language translation: which column has the keys
             - path: str
                 Path to the root dir of the DB on the disk
+            - buffer: BufferManager
+                Buffer manager shared with other tables. A private one is
+                created if not given.
+            - quota: int
+                Optional max number of bytes of this table in the buffer.
+            - max_records: int
+                Number of records per partition. Larger partitions favor
+                scans, smaller ones favor point queries & cheaper evictions.
+            - clustered: bool
+                Place records in partitions by key range instead of insertion
+                order, so that range queries on the key only touch the
+                partitions of the range. See KeyDirectory.
+            - sparse_tails: bool
+                Tail records only store the columns they update. Saves memory
+                on update-heavy tables; see Partition.
+            - cumulative: bool
+                Cumulative tail records give one-hop reads; non-cumulative
+                ones give cheaper updates & reads that walk a bounded chain.
+                See Partition.
         """
         # CONSTANTS
         self.num_columns = num_columns  # constant; lower b/c of tester calls
         self.COL_KEY = key + Config.N_META_COLS
         self.N_TOTAL_COLS = num_columns + Config.N_META_COLS
+        self.MAX_RECORDS = max_records
         self.PATH_TABLE = os.path.join(path, name)
         self.PATH_INDEX = os.path.join(self.PATH_TABLE, 'index')
+        self.PATH_FSM = os.path.join(self.PATH_TABLE, 'fsm')
+        self.PATH_META = os.path.join(self.PATH_TABLE, 'meta')
+        self.PATH_CHECKPOINT = os.path.join(self.PATH_TABLE, 'checkpoint')
+        self.PATH_KEYDIR = os.path.join(self.PATH_TABLE, 'keydir')
         self.name = name
 
         self.__num_records = 0  # keeps track of # of records & RID
@@ -50,14 +75,41 @@ class Table:
         # Key:   rid
         # Value: (threading.Lock, lock_type) where lock_type in ['S', 'X']
         self.glb_locks = {}
-        self.__lock = threading.Lock()  # lock for accessing lock manager
+        # Key:   rid
+        # Value: number of times the record has been written; used by
+        #        optimistic transactions to validate what they read
+        self.rid_versions = {}
+        # Key:   id of the own_locks dict of a running transaction
+        # Value: the dict; its locks follow the records moved by a split
+        self.lock_holders = {}
+        # concurrency control of transactions: 'lock' or 'occ'
+        self.cc_mode = Config.CC_MODE
+        # cache of resolved records; see self.set_cache
+        self.cache = None
+        if Config.CACHE_RECORDS:
+            self.cache = RecordCache(Config.CACHE_RECORDS)
+        # lock for accessing lock manager; reentrant since aborts release the
+        #   locks while holding it
+        self.__lock = threading.RLock()
         self.__lock_n_rec = threading.Lock()
         self.__lock_index = threading.Lock()
+        # makes read-modify-write of self.add_many atomic
+        self.__lock_add = threading.Lock()
+        # serializes the inserts & splits of a clustered table, and its
+        #   writes to existing records since a split moves them; see
+        #   self.__lock_layout
+        self.__lock_insert = threading.RLock()
+        if buffer is None:
+            buffer = BufferManager()
         self.buffer = Bufferpool(
-            Config.SIZE_BUFFER,
+            buffer,
             self.N_TOTAL_COLS,
             self.COL_KEY,
-            self.PATH_TABLE
+            self.PATH_TABLE,
+            quota,
+            max_records,
+            sparse_tails,
+            cumulative
         )
 
         if not os.path.exists(self.PATH_INDEX):
@@ -65,9 +117,61 @@ class Table:
         else:
             with open(self.PATH_INDEX, 'rb') as f:
                 self.index = pickle.load(f)
+            self.index.table = self
+            self.index.attach()
         self.index.init_lock(threading.RLock())
 
-    def check_n_lock(self, queries):
+        # Free-space map
+        # Key:   index of a partition
+        # Value: number of deleted records (tombstones) in that partition
+        self.fsm = {}
+        if os.path.exists(self.PATH_FSM):
+            with open(self.PATH_FSM, 'rb') as f:
+                self.fsm = pickle.load(f)
+
+        # Key directory of a clustered table; None for insertion order
+        self.key_dir = None
+        if os.path.exists(self.PATH_KEYDIR):
+            with open(self.PATH_KEYDIR, 'rb') as f:
+                self.key_dir = pickle.load(f)
+        elif clustered:
+            self.key_dir = KeyDirectory()
+
+        # Recovery: index, fsm & materialized aggregates are as of the last
+        #   checkpoint, so only the partitions written to the disk after it
+        #   need to be read again
+        self.__lock_checkpoint = threading.Lock()
+        seq = 0
+        # Materialized aggregates; see self.materialize
+        self.aggregates = []
+        if os.path.exists(self.PATH_CHECKPOINT):
+            with open(self.PATH_CHECKPOINT, 'rb') as f:
+                saved = pickle.load(f)
+            seq = saved['seq']
+            self.aggregates = [
+                pickle.loads(agg) for agg in saved.get('aggregates', ())
+            ]
+        # the log of writes is empty after a checkpoint trimmed it; keep
+        #   counting from the checkpoint
+        self.buffer.seq = max(self.buffer.seq, seq)
+        n_parts = len(self.buffer.partitions)
+        # RIDs are dense, so the number of records follows from the last
+        #   partition
+        self.__num_records = (n_parts - 1) * self.MAX_RECORDS
+        self.__num_records += self.buffer[-1].count_base_rec
+        stale = {i for i in self.buffer.writes_since(seq) if i < n_parts}
+        if stale:
+            self.__recover(stale)
+        # partitions of the checkpoint that are gone, e.g., emptied by a
+        #   vacuum
+        for agg in self.aggregates:
+            for idx_part in agg.partitions():
+                if idx_part >= n_parts:
+                    agg.reset(idx_part)
+        if not os.path.exists(self.PATH_META):
+            self.__write_meta()
+
+    def check_n_lock(self, queries, conflicts=None):
         """
         delete, insert, update, increment: X lock
         select: S lock
@@ -75,13 +179,22 @@ class Table:
         Arguments:
             queries: list
                 List of query functions and their arguments
+            conflicts: list
+                If given, the RID whose lock caused an abort is appended.
         """
         own_locks = {}
+        with self.__lock:
+            self.lock_holders[id(own_locks)] = own_locks
         for i, (query, args) in enumerate(queries):
             # Require X lock
-            if query.__name__ in ['delete', 'update', 'increment', 'insert']:
+            if query.__name__ in ['delete', 'update', 'increment', 'insert',
+                                  'add']:
                 # get the rid that it performs on
-                if query.__name__ == 'insert':
+                if query.__name__ == 'insert' and self.key_dir is not None:
+                    # the RID of the new record of a clustered table follows
+                    #   from where it's written
+                    continue
+                elif query.__name__ == 'insert':
                     # new rid is num_records + 1
                     # but dont increment the counter here since it will be
                     #   added one later in the actual insertion
@@ -105,11 +218,13 @@ class Table:
                                 del own_locks[rid]
                                 self.glb_locks[rid] -= 1
                                 self.release_lock(own_locks)
+                                self.__conflict(conflicts, rid)
                                 return False
                     # rid has been locked
                     elif rid in self.glb_locks and rid not in own_locks:
                         #  Abbborrt
                         self.release_lock(own_locks)
+                        self.__conflict(conflicts, rid)
                         return False
                     elif rid not in self.glb_locks and rid not in own_locks:
                         own_locks[rid] = 'X'
@@ -137,6 +252,8 @@ class Table:
                         if l == 'X':
                             #  Abbborrt
                             self.release_lock(own_locks)
+                            self.__conflict(conflicts, rid)
+                            return False
                         # It's an S lock, so let's own it too
                         else:
                             self.glb_locks[rid] += 1
@@ -148,6 +265,13 @@ class Table:
                         raise ValueError('Impossible case')
             else:
                 raise ValueError('Unknown query function %s' % query.__name__)
+            # a split of a clustered table may have moved the record between
+            #   locating and locking it
+            if self.key_dir is not None and query.__name__ != 'insert' \
+                    and self.index.locate(0, args[0])[0] != rid:
+                self.release_lock(own_locks)
+                self.__conflict(conflicts, rid)
+                return False
         for query, args in queries:
             query(*args)
         self.release_lock(own_locks)
@@ -156,28 +280,336 @@ class Table:
     def release_lock(self, own_locks):
         """ Release all of the locks present in @queries
         """
-        for rid in own_locks:
-            l = own_locks[rid]
-            # simply release it from the glb locks
-            if l == 'X':
-                with self.__lock:
+        with self.__lock:
+            self.lock_holders.pop(id(own_locks), None)
+            for rid in own_locks:
+                l = own_locks[rid]
+                # simply release it from the glb locks; same if this is the
+                #   only one that owns the S lock
+                if l == 'X' or self.glb_locks[rid] == l:
                     del self.glb_locks[rid]
+                # give back the S locks of this one only
+                else:
+                    self.glb_locks[rid] -= l
+
+    def run_optimistic(self, queries, conflicts=None):
+        """ Optimistic concurrency control:
+            - Read phase: without any locks, locate the records of every query
+                and remember their versions, run the selects, and buffer the
+                writes.
+            - Validation: atomically check that no record has a newer version
+                and that none is locked by a pessimistic transaction.
+            - Write phase: X lock the records written, install the buffered
+                writes in order, and release the locks. The records inserted
+                are X locked as soon as they're written, so the later writes
+                of the transaction on their keys run under its locks.
+            A write on a key that has no record, and isn't inserted earlier in
+                the transaction, aborts the transaction.
+
+        Arguments:
+            queries: list
+                List of query functions and their arguments
+            conflicts: list
+                If given, the RID that failed validation is appended.
+        Returns:
+            True if committed; False if aborted because of a conflict.
+        """
+        indexing_col = self.COL_KEY - Config.N_META_COLS
+        # Key: rid; Value: version when it was first seen
+        read_set = {}
+        write_rids = set()
+        writes = []
+        # keys of the records inserted by this transaction
+        inserted = set()
+        for query, args in queries:
+            name = query.__name__
+            if name == 'insert':
+                writes.append((query, args))
+                inserted.add(args[indexing_col])
+                continue
+            elif name == 'select':
+                rids = self.index.locate(args[1], args[0])
+            elif name in ['delete', 'update', 'increment', 'add']:
+                rids = self.index.locate(indexing_col, args[0])
+                if not rids and args[0] not in inserted:
+                    # the write would find nothing to write
+                    return False
+                writes.append((query, args))
+                write_rids.update(rids)
             else:
-                # this means this is the only one that owns it
-                if l == 1:
-                    del self.glb_locks[rid]
+                raise ValueError('Unknown query function %s' % query.__name__)
+
+            # versions are read before the data so that a write in between
+            #   is caught upon validation
+            for rid in rids:
+                read_set.setdefault(rid, self.rid_versions.get(rid, 0))
+            if name == 'select':
+                query(*args)
+
+        with self.__lock:
+            for rid, version in read_set.items():
+                if (rid in self.glb_locks
+                        or self.rid_versions.get(rid, 0) != version):
+                    self.__conflict(conflicts, rid)
+                    return False
+            # locks of the transaction, as in check_n_lock
+            own_locks = dict.fromkeys(write_rids, 'X')
+            for rid in write_rids:
+                self.glb_locks[rid] = 'X'
+            self.lock_holders[id(own_locks)] = own_locks
+        try:
+            for query, args in writes:
+                if query.__name__ == 'insert':
+                    # run on the table so the record is locked as it's
+                    #   written
+                    self.insert(*args, own_locks=own_locks)
                 else:
-                    while l > 0:
-                        l -= 1
-                        self.glb_locks[rid] -= 1
-                    if self.glb_locks[rid] == 1:
-                        del self.glb_locks[rid]
+                    query(*args)
+        finally:
+            self.release_lock(own_locks)
+        return True
 
-    def insert(self, *columns):
+    def __wait_n_lock(self, rid, own_locks):
+        """ X lock the new record @rid for the transaction with @own_locks
+            once no other transaction holds a lock on it. The RID can be
+            locked in advance by the insert of a pessimistic transaction,
+            which takes no further locks, so the wait is bounded. That never
+            happens for clustered tables, whose inserts lock nothing in
+            advance.
+        """
+        while True:
+            with self.__lock:
+                if rid not in self.glb_locks:
+                    self.glb_locks[rid] = own_locks[rid] = 'X'
+                    return
+            sleep(Config.TXN_LOCK_POLL)
+
+    def run_batch(self, transactions):
+        """ Run pessimistic transactions with the same outcome as running
+            them one after another, but with less overhead per transaction:
+            - consecutive transactions that only select by key, update
+              columns other than the key, or add to them form a group, whose
+              keys are located in one pass over the index
+            - the locks of a group are taken, and later released, while
+              holding the lock manager once
+            - the queries of a group are grouped by partition, and each
+              partition is pinned once for all of them
+            Transactions of a group that touch a record of an earlier one in
+              the group wait for the next group. Other transactions, and the
+              optimistic ones, run by themselves.
+
+        Arguments:
+            transactions: list
+                Transaction objs on this table, in the order to run them.
+        Returns:
+            List with True for each transaction that committed & False for
+                each one that aborted; the conflicts of aborted ones are set
+                as by Transaction.run.
+        """
+        results = [None] * len(transactions)
+        group = []
+        for i, t in enumerate(transactions):
+            if self.key_dir is None and (t.mode or self.cc_mode) == 'lock' \
+                    and all(self.__batchable(*q) for q in t.queries):
+                group.append(i)
+                continue
+            self.__run_group(transactions, group, results)
+            group = []
+            results[i] = t.run()
+        self.__run_group(transactions, group, results)
+        return results
+
+    def __batchable(self, query, args):
+        """ Whether the query can't change which records have which keys,
+            so its record can be located before the transactions ahead of it
+            in its group have run
+        """
+        key_col = self.COL_KEY - Config.N_META_COLS
+        name = query.__name__
+        if name == 'select':
+            return args[1] == key_col
+        if name == 'update':
+            return args[1 + key_col] in (None, args[0])
+        if name in ['increment', 'add']:
+            return args[1] != key_col
+        return False
+
+    def __run_group(self, transactions, group, results):
+        """ Locate the records of the transactions @group at once and run
+            them in batches of transactions that touch different records
+        """
+        if not group:
+            return
+        key_col = self.COL_KEY - Config.N_META_COLS
+        located = iter(self.index.locate_many(
+            key_col,
+            [args[0] for i in group for _, args in transactions[i].queries]
+        ))
+        batch = []
+        taken = set()
+        for i in group:
+            # list of (name of the query, args, rid)
+            plan = []
+            for query, args in transactions[i].queries:
+                plan.append((query.__name__, args, next(located)))
+            # missing keys fail like they do when run by itself
+            if any(len(rids) != 1 for _, _, rids in plan):
+                self.__run_locked(transactions, batch, results)
+                batch, taken = [], set()
+                results[i] = transactions[i].run()
+                continue
+            plan = [(name, args, rids[0]) for name, args, rids in plan]
+            rids = {rid for _, _, rid in plan}
+            if not taken.isdisjoint(rids):
+                self.__run_locked(transactions, batch, results)
+                batch, taken = [], set()
+            batch.append((i, plan))
+            taken |= rids
+        self.__run_locked(transactions, batch, results)
+
+    def __run_locked(self, transactions, batch, results):
+        """ Lock the records of the transactions in @batch, a list of (idx of
+            the transaction, plan), run those that got their locks, & release
+            the locks. The transactions touch different records.
+        """
+        # list of (idx of the transaction, plan, locks taken)
+        running = []
+        with self.__lock:
+            for i, plan in batch:
+                t = transactions[i]
+                t.table = self
+                t.conflicts = []
+                # Key: rid; Value: 'X' or 1 for an S lock, as in own_locks
+                own_locks = {}
+                for name, _, rid in plan:
+                    if name == 'select':
+                        own_locks.setdefault(rid, 1)
+                    else:
+                        own_locks[rid] = 'X'
+                conflict = next((
+                    rid for rid, l in own_locks.items()
+                    if rid in self.glb_locks
+                    and (l == 'X' or self.glb_locks[rid] == 'X')
+                ), None)
+                if conflict is not None:
+                    self.__conflict(t.conflicts, conflict)
+                    results[i] = False
+                    continue
+                for rid, l in own_locks.items():
+                    self.glb_locks[rid] = 'X' if l == 'X' else \
+                        self.glb_locks.get(rid, 0) + 1
+                running.append((i, plan, own_locks))
+        try:
+            self.__run_plans([plan for _, plan, _ in running])
+        finally:
+            with self.__lock:
+                for _, _, own_locks in running:
+                    self.release_lock(own_locks)
+        for i, _, _ in running:
+            results[i] = True
+
+    def __run_plans(self, plans):
+        """ Run the queries of @plans partition by partition. The n-th query
+            on a record runs in the n-th round, so the queries of a
+            transaction on the same record keep their order.
+        """
+        # Key:   index of the partition
+        # Value: list of (name of the query, args, rid, position in partition)
+        rounds = []
+        n_seen = {}
+        for plan in plans:
+            for name, args, rid in plan:
+                n = n_seen.get(rid, 0)
+                n_seen[rid] = n + 1
+                if n == len(rounds):
+                    rounds.append({})
+                which_p, where_in_p = self.__rid2pos(rid)
+                rounds[n].setdefault(which_p, []).append(
+                    (name, args, rid, where_in_p))
+        for parts in rounds:
+            for which_p in sorted(parts):
+                p = self.buffer.pin(which_p)
+                try:
+                    self.__run_queries(p, parts[which_p])
+                finally:
+                    self.buffer.unpin(which_p)
+
+    def __run_queries(self, p, queries):
+        """ Run @queries, a list of (name of the query, args, rid, position
+            in partition) on different records, in the pinned partition @p
+        """
+        updates = []
+        deltas = []
+        for name, args, rid, where_in_p in queries:
+            if name == 'select':
+                p.read(where_in_p, [0] * Config.N_META_COLS + list(args[2]))
+            elif name == 'update':
+                updates.append((where_in_p, rid, args[1:]))
+            else:
+                columns = [None] * self.num_columns
+                columns[args[1]] = 1 if name == 'increment' else args[2]
+                deltas.append((where_in_p, rid, columns))
+        if updates:
+            self.__update_group(p, updates)
+        if deltas:
+            with self.__lock_add:
+                self.__add_group(p, deltas)
+
+    def is_locked(self, rids):
+        """ Whether any of the records @rids is locked by a transaction
+        """
+        with self.__lock:
+            return any(rid in self.glb_locks for rid in rids)
+
+    @staticmethod
+    def __conflict(conflicts, rid):
+        if conflicts is not None:
+            conflicts.append(rid)
+
+    def __bump_versions(self, rids):
+        """ Mark the records @rids as changed for optimistic transactions,
+            and drop them from the record cache. Called after the write.
+        """
+        rids = list(rids)
+        with self.__lock:
+            for rid in rids:
+                self.rid_versions[rid] = self.rid_versions.get(rid, 0) + 1
+        if self.cache is not None:
+            self.cache.invalidate(rids)
+
+    def set_cache(self, capacity):
+        """ Cache up to @capacity resolved records for selects; no cache if
+            0. See RecordCache.
+        """
+        self.cache = RecordCache(capacity) if capacity else None
+
+    def __read(self, rid, cols):
+        """ Read @cols (INCLUDING meta-cols) of the record @rid, through the
+            record cache if there's one.
+        """
+        cache = self.cache
+        if cache is None:
+            return self[rid, cols]
+        cols = tuple(cols)
+        vals = cache.get(rid, cols)
+        if vals is not None:
+            return list(vals)
+        generation = cache.generation(rid)
+        vals = self[rid, cols]
+        cache.put(rid, cols, vals, generation)
+        return vals
+
+    def insert(self, *columns, own_locks=None):
         """ Write the meta-columns & @columns to the correct page
         Arguments:
             - columns: list
                 Record to be written to the DB.
+            - own_locks: dict
+                Locks of the transaction running the insert, as in
+                check_n_lock; if given, the new record is X locked for it
+                before it can be located.
+        Returns:
+            RID of the new record.
         """
         # Indirection is NULL which we use 0 to represent.
         # Schema is in binary representation which has a default of 0000 or 0
@@ -185,20 +617,242 @@ class Table:
         # Thus, there's no need to write anything for these two meta-cols since
         #    they are already zeros by default in the page.
 
-        rid = self.inc_rec()
-        data = [None, rid, int(time()), None]  # meta columns
-        data += columns   # user columns
-        p = self.buffer[-1]  # current partition
-        success = p.write(*data)
-        # Current Partition.base_page is full
-        if not success:
-            self.add_new_partition().write(*data)
+        if self.key_dir is not None:
+            self.inc_rec()
+            rid = self.__insert_clustered(list(columns), own_locks)
+        else:
+            rid = self.inc_rec()
+            if own_locks is not None:
+                self.__wait_n_lock(rid, own_locks)
+            data = [None, rid, int(time()), None]  # meta columns
+            data += columns   # user columns
+            while True:
+                # current partition
+                with self.buffer.pinned(-1) as p:
+                    if p.write(*data):
+                        self.__aggregate_new(rid, columns)
+                        break
+                # Current Partition.base_page is full
+                self.buffer.new_partition()
 
         for i, val in enumerate(columns):
             if self.index.indexed_eh(i):
                 self.index.insert(i, val, rid)
+        self.index.change(rid, list(columns))
+        return rid
+
+    def insert_columns(self, columns):
+        """ Bulk insert of records given column-wise: the values are copied
+            into the base pages a partition at a time, & the indices &
+            materialized aggregates are fed in one pass. Not meant to run
+            alongside other inserts. Clustered tables insert one by one since
+            every record is placed by its key.
+        Arguments:
+            - columns: list
+                array of the values of each user column; all of the same
+                length & non-negative like any value of the table.
+        Returns:
+            Number of records inserted.
+        """
+        n = len(columns[0])
+        if any(len(values) != n for values in columns):
+            raise ValueError('columns of different lengths')
+        if n == 0:
+            return 0
+        if min(min(values) for values in columns) < 0:
+            raise ValueError('negative values are not supported')
+        if self.key_dir is not None:
+            for row in zip(*columns):
+                self.insert(*row)
+            return n
+
+        with self.__lock_n_rec:
+            first = self.__num_records + 1
+            self.__num_records += n
+        key_col = self.COL_KEY - Config.N_META_COLS
+        done = 0
+        while done < n:
+            with self.buffer.pinned(-1) as p:
+                written = p.write_columns(first + done, columns, done)
+                which_p = self.__rid2pos(first + done)[0]
+                keys = columns[key_col][done:done + written]
+                for agg in self.aggregates:
+                    for key, val in zip(
+                            keys, columns[agg.column][done:done + written]):
+                        agg.add(key, val, which_p)
+            if not written:
+                self.add_new_partition()
+            done += written
+
+        self.index.insert_columns(range(first, first + n), columns)
+        return n
+
+    def iter_columns(self, query_columns):
+        """ Read the live records column-wise a partition at a time, from
+            the bytes of its pages instead of record by record.
+        Arguments:
+            - query_columns: list
+                List of boolean values for the columns to return.
+        Returns:
+            Iterator over a list of arrays, one per queried column, for each
+                partition.
+        """
+        cols = [0] * Config.N_META_COLS + list(query_columns)
+        for idx_part in range(len(self.buffer.partitions)):
+            yield self.buffer[idx_part].read_columns(cols)
+
+    def __insert_clustered(self, columns, own_locks=None):
+        """ Write @columns to the partition that owns its key, splitting the
+            partition first if it's full. If @own_locks is given, the new
+            record is X locked for it before a split can move it.
+        Returns:
+            RID of the new record, which follows from where it's written.
+        """
+        key = columns[self.COL_KEY - Config.N_META_COLS]
+        with self.__lock_insert:
+            which_p = self.key_dir.route(key)
+            with self.buffer.pinned(which_p) as p:
+                full = not p.has_capacity()
+            if full:
+                self.__split(which_p)
+                which_p = self.key_dir.route(key)
+            with self.buffer.pinned(which_p) as p:
+                rid = which_p * self.MAX_RECORDS + p.count_base_rec + 1
+                p.write(None, rid, int(time()), None, *columns)
+                self.__aggregate_new(rid, columns)
+            self.key_dir.cover(which_p, key)
+            if own_locks is not None:
+                self.__wait_n_lock(rid, own_locks)
+        return rid
+
+    def __aggregate_new(self, rid, columns):
+        """ Add the new record @rid to the materialized aggregates. Called
+            while its partition is pinned, so the partition isn't written to
+            the disk before the aggregates have the record; see
+            self.checkpoint.
+        """
+        key = columns[self.COL_KEY - Config.N_META_COLS]
+        which_p = self.__rid2pos(rid)[0]
+        for agg in self.aggregates:
+            agg.add(key, columns[agg.column], which_p)
+
+    def __lock_layout(self):
+        """ Context manager that keeps a clustered table from splitting
+            while a write locates records & changes them; does nothing for
+            other tables.
+        """
+        if self.key_dir is not None:
+            return self.__lock_insert
+        return nullcontext()
+
+    def __split(self, which_p):
+        """ Make room in the full partition @which_p of a clustered table.
+            Its live records are sorted by key and, unless the tombstones
+            alone free enough space, the upper half is moved to a new
+            partition that takes over its keys. Records of the same key stay
+            together. The locks & versions of the records moved follow them to
+            their new RIDs, see self.__move_rids.
+        """
+        p = self.buffer[which_p]
+        # RIDs that can change
+        rids = range(which_p * self.MAX_RECORDS + 1,
+                     (which_p + 1) * self.MAX_RECORDS + 1)
+        all_cols = [1] * self.N_TOTAL_COLS
+        rows = [
+            p.read(idx, all_cols) for idx in range(p.count_base_rec)
+            if not p.is_deleted(idx)
+        ]
+        rows.sort(key=lambda row: row[self.COL_KEY])
+        keys = [row[self.COL_KEY] for row in rows]
 
-    def select(self, key, indexing_col, query_columns):
+        if len(rows) <= self.MAX_RECORDS // 2:
+            moves = self.__rewrite(which_p, rows)
+            self.key_dir.set_range(which_p, keys)
+        else:
+            # split at the key boundary closest to the middle
+            mid = len(rows) // 2
+            bounds = [
+                i for i in (bisect_left(keys, keys[mid]),
+                            bisect_right(keys, keys[mid]))
+                if 0 < i < len(rows)
+            ]
+            if not bounds:
+                raise ValueError(
+                    'Partition %d only holds key %d' % (which_p, keys[mid]))
+            mid = min(bounds, key=lambda i: abs(i - len(rows) // 2))
+            new_p = len(self.buffer.partitions)
+            rids = list(rids) + list(range(new_p * self.MAX_RECORDS + 1,
+                                           (new_p + 1) * self.MAX_RECORDS + 1))
+            moves = self.__rewrite(which_p, rows[:mid])
+            moves += self.__rewrite(new_p, rows[mid:])
+            self.key_dir.split(which_p, keys[mid], new_p)
+            self.key_dir.set_range(which_p, keys[:mid])
+            self.key_dir.set_range(new_p, keys[mid:])
+
+        with self.__lock:
+            self.index.move(moves)
+            self.__move_rids(moves, rids)
+        self.__aggregate_moves(moves)
+        self.fsm.pop(which_p, None)
+
+    def __aggregate_moves(self, moves):
+        """ Move the records @moves, a list of (old RID, new RID, columns),
+            to the partitions of their new RIDs in the materialized
+            aggregates
+        """
+        key_col = self.COL_KEY - Config.N_META_COLS
+        for old, new, columns in moves:
+            old_p, new_p = self.__rid2pos(old)[0], self.__rid2pos(new)[0]
+            for agg in self.aggregates:
+                agg.move(columns[key_col], columns[agg.column], old_p, new_p)
+
+    def __move_rids(self, moves, rids):
+        """ Make the locks & versions of the records @moves, a list of (old
+            RID, new RID, columns), follow them to their new RIDs. Locks on
+            the other RIDs in @rids are on deleted records and are dropped.
+            Must hold the lock of the lock manager along with the index
+            change, so that a transaction locks either the old or the new
+            RID of a record, and the one it locks is remapped.
+        """
+        mapping = {old: new for old, new, _ in moves}
+        for locks in [self.glb_locks] + list(self.lock_holders.values()):
+            held = {rid: locks.pop(rid) for rid in rids if rid in locks}
+            for rid, l in held.items():
+                if rid in mapping:
+                    locks[mapping[rid]] = l
+        # a version newer than any read of either RID
+        versions = {
+            rid: self.rid_versions.get(rid, 0) for rid in rids
+            if rid in self.rid_versions or rid in mapping
+        }
+        for rid, version in versions.items():
+            self.rid_versions[rid] = version + 1
+        for old, new in mapping.items():
+            self.rid_versions[new] = \
+                max(versions[old], versions.get(new, 0)) + 1
+        if self.cache is not None:
+            self.cache.invalidate(rids)
+
+    def __rewrite(self, which_p, rows):
+        """ Replace partition @which_p, or add it if it's the next one, by a
+            new partition with @rows written in order with tails merged in.
+        Returns:
+            List of (old RID, new RID, user columns) of @rows.
+        """
+        target = self.buffer.make_partition()
+        moves = []
+        for row in rows:
+            new_rid = which_p * self.MAX_RECORDS + target.count_base_rec + 1
+            target.write(None, new_rid, row[Config.COL_TS], None,
+                         *row[Config.N_META_COLS:])
+            moves.append(
+                (row[Config.COL_RID], new_rid, row[Config.N_META_COLS:]))
+        if which_p == len(self.buffer.partitions):
+            self.buffer.new_partition()
+        self.buffer.replace(which_p, target)
+        return moves
+
+    def select(self, key, indexing_col, query_columns, columnar=False):
         """ Read a record whose key matches the specified @key.
 
         Arguments:
@@ -206,22 +860,377 @@ class Table:
                 Key of the records to look for.
             - query_columns: list
                 List of boolean values for the columns to return.
+            - columnar: bool
+                Return a ColumnarResult instead of Record objs.
+        Returns:
+            A list of Record objs that match the key. If the index on
+                @indexing_col covers @query_columns, the records aren't read.
+        """
+        covered = self.index.locate_covered(
+            indexing_col, key, key + 1, query_columns)
+        if covered is not None:
+            return self.__covered_result(covered, key, query_columns, columnar)
+        rids = self.index.locate(indexing_col, key)
+        return self.__read_rids(rids, key, query_columns, columnar)
+
+    def select_many(self, requests):
+        """ Run many selects at once. Keys are located with one pass over the
+            index per indexing column, and the reads are grouped by partition
+            so each partition is fetched from the bufferpool only once.
+
+        Arguments:
+            - requests: list
+                List of (key, indexing_col, query_columns) where the elements
+                are the arguments of self.select.
         Returns:
-            A list of Record objs that match the key.
+            List with the result of self.select for each request.
+        """
+        requests = list(requests)
+        all_rids = [None] * len(requests)
+        # Key: indexing column; Value: positions of its requests
+        by_col = {}
+        for i, (_, indexing_col, _) in enumerate(requests):
+            by_col.setdefault(indexing_col, []).append(i)
+        for indexing_col, positions in by_col.items():
+            keys = [requests[i][0] for i in positions]
+            located = self.index.locate_many(indexing_col, keys)
+            for i, rids in zip(positions, located):
+                all_rids[i] = rids
+
+        results = [[None] * len(rids) for rids in all_rids]
+        # Key:   index of the partition
+        # Value: list of (request, match, position in partition, rid)
+        groups = {}
+        for i, rids in enumerate(all_rids):
+            for j, rid in enumerate(rids):
+                which_p, where_in_p = self.__rid2pos(rid)
+                groups.setdefault(which_p, []).append((i, j, where_in_p, rid))
+
+        for which_p in sorted(groups):
+            p = None
+            for i, j, where_in_p, rid in groups[which_p]:
+                key, _, query_columns = requests[i]
+                cols = tuple([0] * Config.N_META_COLS + list(query_columns))
+                vals = None if self.cache is None else \
+                    self.cache.get(rid, cols)
+                if vals is not None:
+                    results[i][j] = Record(rid, key, list(vals))
+                    continue
+                # only fetched if some record isn't cached
+                if p is None:
+                    p = self.buffer[which_p]
+                if self.cache is not None:
+                    generation = self.cache.generation(rid)
+                vals = p.read(where_in_p, cols)
+                if self.cache is not None:
+                    self.cache.put(rid, cols, vals, generation)
+                results[i][j] = Record(rid, key, vals)
+        return results
+
+    def select_range(self, begin, end, indexing_col, query_columns,
+                     columnar=False):
+        """ Read the records whose values in @indexing_col are between @begin
+            (inclusive) and @end (exclusive).
+
+        Arguments:
+            - begin: int
+                Starting value of the range.
+            - end: int
+                Ending value of the range.
+            - indexing_col: int
+                Indexed column to perform the range search on.
+            - query_columns: list
+                List of boolean values for the columns to return.
+            - columnar: bool
+                Return a ColumnarResult instead of Record objs.
+        Returns:
+            A list of Record objs whose values fall into the range; their key
+                attribute is None since they don't share one. Without an
+                index on @indexing_col, the table is scanned for them; if the
+                index covers @query_columns, the records aren't read.
+        """
+        if not self.index.indexed_eh(indexing_col):
+            return self.scan(query_columns, columnar,
+                             where=(indexing_col, begin, end - 1))
+        covered = self.index.locate_covered(
+            indexing_col, begin, end, query_columns)
+        if covered is not None:
+            return self.__covered_result(
+                covered, None, query_columns, columnar)
+        rids = self.index.locate_range(indexing_col, begin, end)
+        return self.__read_rids(rids, None, query_columns, columnar)
+
+    def __read_rids(self, rids, key, query_columns, columnar):
+        """ Read @query_columns of the records with @rids as Record objs or as
+            a ColumnarResult.
         """
-        # TODO: for this MS, only find the first occurance
         # Convert @query_columns to the actual column indices
         cols = [0] * Config.N_META_COLS + query_columns
 
-        result = []
-        rids = self.index.locate(indexing_col, key)
+        if not columnar:
+            return [Record(rid, key, self.__read(rid, cols)) for rid in rids]
 
-        # for match in matches:
+        result = ColumnarResult(sum(1 for q in query_columns if q))
         for rid in rids:
-            result.append(Record(rid, key, self[rid, cols]))
+            result.rids.append(rid)
+            for arr, val in zip(result.columns, self.__read(rid, cols)):
+                arr.append(val)
+        return result
+
+    @staticmethod
+    def __covered_result(covered, key, query_columns, columnar):
+        """ Turn the (rid, values) from Index.locate_covered into Record objs
+            or a ColumnarResult.
+        """
+        if not columnar:
+            return [Record(rid, key, vals) for rid, vals in covered]
 
+        result = ColumnarResult(sum(1 for q in query_columns if q))
+        for rid, vals in covered:
+            result.rids.append(rid)
+            for arr, val in zip(result.columns, vals):
+                arr.append(val)
         return result
 
+    def aggregate(self, begin, end, column, op, parallel=False):
+        """ Aggregate @column over the records whose keys are between @begin
+            and @end (both inclusive). The work is split by partition, and
+            the partitions are fanned out to worker processes if @parallel.
+
+        Arguments:
+            - begin: int
+                Starting key of the range.
+            - end: int
+                Ending key of the range.
+            - column: int
+                Index of the column to aggregate.
+            - op: str
+                One of 'sum', 'count', 'min', 'max'.
+            - parallel: bool
+                Use the process pool.
+        Returns:
+            The aggregate; None for min/max of no records.
+        """
+        agg = self.materialized(column, op)
+        if agg is not None:
+            result = self.__aggregate_materialized(
+                agg, begin, end, column, op, parallel)
+            if result is not False:
+                return result
+
+        if self.key_dir is not None:
+            # only the partitions whose keys overlap the range are read;
+            #   zone maps are exact after merges, the directory isn't
+            tasks = dict.fromkeys(
+                idx for idx in self.key_dir.partitions(begin, end)
+                if self.buffer.may_hold(idx, self.COL_KEY, begin, end))
+            args = (self.COL_KEY, begin, end)
+        else:
+            indexing_col = self.COL_KEY - Config.N_META_COLS
+            rids = self.index.locate_range(indexing_col, begin, end + 1)
+            tasks = self.__group_rids(rids)
+            args = ()
+        results = run_partitions(
+            self.buffer, aggregate_partition, tasks,
+            column + Config.N_META_COLS, op, *args, parallel=parallel)
+        return combine_partials(op, results)
+
+    def __aggregate_materialized(self, agg, begin, end, column, op, parallel):
+        """ Answer self.aggregate from @agg: the buckets entirely within the
+            range are read from it, and the remaining keys at both ends of the
+            range are aggregated from the records.
+        Returns:
+            The aggregate; False if @agg doesn't cover any part of the range.
+        """
+        if agg.bucket_size is None:
+            span = self.__key_span()
+            if span is None or not (begin <= span[0] and span[1] <= end):
+                return False
+            return agg.value(op)
+
+        size = agg.bucket_size
+        first = -(-begin // size)   # first bucket that starts in the range
+        last = (end + 1) // size - 1    # last bucket that ends in it
+        if first > last:
+            return False
+        partials = [agg.value(op, first, last)]
+        if begin < first * size:
+            partials.append(
+                self.aggregate(begin, first * size - 1, column, op, parallel))
+        if (last + 1) * size <= end:
+            partials.append(
+                self.aggregate((last + 1) * size, end, column, op, parallel))
+        return combine_partials(op, partials)
+
+    def __key_span(self):
+        """ Smallest & largest key that may be in the table according to the
+            zone maps of the partitions.
+        Returns:
+            (smallest, largest); (0, -1) for an empty table; None if unknown.
+        """
+        lo, hi = 0, -1
+        for idx_part in range(len(self.buffer.partitions)):
+            summary = self.buffer.summary(idx_part)
+            if summary is None:
+                return None
+            zone = summary['zones'][self.COL_KEY - Config.N_META_COLS]
+            if zone is None:
+                continue
+            if hi < lo:
+                lo, hi = zone
+            else:
+                lo, hi = min(lo, zone[0]), max(hi, zone[1])
+        return lo, hi
+
+    def materialize(self, column, ops=OPS, bucket_size=None):
+        """ Declare a materialized aggregate of @column that's maintained by
+            every write from now on, and that answers self.aggregate over
+            whole buckets without reading the records. It's filled with a
+            scan, so it must not be declared concurrently with writes.
+
+        Arguments:
+            - column: int
+                Index of the column to aggregate.
+            - ops: tuple
+                Any of 'sum', 'count', 'min', 'max'.
+            - bucket_size: int
+                Group by buckets of this many keys; the whole table is a
+                single bucket if None.
+        Returns:
+            MaterializedAggregate obj
+        """
+        agg = MaterializedAggregate(column, ops, bucket_size)
+        self.__fill_aggregates([agg])
+        self.aggregates.append(agg)
+        # it's saved by checkpoints, and only known upon reopening from then
+        self.checkpoint()
+        return agg
+
+    def materialized(self, column, op):
+        """
+        Returns:
+            A MaterializedAggregate obj of @op on @column; None if there's
+                none.
+        """
+        for agg in self.aggregates:
+            if agg.column == column and op in agg.ops:
+                return agg
+        return None
+
+    def __fill_aggregates(self, aggregates):
+        """ Add all live records to @aggregates
+        """
+        if not aggregates:
+            return
+        for idx_part in range(len(self.buffer.partitions)):
+            self.__fill_partition(aggregates, idx_part)
+
+    def __fill_partition(self, aggregates, idx_part):
+        """ Add the live records of partition @idx_part to @aggregates
+        """
+        if not aggregates:
+            return
+        key_col = self.COL_KEY - Config.N_META_COLS
+        cols = [0] * Config.N_META_COLS + [
+            1 if i == key_col or any(agg.column == i for agg in aggregates)
+            else 0 for i in range(self.num_columns)
+        ]
+        pos = {col: i for i, col in enumerate(
+            i for i, q in enumerate(cols[Config.N_META_COLS:]) if q)}
+        values = self.buffer[idx_part].read_columns(cols)
+        for agg in aggregates:
+            for key, val in zip(values[pos[key_col]], values[pos[agg.column]]):
+                agg.add(key, val, idx_part)
+
+    def __preimages(self, p, group):
+        """ User columns of the records in @group, a list of (idx, rid, _) in
+            partition @p, before they are written; only read if there are
+            materialized aggregates or secondary indexes to maintain.
+        Returns:
+            dict with the rid as the key & the list of columns as the value.
+        """
+        if not self.aggregates and not self.index.maintained_eh():
+            return {}
+        cols = [0] * Config.N_META_COLS + [1] * self.num_columns
+        return {rid: p.read(idx, cols) for idx, rid, _ in group}
+
+    def __maintain(self, rows, rid, new_values):
+        """ Apply the write of @new_values, with None for the columns left
+            alone, on the record @rid to the materialized aggregates & the
+            secondary indexes. @rows has the current columns of the record &
+            gets the new ones.
+        """
+        if not rows:
+            return
+        key_col = self.COL_KEY - Config.N_META_COLS
+        old = rows[rid]
+        new = rows[rid] = [
+            o if n is None else n for o, n in zip(old, new_values)
+        ]
+        which_p = self.__rid2pos(rid)[0]
+        for agg in self.aggregates:
+            agg.change(old[key_col], old[agg.column],
+                       new[key_col], new[agg.column], which_p)
+        # the key column is moved in the index by the caller
+        self.index.change(rid, new, old, skip=key_col)
+
+    def scan(self, query_columns, columnar=False, parallel=False,
+             where=None):
+        """ Read @query_columns of all live records of the table.
+
+        Arguments:
+            - query_columns: list
+                List of boolean values for the columns to return.
+            - columnar: bool
+                Return a ColumnarResult instead of Record objs.
+            - parallel: bool
+                Fan the partitions out to worker processes.
+            - where: tuple
+                Optional (column, begin, end) to only read the records whose
+                values in column are between begin and end (both inclusive).
+                Partitions ruled out by their zone maps aren't loaded.
+        Returns:
+            Records in RID order; their key attribute is None.
+        """
+        cols = [0] * Config.N_META_COLS + query_columns
+        idx_parts = range(len(self.buffer.partitions))
+        if where is not None:
+            column, begin, end = where
+            where = (column + Config.N_META_COLS, begin, end)
+            idx_parts = [
+                idx for idx in idx_parts
+                if self.buffer.may_hold(idx, *where)
+            ]
+        tasks = dict.fromkeys(idx_parts)
+        results = run_partitions(
+            self.buffer, scan_partition, tasks, cols, where,
+            parallel=parallel)
+        results.sort(key=lambda r: r.rids[0] if len(r) else 0)
+
+        if not columnar:
+            return [
+                Record(rid, None, list(vals))
+                for r in results for rid, vals in zip(r.rids, zip(*r.columns))
+            ]
+        result = ColumnarResult(sum(1 for q in query_columns if q))
+        for r in results:
+            result.rids.extend(r.rids)
+            for arr, part in zip(result.columns, r.columns):
+                arr.extend(part)
+        return result
+
+    def __group_rids(self, rids):
+        """ Group @rids by partition
+        Returns:
+            dict with the index of a partition as the key & the list of
+                positions in that partition as the value.
+        """
+        groups = {}
+        for rid in rids:
+            which_p, where_in_p = self.__rid2pos(rid)
+            groups.setdefault(which_p, []).append(where_in_p)
+        return groups
+
     def update(self, key, *columns):
         """ Update records with the specified key.
 
@@ -233,37 +1242,230 @@ class Table:
                 a column, no update will be made to it.
                 Ex: [None, None, None, 1]
         """
-        # TODO: update indexing for other columns
+        self.update_many([(key, columns)])
+
+    def update_many(self, updates):
+        """ Update the records of many keys at once. All keys are located in
+            one pass over the index, and the updates are grouped by partition
+            so that each partition is fetched from the bufferpool only once
+            and gets its tail records appended in bulk.
+
+        Arguments:
+            - updates: list
+                List of (key, columns) where the elements are the arguments of
+                self.update.
+        Returns:
+            Number of records updated.
+        """
+        with self.__lock_layout():
+            return self.__update_many(list(updates))
+
+    def __update_many(self, updates):
         indexing_col = self.COL_KEY - Config.N_META_COLS
-        if columns[indexing_col] is not None:
-            key_change = True
-        else:
-            key_change = False
+        all_rids = self.index.locate_many(
+            indexing_col, [key for key, _ in updates])
 
-        # TODO: currently slect is called even when there's no key modification
-        cols = [0] * self.num_columns
-        cols[indexing_col] = 1
-        old_recs = self.select(key, indexing_col, cols)
-        rids = self.index.locate(indexing_col, key)
+        # Key:   index of the partition
+        # Value: list of (idx, rid, columns) to update in that partition
+        groups = {}
+        # Key:   rid whose key is updated
+        # Value: [key before the batch, key after it]; a record updated many
+        #        times only moves once in the index
+        key_changes = {}
+        for (key, columns), rids in zip(updates, all_rids):
+            new_key = columns[indexing_col]
+            for rid in rids:
+                which_p, where_in_p = self.__rid2pos(rid)
+                groups.setdefault(which_p, []).append(
+                    (where_in_p, rid, columns))
+                if new_key is not None:
+                    key_changes.setdefault(rid, [key, key])[1] = new_key
 
-        assert(len(old_recs) == len(rids))
-        for rid, old_rec in zip(rids, old_recs):
-            which_p, where_in_p = self.__rid2pos(rid)
-            p = self.buffer[which_p]
-            p.update(where_in_p, rid, *columns)
-            if key_change:
-                new_val = columns[indexing_col]
-                self.index.update(indexing_col, old_rec.key, new_val, rid)
+        for which_p in sorted(groups):
+            with self.buffer.pinned(which_p) as p:
+                self.__update_group(p, groups[which_p])
+        for rid, (old_key, new_key) in key_changes.items():
+            if new_key == old_key:
+                continue
+            self.index.update(indexing_col, old_key, new_key, rid)
+            if self.key_dir is not None:
+                self.key_dir.cover(self.__rid2pos(rid)[0], new_key)
+        return sum(len(group) for group in groups.values())
+
+    def __update_group(self, p, group):
+        """ Write @group, a list of (idx, rid, columns), to partition @p as
+            in self.update_many; key changes are left to the caller.
+        """
+        rows = self.__preimages(p, group)
+        p.update_many(group)
+        self.__bump_versions(rid for _, rid, _ in group)
+        for _, rid, columns in group:
+            self.__maintain(rows, rid, columns)
+
+    def upsert(self, records):
+        """ Update the records of the keys that exist and insert the others.
+
+        Arguments:
+            - records: list
+                List of (key, columns) like in self.update_many. For keys that
+                don't exist, @columns is inserted as a new record where the
+                key column defaults to key and other None values to 0.
+        Returns:
+            Number of records inserted.
+        """
+        indexing_col = self.COL_KEY - Config.N_META_COLS
+        records = list(records)
+        all_rids = self.index.locate_many(
+            indexing_col, [key for key, _ in records])
+
+        updates = []
+        inserted = set()
+        for (key, columns), rids in zip(records, all_rids):
+            # a key inserted earlier in this batch is updated by the later ones
+            if rids or key in inserted:
+                updates.append((key, columns))
+                continue
+            columns = list(columns)
+            if columns[indexing_col] is None:
+                columns[indexing_col] = key
+            self.insert(*[0 if col is None else col for col in columns])
+            inserted.add(columns[indexing_col])
+        self.update_many(updates)
+        return len(inserted)
 
     def delete(self, key):
+        with self.__lock_layout():
+            self.__delete(key)
+
+    def __delete(self, key):
         indexing_col = self.COL_KEY - Config.N_META_COLS
         rids = self.index.locate(indexing_col, key)
 
-        for rid in rids:
+        for rid in list(rids):
             self.index.delete(indexing_col, key, rid)
             which_p, where_in_p = self.__rid2pos(rid)
+            with self.buffer.pinned(which_p) as p:
+                row = self.__preimages(p, [(where_in_p, rid, None)]).get(rid)
+                deleted = p.delete(where_in_p)
+                if deleted:
+                    for agg in self.aggregates:
+                        agg.remove(row[indexing_col], row[agg.column],
+                                   which_p)
+            if deleted:
+                self.fsm[which_p] = self.fsm.get(which_p, 0) + 1
+                if row is not None:
+                    self.index.change(rid, None, row, skip=indexing_col)
+            self.__bump_versions([rid])
+
+    def vacuum(self):
+        """ Reclaim the space of deleted records. Starting from the first
+            partition with tombstones according to the free-space map, every
+            live record is moved down to the next free slot with its tail
+            records merged in, so that RIDs stay dense & in order, and all
+            indices are remapped to the new RIDs. Partitions left empty at
+            the end are removed from the disk.
+            Must not run concurrently with queries or transactions.
+        Returns:
+            dict with the number of 'records', 'partitions' and 'bytes'
+                reclaimed.
+        """
+        reclaimed = {'records': 0, 'partitions': 0, 'bytes': 0}
+        dirty_parts = [idx for idx, n in self.fsm.items() if n > 0]
+        if not dirty_parts:
+            return reclaimed
+        if self.key_dir is not None:
+            return self.__vacuum_clustered(dirty_parts)
+        first = min(dirty_parts)
+        n_parts = len(self.buffer.partitions)
+
+        # Key: old RID; Value: new RID of every live record that got rewritten
+        mapping = {}
+        # records that changed partition; see self.__aggregate_moves
+        moves = []
+        all_cols = [1] * self.N_TOTAL_COLS
+        which_t = first     # index of the partition being rewritten
+        target = self.buffer.make_partition()
+        for which_p in range(first, n_parts):
+            p = self.buffer[which_p]
+            reclaimed['bytes'] += p.size()
+            for idx in range(p.count_base_rec):
+                if p.is_deleted(idx):
+                    reclaimed['records'] += 1
+                    continue
+                row = p.read(idx, all_cols)
+                # A new RID is never larger than the old one, so partition
+                #   @which_t has been read entirely once it's full
+                if not target.has_capacity():
+                    reclaimed['bytes'] -= target.size()
+                    self.buffer.replace(which_t, target)
+                    which_t += 1
+                    target = self.buffer.make_partition()
+                old_rid = which_p * self.MAX_RECORDS + idx + 1
+                new_rid = which_t * self.MAX_RECORDS + target.count_base_rec + 1
+                mapping[old_rid] = new_rid
+                if self.aggregates and which_t != which_p:
+                    moves.append((old_rid, new_rid, row[Config.N_META_COLS:]))
+                target.write(None, new_rid, row[Config.COL_TS], None,
+                             *row[Config.N_META_COLS:])
+
+        reclaimed['bytes'] -= target.size()
+        self.buffer.replace(which_t, target)
+        self.buffer.truncate(which_t + 1)
+        reclaimed['partitions'] = n_parts - (which_t + 1)
+
+        n_records = which_t * self.MAX_RECORDS + target.count_base_rec
+        self.index.remap(mapping, first * self.MAX_RECORDS + 1, n_records)
+        self.__aggregate_moves(moves)
+        with self.__lock_n_rec:
+            self.__num_records = n_records
+        self.fsm = {}
+        self.rid_versions = {}
+        if self.cache is not None:
+            self.cache.clear()
+        # RIDs changed all over; don't let recovery mix them with old ones
+        self.checkpoint()
+        return reclaimed
+
+    def __vacuum_clustered(self, dirty_parts):
+        """ Vacuum of a clustered table: records stay in the partition of
+            their key, so every partition with tombstones is compacted in
+            place. No partition is removed.
+        """
+        reclaimed = {'records': 0, 'partitions': 0, 'bytes': 0}
+        all_cols = [1] * self.N_TOTAL_COLS
+        moves = []
+        for which_p in sorted(dirty_parts):
             p = self.buffer[which_p]
-            p.delete(where_in_p)
+            rows = [
+                p.read(idx, all_cols) for idx in range(p.count_base_rec)
+                if not p.is_deleted(idx)
+            ]
+            reclaimed['records'] += p.count_base_rec - len(rows)
+            reclaimed['bytes'] += p.size()
+            moves += self.__rewrite(which_p, rows)
+            reclaimed['bytes'] -= self.buffer[which_p].size()
+            self.key_dir.set_range(
+                which_p, [row[self.COL_KEY] for row in rows])
+
+        self.index.move(moves)
+        with self.__lock_n_rec:
+            self.__num_records -= reclaimed['records']
+        self.fsm = {}
+        self.rid_versions = {}
+        if self.cache is not None:
+            self.cache.clear()
+        self.checkpoint()
+        return reclaimed
+
+    def max_rid(self):
+        """
+        Returns:
+            Upper bound of the RIDs in use. RIDs of a clustered table have
+                gaps where partitions aren't full.
+        """
+        if self.key_dir is not None:
+            return len(self.buffer.partitions) * self.MAX_RECORDS
+        return self.get_num_rec()
 
     def inc_rec(self):
         with self.__lock_n_rec:
@@ -284,15 +1486,84 @@ class Table:
          Returns:
              True is increment is successful; false if no record matches key
          """
-        r = self.select(
-            key, self.COL_KEY - Config.N_META_COLS, [1] * self.num_columns)
-        if len(r) > 0:
-            r = r[0]
-            updated_columns = [None] * self.num_columns
-            updated_columns[column] = r.columns[column] + 1
-            self.update(key, *updated_columns)
-            return True
-        return False
+        return self.add(key, column, 1)
+
+    def add(self, key, column, delta):
+        """ Add @delta to one column of the record in place
+         Arguments:
+            key:
+                The primary of key of the record to change
+            column:
+                The column to change
+            delta:
+                Value to add to the column; can be negative
+         Returns:
+             True if successful; False if no record matches key
+         """
+        columns = [None] * self.num_columns
+        columns[column] = delta
+        return self.add_many([(key, columns)]) > 0
+
+    def add_many(self, deltas):
+        """ Add deltas to one or more columns of many records. Keys are located
+            in one pass over the index and every record gets a single tail
+            record per delta, written while its partition is fetched once.
+            The same key may appear many times, e.g., for hot counters.
+
+        Arguments:
+            - deltas: list
+                List of (key, columns) where @columns has the value to add to
+                each column, or None to leave the column alone.
+                Ex: [(906659671, [None, 1, None, None, -2])]
+        Returns:
+            Number of records changed.
+        """
+        with self.__lock_layout():
+            return self.__add_many(list(deltas))
+
+    def __add_many(self, deltas):
+        indexing_col = self.COL_KEY - Config.N_META_COLS
+        all_rids = self.index.locate_many(
+            indexing_col, [key for key, _ in deltas])
+
+        # Key:   index of the partition
+        # Value: list of (idx, rid, columns) to change in that partition
+        groups = {}
+        for (key, columns), rids in zip(deltas, all_rids):
+            for rid in rids:
+                which_p, where_in_p = self.__rid2pos(rid)
+                groups.setdefault(which_p, []).append(
+                    (where_in_p, rid, columns))
+
+        with self.__lock_add:
+            for which_p in sorted(groups):
+                group = groups[which_p]
+                with self.buffer.pinned(which_p) as p:
+                    new_cols = self.__add_group(p, group)
+                # the key got changed; move the rid in the index
+                for (_, rid, columns), new in zip(group, new_cols):
+                    delta = columns[indexing_col]
+                    if delta:
+                        new_key = new[indexing_col]
+                        self.index.update(
+                            indexing_col, new_key - delta, new_key, rid)
+                        if self.key_dir is not None:
+                            self.key_dir.cover(which_p, new_key)
+        return sum(len(group) for group in groups.values())
+
+    def __add_group(self, p, group):
+        """ Add the deltas of @group, a list of (idx, rid, columns), in
+            partition @p as in self.add_many; key changes are left to the
+            caller, which holds self.__lock_add.
+        Returns:
+            The new columns; see Partition.add_many.
+        """
+        rows = self.__preimages(p, group)
+        new_cols = p.add_many(group)
+        self.__bump_versions(rid for _, rid, _ in group)
+        for (_, rid, _), new in zip(group, new_cols):
+            self.__maintain(rows, rid, new)
+        return new_cols
 
     def add_new_partition(self):
         """ Add a new partition to self.partitions
@@ -307,10 +1578,78 @@ class Table:
 
     def close(self):
         self.buffer.flush()
-        with open(os.path.join(self.PATH_TABLE, 'index'), 'wb') as f:
-            pickle.dump(self.index, f)
-        with open(os.path.join(self.PATH_TABLE, 'meta'), 'wb') as f:
-            pickle.dump([self.num_columns, self.COL_KEY-Config.N_META_COLS], f)
+        self.checkpoint()
+        self.index.close()
+        self.buffer.close()
+
+    def checkpoint(self):
+        """ Fuzzy checkpoint: snapshot the index, write the dirty partitions
+            without evicting them, then persist the index, fsm & meta, and
+            finally the checkpoint marker with the sequence number of the
+            partition writes at the time of the snapshot. Queries can keep
+            running; partitions written after the snapshot are read again upon
+            recovery. A crash before the marker is written falls back to the
+            previous checkpoint.
+            The materialized aggregates are saved in the marker. Their
+            snapshot is taken along with the sequence number while no
+            partition can be written to the disk, and writes change them
+            before unpinning the partition, so every partition whose records
+            aren't in the snapshot as they are on the disk is written after
+            it.
+        """
+        with self.__lock_checkpoint:
+            with self.buffer.manager.lock:
+                seq = self.buffer.seq
+                aggregates = [agg.snapshot() for agg in self.aggregates]
+            index = self.index.snapshot()
+            fsm = dict(self.fsm)
+            key_dir = pickle.dumps(self.key_dir)
+            self.buffer.checkpoint()
+
+            with open(self.PATH_INDEX + '.tmp', 'wb') as f:
+                f.write(index)
+            os.replace(self.PATH_INDEX + '.tmp', self.PATH_INDEX)
+            dump_atomic(fsm, self.PATH_FSM)
+            if self.key_dir is not None:
+                with open(self.PATH_KEYDIR + '.tmp', 'wb') as f:
+                    f.write(key_dir)
+                os.replace(self.PATH_KEYDIR + '.tmp', self.PATH_KEYDIR)
+            self.__write_meta()
+            dump_atomic({'seq': seq, 'aggregates': aggregates},
+                        self.PATH_CHECKPOINT)
+            self.buffer.trim_writes(seq)
+
+    def __write_meta(self):
+        dump_atomic([self.num_columns, self.COL_KEY - Config.N_META_COLS,
+                     self.MAX_RECORDS, self.key_dir is not None,
+                     self.buffer.SPARSE_TAILS, self.buffer.CUMULATIVE],
+                    self.PATH_META)
+
+    def __recover(self, stale):
+        """ Bring the index, fsm & materialized aggregates loaded from the
+            checkpoint up to date with the partitions @stale that were written
+            after it.
+        """
+        records = []
+        all_cols = [1] * self.N_TOTAL_COLS
+        for idx_part in sorted(stale):
+            p = self.buffer[idx_part]
+            keys = []
+            for idx in range(p.count_base_rec):
+                if not p.is_deleted(idx):
+                    row = p.read(idx, all_cols)
+                    records.append(
+                        (row[Config.COL_RID], row[Config.N_META_COLS:]))
+                    keys.append(row[self.COL_KEY])
+            self.fsm[idx_part] = p.count_deleted
+            if self.key_dir is not None:
+                # partitions split off after the checkpoint
+                self.key_dir.add(idx_part, keys)
+                self.key_dir.set_range(idx_part, keys)
+            for agg in self.aggregates:
+                agg.reset(idx_part)
+            self.__fill_partition(self.aggregates, idx_part)
+        self.index.reindex(stale, records, self.__num_records)
 
     def __rid2pos(self, rid):
         """ Internal Method for info for where to find a record in base page
@@ -319,8 +1658,8 @@ class Table:
             which_partition, where_in_partition
         """
         rid -= 1
-        rem = rid % Config.MAX_RECORDS
-        return int((rid - rem) / Config.MAX_RECORDS), rem
+        rem = rid % self.MAX_RECORDS
+        return int((rid - rem) / self.MAX_RECORDS), rem
 
     def __getitem__(self, rid):
         """
@@ -2,9 +2,18 @@ class Transaction:
     """
     # Creates a transaction object.
     """
-    def __init__(self):
+    def __init__(self, mode=None):
+        """
+        Arguments:
+            - mode: str
+                Concurrency control: 'lock' for pessimistic no-wait locking,
+                'occ' for optimistic. Defaults to the mode of the table.
+        """
         self.queries = []
         self.table = None
+        self.mode = mode
+        # RIDs of the records that made the last run abort
+        self.conflicts = []
 
     """
     # Adds the given query to this transaction
@@ -16,12 +25,17 @@ class Transaction:
     def add_query(self, query, *args):
         self.queries.append((query, args))
 
+    def get_table(self):
+        # We can assume a transaction will access only one table for this MS
+        return self.queries[0][0].__self__.table
+
     # If you choose to implement this differently this method must still
     # return True if transaction commits or False on abort
     def run(self):
         # do a pre-check of availability of the locks by trying to lock
-        # We can assume a transaction will access only one table for this MS
-        self.table = self.queries[0][0].__self__.table
+        self.table = self.get_table()
+        self.conflicts = []
+        if (self.mode or self.table.cc_mode) == 'occ':
+            return self.table.run_optimistic(self.queries, self.conflicts)
         # pre-check failure; locks released and return false
-
-        return self.table.check_n_lock(self.queries)
+        return self.table.check_n_lock(self.queries, self.conflicts)
@@ -1,13 +1,42 @@
+from heapq import heappush, heappop
+from lstore.config import Config
+from random import uniform
+from time import monotonic, sleep
+
+
 class TransactionWorker:
 
     """
     # Creates a transaction worker object.
     """
-    def __init__(self, transactions=[]):
+    def __init__(self, transactions=None, max_attempts=Config.TXN_MAX_ATTEMPTS,
+                 backoff=Config.TXN_BACKOFF,
+                 max_backoff=Config.TXN_MAX_BACKOFF,
+                 batch_size=Config.TXN_BATCH):
+        """
+        Arguments:
+            - transactions: list
+                Transactions to run.
+            - max_attempts: int
+                Number of times a transaction is run before giving up on it;
+                1 for no retries.
+            - backoff: float
+                Seconds before the 1st retry; doubled for each further retry.
+            - max_backoff: float
+                Cap of the backoff in seconds.
+            - batch_size: int
+                Max number of transactions that are due at the same time to
+                run together; see Table.run_batch.
+        """
         self.stats = []
-        self.transactions = transactions
+        self.transactions = [] if transactions is None else transactions
         self.result = 0
-        pass
+        self.MAX_ATTEMPTS = max_attempts
+        self.BACKOFF = backoff
+        self.MAX_BACKOFF = max_backoff
+        self.BATCH_SIZE = batch_size
+        self.n_retries = 0  # number of reruns of aborted transactions
+        self.n_aborts = 0   # number of transactions that were given up on
 
     def add_transaction(self, t):
         self.transactions.append(t)
@@ -21,8 +50,88 @@ class TransactionWorker:
     # transaction_worker = TransactionWorker([t])
     """
     def run(self):
-        for transaction in self.transactions:
-            # each transaction returns True if committed or False if aborted
-            self.stats.append(transaction.run())
+        """ Run the transactions. An aborted transaction is requeued with an
+            exponential backoff with full jitter, and other transactions run
+            in the meantime. Once its backoff is over, it waits further while
+            the records it conflicted on are still locked, but no longer
+            than the max backoff. Transactions that are due at the same time
+            run in batches through Table.run_batch.
+        """
+        # each transaction is True if committed or False if aborted
+        self.stats = [None] * len(self.transactions)
+        # Scheduled runs: (when, sequence no., idx of transaction, attempt,
+        #   deadline for waiting on locks); sorted by the heap
+        queue = [(0, i, i, 1, 0) for i in range(len(self.transactions))]
+        n_scheduled = len(queue)
+        while queue:
+            when = queue[0][0]
+            now = monotonic()
+            if when > now:
+                sleep(when - now)
+                now = when
+
+            # list of (idx of transaction, attempt) due now
+            batch = []
+            while queue and queue[0][0] <= now and \
+                    len(batch) < self.BATCH_SIZE:
+                _, _, i, attempt, deadline = heappop(queue)
+                t = self.transactions[i]
+                # retrying is pointless while the conflicting locks are held
+                if (attempt > 1 and now < deadline and t.conflicts
+                        and t.table.is_locked(t.conflicts)):
+                    n_scheduled += 1
+                    heappush(queue, (now + Config.TXN_LOCK_POLL, n_scheduled,
+                                     i, attempt, deadline))
+                    continue
+                batch.append((i, attempt))
+            if not batch:
+                continue
+
+            for (i, attempt), committed in zip(batch, self.__run(batch)):
+                n_scheduled = self.__finish(
+                    queue, n_scheduled, i, attempt, committed)
         # stores the number of transactions that committed
         self.result = len(list(filter(lambda x: x, self.stats)))
+
+    def __run(self, batch):
+        """ Run the transactions of @batch, a list of (idx of transaction,
+            attempt), grouped by table.
+        Returns:
+            List of whether each one committed.
+        """
+        if len(batch) == 1:
+            return [self.transactions[batch[0][0]].run()]
+        # Key:   Table obj
+        # Value: positions in @batch of its transactions
+        by_table = {}
+        for pos, (i, _) in enumerate(batch):
+            table = self.transactions[i].get_table()
+            by_table.setdefault(table, []).append(pos)
+        results = [None] * len(batch)
+        for table, positions in by_table.items():
+            committed = table.run_batch(
+                [self.transactions[batch[pos][0]] for pos in positions])
+            for pos, c in zip(positions, committed):
+                results[pos] = c
+        return results
+
+    def __finish(self, queue, n_scheduled, i, attempt, committed):
+        """ Record the outcome of transaction @i, or requeue it with a
+            backoff.
+        Returns:
+            The new number of scheduled runs.
+        """
+        if committed:
+            self.stats[i] = True
+        elif attempt >= self.MAX_ATTEMPTS:
+            self.stats[i] = False
+            self.n_aborts += 1
+        else:
+            self.n_retries += 1
+            backoff = min(self.MAX_BACKOFF,
+                          self.BACKOFF * 2 ** (attempt - 1))
+            when = monotonic() + uniform(0, backoff)
+            n_scheduled += 1
+            heappush(queue, (when, n_scheduled, i, attempt + 1,
+                             when + self.MAX_BACKOFF))
+        return n_scheduled
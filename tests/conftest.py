@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+from lstore.db import Database
+
+
+@pytest.fixture
+def path(tmp_path):
+    """ Directory of a fresh database
+    """
+    return os.path.join(str(tmp_path), 'db')
+
+
+@pytest.fixture
+def db(path):
+    db = Database()
+    db.open(path)
+    yield db
+    db.close()
+
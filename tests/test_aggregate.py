@@ -0,0 +1,162 @@
+import pytest
+
+from lstore.db import Database
+from lstore.query import Query
+
+BUDGET = 300000
+RANGES = [(0, 10**9), (0, 1999), (3, 1003), (150, 160), (100, 299),
+          (0, 2000)]
+OPS = {'sum': sum, 'count': len, 'min': min, 'max': max}
+
+
+def open_db(path):
+    db = Database(buffer_size=BUDGET)
+    db.open(path)
+    return db
+
+
+def expected(rows, begin, end, column, op):
+    vals = [c[column] for k, c in rows.items() if begin <= k <= end]
+    if not vals and op in ('min', 'max'):
+        return None
+    return OPS[op](vals)
+
+
+def check(table, rows):
+    for begin, end in RANGES:
+        for column in (1, 2):
+            for op in table.materialized(column, 'sum').ops:
+                assert table.aggregate(begin, end, column, op) == \
+                    expected(rows, begin, end, column, op), \
+                    (begin, end, column, op)
+
+
+def rows_of(q):
+    return {r.columns[0]: r.columns for r in q.scan([1, 1, 1])}
+
+
+@pytest.fixture
+def filled(path):
+    db = open_db(path)
+    table = db.create_table('t', 3, 0, max_records=128)
+    q = Query(table)
+    for key in range(1000):
+        q.insert(key, key, 1)
+    table.materialize(1)
+    table.materialize(2, ('sum', 'min', 'max'), bucket_size=100)
+    for key in range(1000, 1500):
+        q.insert(key, key, 1)
+    q.update(5, None, 500, 9)
+    q.update_batch([(6, [None, 1, 2]), (6, [None, 7, 3])])
+    q.add_batch([(7, [None, 5, 1]), (7, [None, 1, 4])])
+    q.increment(8, 2)
+    q.delete(9)
+    # the key moves to another bucket
+    q.update(10, 2000, None, None)
+    return db, table, q
+
+
+def test_same_as_scanning(filled):
+    db, table, q = filled
+    check(table, rows_of(q))
+    db.close()
+
+
+def test_whole_buckets_read_no_records(filled, monkeypatch):
+    db, table, q = filled
+    rows = rows_of(q)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('records were read')
+    monkeypatch.setattr('lstore.table.run_partitions', fail)
+    assert table.aggregate(0, 10**9, 1, 'sum') == \
+        expected(rows, 0, 10**9, 1, 'sum')
+    assert table.aggregate(100, 299, 2, 'max') == \
+        expected(rows, 100, 299, 2, 'max')
+    assert q.sum(0, 10**9, 1) == expected(rows, 0, 10**9, 1, 'sum')
+    db.close()
+
+
+def test_survive_reopen(filled, path):
+    db, table, q = filled
+    rows = rows_of(q)
+    db.close()
+    db = open_db(path)
+    table = db.get_table('t')
+    assert len(table.aggregates) == 2
+    check(table, rows)
+    db.close()
+
+
+def crash_n_reopen(path):
+    """ Reopen the database without closing it first
+    """
+    db = open_db(path)
+    return db, db.get_table('t')
+
+
+def test_repaired_after_a_crash(filled, path):
+    db, table, q = filled
+    rows = rows_of(q)
+    db.close()
+    db = open_db(path)
+    table = db.get_table('t')
+    q = Query(table)
+    q.insert(5000, 3, 3)
+    table.checkpoint()
+    q.insert(5001, 4, 4)
+    q.update(20, None, 7, 7)
+    q.delete(21)
+    table.buffer.flush()
+    # no close; the saved aggregates are stale
+    rows[5000], rows[5001] = [5000, 3, 3], [5001, 4, 4]
+    rows[20] = [20, 7, 7]
+    del rows[21]
+    db, table = crash_n_reopen(path)
+    # only the 1st partition & the last one are read again
+    assert table.buffer.n_loads == 2 < len(table.buffer.partitions)
+    check(table, rows)
+    db.close()
+
+
+def test_repaired_after_a_vacuum_and_a_crash(filled, path):
+    db, table, q = filled
+    for key in range(0, 1500, 3):
+        q.delete(key)
+    table.vacuum()
+    q.update(1, None, 50, 50)
+    q.insert(6000, 1, 1)
+    table.buffer.flush()
+    rows = rows_of(q)
+    db, table = crash_n_reopen(path)
+    check(table, rows)
+    # the shares of the partitions were repaired too
+    q = Query(table)
+    q.update(2, None, 60, 60)
+    q.delete(4)
+    table.buffer.flush()
+    rows = rows_of(q)
+    db, table = crash_n_reopen(path)
+    check(table, rows)
+    db.close()
+
+
+def test_clustered_splits(path):
+    db = open_db(path)
+    table = db.create_table('t', 3, 0, max_records=64, clustered=True)
+    table.materialize(1)
+    table.materialize(2, ('sum', 'min', 'max'), bucket_size=100)
+    q = Query(table)
+    for key in range(0, 1000, 2):
+        q.insert(key, key, 1)
+    table.checkpoint()
+    # inserts between the keys split the partitions again
+    for key in range(1, 1000, 4):
+        q.insert(key, key % 7, key % 5)
+    q.delete(500)
+    table.buffer.flush()
+    rows = rows_of(q)
+    check(table, rows)
+    db, table = crash_n_reopen(path)
+    check(table, rows)
+    db.close()
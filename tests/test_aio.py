@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+from lstore.aio import AsyncQuery, AsyncTransaction
+from lstore.config import Config
+from lstore.db import Database
+from lstore.query import Query
+
+# bytes of a partition of 3 user columns & 64 records with one tail page
+SIZE_PART = 2 * (3 + Config.N_META_COLS) * 64 * Config.SIZE_INT
+
+
+def test_calls_in_flight_are_bounded(db):
+    table = db.create_table('t', 3, 0)
+    q = AsyncQuery(table, max_pending=2)
+    lock = threading.Lock()
+    n_running = [0, 0]  # now, max
+    insert = q.query.insert
+
+    def slow_insert(*columns):
+        with lock:
+            n_running[0] += 1
+            n_running[1] = max(n_running)
+        time.sleep(0.005)
+        insert(*columns)
+        with lock:
+            n_running[0] -= 1
+    q.query.insert = slow_insert
+
+    async def main():
+        await asyncio.gather(*(q.insert(k, k, k) for k in range(20)))
+    asyncio.run(main())
+    assert n_running[1] <= 2
+    assert len(Query(table).scan([1, 0, 0])) == 20
+
+
+def test_selects_are_batched_and_coalesced(db, monkeypatch):
+    table = db.create_table('t', 3, 0)
+    for key in range(100):
+        Query(table).insert(key, key * 2, key * 3)
+    batches = []
+    select_many = table.select_many
+
+    def counting(requests):
+        batches.append(len(requests))
+        return select_many(requests)
+    monkeypatch.setattr(table, 'select_many', counting)
+    q = AsyncQuery(table)
+
+    async def main():
+        return await asyncio.gather(
+            *(q.select(key % 10, 0, [1, 1, 1]) for key in range(50)))
+    results = asyncio.run(main())
+    assert batches == [10]
+    for key, result in enumerate(results):
+        assert result[0].columns == [key % 10, key % 10 * 2, key % 10 * 3]
+
+
+def test_transaction(db):
+    table = db.create_table('t', 3, 0)
+    Query(table).insert(1, 2, 3)
+    q = AsyncQuery(table)
+    t = AsyncTransaction()
+    t.add_query(q.update, 1, None, 20, None)
+    t.add_query(q.select, 1, 0, [1, 1, 1])
+    assert asyncio.run(t.run())
+    assert Query(table).select(1, 0, [1, 1, 1])[0].columns == [1, 20, 3]
+
+
+def test_admission_waits_for_buffer_headroom(path):
+    db = Database(buffer_size=8 * SIZE_PART)
+    db.open(path)
+    table = db.create_table('t', 3, 0, max_records=64)
+    for key in range(64 * 8):
+        Query(table).insert(key, key * 2, key * 3)
+    q = AsyncQuery(table)
+    calls = []
+    insert = q.query.insert
+
+    def recording_insert(*columns):
+        calls.append(columns)
+        return insert(*columns)
+    q.query.insert = recording_insert
+    # saturate the budget with pinned partitions
+    for idx_part in range(8):
+        table.buffer.pin(idx_part)
+    assert db.buffer.headroom() <= 0
+
+    async def main():
+        task = asyncio.ensure_future(q.insert(1000, 0, 0))
+        await asyncio.sleep(0.05)
+        stalled = not task.done() and not calls
+        for idx_part in range(8):
+            table.buffer.unpin(idx_part)
+        rid = await asyncio.wait_for(task, 5)
+        return stalled, rid
+    stalled, rid = asyncio.run(main())
+    assert stalled
+    assert calls == [(1000, 0, 0)] and rid == 64 * 8 + 1
+    db.close()
@@ -0,0 +1,150 @@
+import random
+import threading
+
+import pytest
+
+from lstore.db import Database
+from lstore.query import Query
+from lstore.table import Table
+from lstore.transaction import Transaction
+from lstore.transaction_worker import TransactionWorker
+
+N_RECORDS = 2000
+
+
+def build(seed, n):
+    """ Specs of @n transactions of 1 to 4 random queries
+    """
+    rand = random.Random(seed)
+    specs = []
+    next_key = N_RECORDS
+    inserted = []
+    for _ in range(n):
+        ops = []
+        # keys are located before a transaction runs, so its own inserts
+        #   can only be deleted by later ones
+        new = []
+        for _ in range(rand.randint(1, 4)):
+            r, key = rand.random(), rand.randrange(N_RECORDS)
+            if r < .35:
+                ops.append(('select', key))
+            elif r < .6:
+                ops.append(('update', key, rand.randrange(100)))
+            elif r < .85:
+                ops.append(('increment', key))
+            elif r < .9:
+                ops.append(('insert', next_key))
+                new.append(next_key)
+                next_key += 1
+            elif r < .95 and inserted:
+                ops.append(('delete', inserted.pop()))
+            else:
+                ops.append(('add', key, rand.randrange(5)))
+        inserted += new
+        specs.append(ops)
+    return specs
+
+
+def run(path, specs, batch_size):
+    db = Database()
+    db.open(path)
+    table = db.create_table('t', 4, 0)
+    q = Query(table)
+    for key in range(N_RECORDS):
+        q.insert(key, 0, 0, 0)
+    table.index.create_index(2)
+    transactions = []
+    for ops in specs:
+        t = Transaction()
+        for name, key, *args in ops:
+            if name == 'select':
+                t.add_query(q.select, key, 0, [1, 1, 1, 1])
+            elif name == 'update':
+                t.add_query(q.update, key, None, args[0], None, None)
+            elif name == 'increment':
+                t.add_query(q.increment, key, 3)
+            elif name == 'insert':
+                t.add_query(q.insert, key, 1, 2, 3)
+            elif name == 'delete':
+                t.add_query(q.delete, key)
+            else:
+                t.add_query(q.add, key, 1, args[0])
+        transactions.append(t)
+    worker = TransactionWorker(transactions, batch_size=batch_size)
+    worker.run()
+    rows = sorted(tuple(r.columns) for r in q.scan([1, 1, 1, 1]))
+    index = [sorted(table.index.locate(2, value)) for value in range(100)]
+    assert not table.glb_locks and not db.buffer.pins
+    db.close()
+    return worker.stats, rows, index
+
+
+def test_same_outcome_as_one_at_a_time(tmp_path):
+    specs = build(1, 3000)
+    one = run(str(tmp_path / 'one'), specs, 1)
+    batched = run(str(tmp_path / 'batched'), specs, 64)
+    assert one[0] == [True] * len(specs)
+    assert batched == one
+
+
+def test_concurrent_workers_on_hot_keys(db):
+    table = db.create_table('t', 3, 0)
+    q = Query(table)
+    for key in range(20):
+        q.insert(key, 0, 0)
+    rand = random.Random(2)
+    workers = []
+    for _ in range(4):
+        transactions = []
+        for _ in range(300):
+            t = Transaction()
+            for key in rand.sample(range(20), 2):
+                t.add_query(q.increment, key, 1)
+                t.add_query(q.select, key, 0, [1, 1, 1])
+            transactions.append(t)
+        workers.append(TransactionWorker(transactions, max_attempts=1000,
+                                         batch_size=32))
+    threads = [threading.Thread(target=w.run) for w in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(r.columns[1] for r in q.scan([1, 1, 1])) == \
+        2 * sum(w.result for w in workers)
+    assert not table.glb_locks and not db.buffer.pins
+
+
+def test_failed_batch_is_not_committed(db, monkeypatch):
+    table = db.create_table('t', 3, 0)
+    q = Query(table)
+    q.insert(1, 0, 0)
+    t = Transaction()
+    t.add_query(q.increment, 1, 1)
+
+    def fail(self, plans):
+        raise RuntimeError('disk full')
+    monkeypatch.setattr(Table, '_Table__run_plans', fail)
+    rid = table.index.locate(0, 1)[0]
+    results = [None]
+    with pytest.raises(RuntimeError):
+        table._Table__run_locked([t], [(0, [('increment', (1, 1), rid)])],
+                                 results)
+    assert results == [None]
+    assert not table.glb_locks
+
+
+def test_flush_waits_for_pinned_partitions(db):
+    table = db.create_table('t', 3, 0)
+    Query(table).insert(1, 0, 0)
+    table.buffer.pin(0)
+    flushed = threading.Event()
+
+    def flush():
+        table.buffer.flush()
+        flushed.set()
+    threading.Thread(target=flush, daemon=True).start()
+    assert not flushed.wait(0.2)
+    assert table.buffer.partitions[0] is not None
+    table.buffer.unpin(0)
+    assert flushed.wait(5)
+    assert table.buffer.partitions[0] is None
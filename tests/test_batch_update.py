@@ -0,0 +1,39 @@
+from lstore.query import Query
+
+
+def make(db):
+    q = Query(db.create_table('t', 3, 0))
+    for key in range(10):
+        q.insert(key, key, key)
+    return q
+
+
+def test_update_batch(db):
+    q = make(db)
+    assert q.update_batch([(1, [None, 5, None]), (2, (None, None, 6)),
+                           (42, [None, 1, None])]) == 2
+    assert q.select(1, 0, [1, 1, 1])[0].columns == [1, 5, 1]
+    assert q.select(2, 0, [1, 1, 1])[0].columns == [2, 2, 6]
+
+
+def test_key_updated_twice_in_a_batch(db):
+    q = make(db)
+    q.update_batch([(1, [10, None, None]), (1, [11, None, None])])
+    assert q.select(1, 0, [1, 1, 1]) == []
+    assert q.select(10, 0, [1, 1, 1]) == []
+    assert q.select(11, 0, [1, 1, 1])[0].columns == [11, 1, 1]
+
+
+def test_key_updated_back_in_a_batch(db):
+    q = make(db)
+    q.update_batch([(3, [30, None, None]), (3, [3, 7, None])])
+    assert q.select(30, 0, [1, 1, 1]) == []
+    assert q.select(3, 0, [1, 1, 1])[0].columns == [3, 7, 3]
+
+
+def test_upsert(db):
+    q = make(db)
+    assert q.upsert([(4, [None, 40, None]), (20, [None, 2, None]),
+                     (20, [None, None, 3])]) == 1
+    assert q.select(4, 0, [1, 1, 1])[0].columns == [4, 40, 4]
+    assert q.select(20, 0, [1, 1, 1])[0].columns == [20, 2, 3]
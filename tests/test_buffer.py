@@ -0,0 +1,81 @@
+import sys
+import threading
+
+from lstore.config import Config
+from lstore.db import Database
+from lstore.query import Query
+
+# bytes of a partition of 3 user columns & 64 records with one tail page
+SIZE_PART = 2 * (3 + Config.N_META_COLS) * 64 * Config.SIZE_INT
+
+
+def fill(table, n):
+    q = Query(table)
+    for key in range(n):
+        q.insert(key, key * 2, key * 3)
+    return q
+
+
+def test_tables_share_one_budget(path):
+    db = Database(buffer_size=4 * SIZE_PART)
+    db.open(path)
+    a = db.create_table('a', 3, 0, max_records=64)
+    b = db.create_table('b', 3, 0, max_records=64)
+    qa, qb = fill(a, 640), fill(b, 640)
+    assert db.buffer.used <= db.buffer.BUDGET
+    # both tables had partitions evicted to stay within the shared budget
+    assert a.buffer.n_writes and b.buffer.n_writes
+    for key in range(0, 640, 7):
+        assert qa.select(key, 0, [1, 1, 1])[0].columns == \
+            [key, key * 2, key * 3]
+        assert qb.select(key, 0, [1, 1, 1])[0].columns == \
+            [key, key * 2, key * 3]
+    db.close()
+
+
+def test_quota_evicts_own_partitions_first(path):
+    db = Database(buffer_size=100 * SIZE_PART)
+    db.open(path)
+    big = db.create_table('big', 3, 0, max_records=64)
+    small = db.create_table('small', 3, 0, quota=2 * SIZE_PART,
+                            max_records=64)
+    fill(big, 640)
+    fill(small, 640)
+    assert db.buffer.usage[small.buffer] <= 2 * SIZE_PART
+    assert small.buffer.n_writes and not big.buffer.n_writes
+    db.close()
+
+
+def test_writes_survive_evictions_by_other_tables(path):
+    db = Database(buffer_size=SIZE_PART)
+    db.open(path)
+    a = db.create_table('a', 3, 0, max_records=64)
+    b = db.create_table('b', 3, 0, max_records=64)
+    qa, qb = fill(a, 640), fill(b, 640)
+    done = threading.Event()
+
+    def read_b():
+        while not done.is_set():
+            for key in range(0, 640, 13):
+                qb.select(key, 0, [1, 1, 1])
+
+    # switch threads often so that reads of b evict partitions of a in the
+    #   middle of its writes
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    reader = threading.Thread(target=read_b)
+    reader.start()
+    try:
+        for i in range(10000):
+            qa.increment(i % 640, 1)
+            if i % 1000 == 0:
+                qa.update(i % 640, None, None, 1)
+    finally:
+        done.set()
+        reader.join()
+        sys.setswitchinterval(interval)
+    total = sum(qa.select(key, 0, [0, 1, 0])[0].columns[0]
+                for key in range(640))
+    assert total == sum(range(640)) * 2 + 10000
+    assert a.buffer.n_writes and b.buffer.n_writes
+    db.close()
@@ -0,0 +1,83 @@
+import os
+import random
+
+import pytest
+
+from lstore.db import Database
+from lstore.query import Query
+
+N_RECORDS = 3000
+
+
+def read_csv(path):
+    with open(path) as f:
+        return sorted(list(map(int, line.split(','))) for line in f)
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_csv_round_trip(tmp_path, parallel):
+    rand = random.Random(1)
+    rows = [[key] + [rand.randrange(1000) for _ in range(4)]
+            for key in range(N_RECORDS)]
+    path_in = str(tmp_path / 'in.csv')
+    with open(path_in, 'w') as f:
+        f.write('a,b,c,d,e\n')
+        f.writelines(','.join(map(str, row)) + '\n' for row in rows)
+    db = Database()
+    db.open(str(tmp_path / 'db'))
+    progress = []
+    assert db.import_csv('t', path_in, header=True, parallel=parallel,
+                         progress=progress.append, chunk_size=700) \
+        == N_RECORDS
+    assert progress == [700, 1400, 2100, 2800, 3000]
+    table = db.tables['t']
+    q = Query(table)
+    # the key index was fed by the import
+    assert q.select(1234, 0, [1] * 5)[0].columns == rows[1234]
+    table.index.create_index(2)
+    for key in rand.sample(range(N_RECORDS), 100):
+        rows[key][2] = rand.randrange(1000)
+        q.update(key, None, None, rows[key][2], None, None)
+    deleted = set(rand.sample(range(N_RECORDS), 100))
+    for key in deleted:
+        q.delete(key)
+    live = [row for row in rows if row[0] not in deleted]
+    value = live[10][2]
+    assert sorted(r.columns[0] for r in q.select(value, 2, [1, 0, 0, 0, 0])) \
+        == sorted(row[0] for row in live if row[2] == value)
+
+    path_out = str(tmp_path / 'out.csv')
+    progress = []
+    assert db.export_csv('t', path_out, parallel=parallel,
+                         progress=progress.append) == len(live)
+    assert progress[-1] == len(live)
+    assert read_csv(path_out) == sorted(live)
+    db.close()
+
+
+def test_columns_round_trip(tmp_path):
+    db = Database()
+    db.open(str(tmp_path / 'db'))
+    table = db.create_table('t', 3, 0)
+    q = Query(table)
+    for key in range(N_RECORDS):
+        q.insert(key, key * 2, key % 7)
+    q.delete(5)
+    q.update(6, None, 60, None)
+    paths = [str(tmp_path / ('c%d' % i)) for i in range(3)]
+    assert db.export_columns('t', paths) == N_RECORDS - 1
+    assert all(os.path.getsize(p) == (N_RECORDS - 1) * 8 for p in paths)
+    assert db.import_columns('u', paths, chunk_size=1000) == N_RECORDS - 1
+    u = Query(db.tables['u'])
+    assert u.select(6, 0, [1, 1, 1])[0].columns == [6, 60, 6]
+    assert u.select(5, 0, [1, 1, 1]) == []
+    assert u.sum(0, N_RECORDS, 1) == q.sum(0, N_RECORDS, 1)
+    db.close()
+    db = Database()
+    db.open(str(tmp_path / 'db'))
+    path_out = str(tmp_path / 'u.csv')
+    db.export_csv('u', path_out)
+    assert read_csv(path_out) == sorted(
+        [key, 60 if key == 6 else key * 2, key % 7]
+        for key in range(N_RECORDS) if key != 5)
+    db.close()
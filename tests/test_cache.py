@@ -0,0 +1,84 @@
+import threading
+
+from lstore.cache import RecordCache
+from lstore.query import Query
+
+
+def make_table(db, n=200):
+    table = db.create_table('t', 3, 0)
+    table.set_cache(50)
+    q = Query(table)
+    for key in range(n):
+        q.insert(key, key, 0)
+    return table, q
+
+
+def select(q, key):
+    return [r.columns for r in q.select(key, 0, [1, 1, 1])]
+
+
+def test_writes_invalidate_cached_records(db):
+    table, q = make_table(db)
+    for _ in range(3):
+        assert select(q, 0) == [[0, 0, 0]]
+    assert table.cache.stats()['hits'] == 2
+    q.update(0, None, 5, None)
+    assert select(q, 0) == [[0, 5, 0]]
+    q.increment(0, 2)
+    assert select(q, 0) == [[0, 5, 1]]
+    q.add_batch([(0, [None, 1, 1])])
+    assert select(q, 0) == [[0, 6, 2]]
+    q.update_batch([(0, [None, 7, None])])
+    assert select(q, 0) == [[0, 7, 2]]
+    q.delete(0)
+    assert select(q, 0) == []
+    assert table.select_many([(1, 0, [1, 1, 1])])[0][0].columns == [1, 1, 0]
+
+
+def test_scan_of_cold_records_keeps_hot_ones(db):
+    table, q = make_table(db)
+    for _ in range(10):
+        for key in range(10):
+            select(q, key)
+    for key in range(10, 200):
+        select(q, key)
+    hits = table.cache.stats()['hits']
+    for key in range(10):
+        select(q, key)
+    assert table.cache.stats()['hits'] == hits + 10
+    assert table.cache.stats()['size'] <= 50
+
+
+def test_racing_read_puts_no_stale_value():
+    cache = RecordCache(10)
+    generation = cache.generation(1)
+    # the record is written between the read and the put
+    cache.invalidate([1])
+    cache.put(1, (1,), [0], generation)
+    assert cache.get(1, (1,)) is None
+
+
+def test_concurrent_increments_and_selects(db):
+    _, q = make_table(db)
+    # values seen by each reader
+    seen = [[], []]
+
+    def write():
+        for _ in range(1000):
+            q.increment(3, 2)
+
+    def read(values):
+        for _ in range(1000):
+            values.append(select(q, 3)[0])
+    threads = [threading.Thread(target=write)] + \
+        [threading.Thread(target=read, args=(values,)) for values in seen]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert select(q, 3) == [[3, 3, 1000]]
+    for values in seen:
+        assert all(v[:2] == [3, 3] for v in values)
+        # a reader never gets a stale value back from the cache
+        counts = [v[2] for v in values]
+        assert counts == sorted(counts)
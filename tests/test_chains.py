@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from lstore.config import Config
+from lstore.db import Database
+from lstore.partition import Partition
+from lstore.query import Query
+
+N_COLS = 5 + Config.N_META_COLS
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_reads_match_cumulative_tails(monkeypatch, sparse):
+    monkeypatch.setattr(Config, 'MAX_CHAIN', 2)
+    rand = random.Random(1)
+    ref = Partition(N_COLS, 4, 64)
+    p = Partition(N_COLS, 4, 64, sparse, False)
+    for x in (ref, p):
+        for i in range(64):
+            x.write(None, i + 1, 0, None, i, i, i, i, i)
+    for _ in range(2000):
+        # merge before the tail pages of the reference run out
+        if len(ref.tail_pages) * 64 - ref.count_tail_rec < 2:
+            ref.merge()
+            p.merge()
+        idx = rand.randrange(64)
+        columns = [None] * 5
+        columns[rand.randrange(1, 5)] = rand.randrange(1000)
+        ref.update(idx, idx + 1, *columns)
+        p.update(idx, idx + 1, *columns)
+        query_columns = [0] * Config.N_META_COLS + \
+            [rand.randrange(2) for _ in range(5)]
+        assert p.read(idx, query_columns) == ref.read(idx, query_columns)
+        # folding bounds the tail records a read walks through
+        assert p.chain_lens[idx] <= Config.MAX_CHAIN
+
+
+def test_table_with_delta_tails(path):
+    rows = {}
+    for cumulative in (True, False):
+        db = Database()
+        db.open(path + str(cumulative))
+        table = db.create_table('t', 5, 0, max_records=64,
+                                cumulative=cumulative)
+        q = Query(table)
+        rand = random.Random(2)
+        for key in range(300):
+            q.insert(key, 0, 0, 0, 0)
+        for _ in range(3000):
+            key = rand.randrange(300)
+            if rand.random() < .5:
+                q.increment(key, rand.randrange(1, 5))
+            else:
+                columns = [None] * 5
+                columns[rand.randrange(1, 5)] = rand.randrange(1000)
+                q.update(key, *columns)
+        rows[cumulative] = [r.columns for r in q.scan([1] * 5)]
+        db.close()
+        db = Database()
+        db.open(path + str(cumulative))
+        assert [r.columns for r in Query(db.get_table('t')).scan([1] * 5)] \
+            == rows[cumulative]
+        db.close()
+    assert rows[True] == rows[False]
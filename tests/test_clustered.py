@@ -0,0 +1,138 @@
+import threading
+
+from lstore.query import Query
+from lstore.transaction import Transaction
+from lstore.transaction_worker import TransactionWorker
+
+MAX_RECORDS = 16
+
+
+def make_table(db, n=MAX_RECORDS):
+    """ Clustered table whose only partition is full with keys 0..@n-1
+    """
+    table = db.create_table('t', 3, 0, max_records=MAX_RECORDS,
+                            clustered=True)
+    q = Query(table)
+    for key in range(n):
+        q.insert(key, 0, 0)
+    return table, q
+
+
+def test_sum_passes_parallel_through(db, monkeypatch):
+    table, q = make_table(db)
+    calls = []
+    aggregate = table.aggregate
+
+    def recording(*args):
+        calls.append(args[-1])
+        return aggregate(*args)
+    monkeypatch.setattr(table, 'aggregate', recording)
+    assert q.sum(0, 10, 0) == sum(range(11))
+    assert q.sum(0, 10, 0, parallel=False) == sum(range(11))
+    assert calls == [False, False]
+
+
+def test_locks_follow_records_moved_by_a_split(db):
+    table, q = make_table(db)
+    old_rid = table.index.locate(0, 15)[0]
+    # a running transaction holding an X lock on key 15
+    own_locks = {old_rid: 'X'}
+    table.glb_locks[old_rid] = 'X'
+    table.lock_holders[id(own_locks)] = own_locks
+    version = table.rid_versions.get(old_rid, 0)
+    q.insert(16, 0, 0)
+    new_rid = table.index.locate(0, 15)[0]
+    assert new_rid != old_rid
+    assert table.glb_locks == {new_rid: 'X'}
+    assert own_locks == {new_rid: 'X'}
+    assert table.rid_versions[new_rid] > version
+    assert table.rid_versions[old_rid] > version
+    table.release_lock(own_locks)
+    assert table.glb_locks == {} and table.lock_holders == {}
+
+
+def test_record_moved_while_being_locked_aborts(db, monkeypatch):
+    table, q = make_table(db)
+    old_rid = table.index.locate(0, 15)[0]
+    locate = table.index.locate
+    splits = [lambda: q.insert(16, 0, 0)]
+
+    def locate_then_split(column, key):
+        rids = list(locate(column, key))
+        if splits:
+            splits.pop()()
+        return rids
+    monkeypatch.setattr(table.index, 'locate', locate_then_split)
+    t = Transaction()
+    t.add_query(q.update, 15, None, 1, None)
+    assert not t.run()
+    assert t.conflicts == [old_rid]
+    assert not table.glb_locks
+    # the retry finds the record at its new RID
+    assert t.run()
+    assert q.select(15, 0, [0, 1, 0])[0].columns == [1]
+
+
+def test_optimistic_read_of_a_moved_record_aborts(db):
+    table, q = make_table(db)
+    t = Transaction('occ')
+    t.add_query(q.update, 15, None, 1, None)
+    t.add_query(q.select, 0, 0, [1, 1, 1])
+    select = q.select
+
+    def select_then_split(*args):
+        q.insert(16, 0, 0)
+        return select(*args)
+    select_then_split.__name__ = 'select'
+    t.queries[1] = (select_then_split, t.queries[1][1])
+    assert not t.run()
+    assert q.select(15, 0, [0, 1, 0])[0].columns == [0]
+
+
+def test_inserted_record_is_locked_across_splits(db):
+    table, q = make_table(db, MAX_RECORDS - 1)
+    t = Transaction('occ')
+    t.add_query(q.insert, 15, 0, 0)
+    for key in range(16, 40):
+        t.add_query(q.insert, key, 0, 0)
+    t.add_query(q.update, 15, None, 7, None)
+    update = q.update
+    locked = []
+
+    def checking_update(key, *columns):
+        locked.append(table.glb_locks.get(table.index.locate(0, key)[0]))
+        update(key, *columns)
+    checking_update.__name__ = 'update'
+    t.queries[-1] = (checking_update, t.queries[-1][1])
+    assert t.run()
+    assert locked == ['X']
+    assert q.select(15, 0, [0, 1, 0])[0].columns == [7]
+    assert not table.glb_locks
+
+
+def test_increments_while_splitting(db):
+    table, q = make_table(db, 64)
+    workers = []
+    for w in range(2):
+        transactions = []
+        for i in range(200):
+            t = Transaction()
+            t.add_query(q.increment, (i * 7 + w) % 64, 1)
+            transactions.append(t)
+        workers.append(TransactionWorker(transactions, max_attempts=1000))
+
+    def insert():
+        for key in range(64, 1000):
+            q.insert(key, 0, 0)
+    threads = [threading.Thread(target=w.run) for w in workers]
+    threads.append(threading.Thread(target=insert))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    committed = sum(w.result for w in workers)
+    assert committed == 400
+    total = sum(q.select(key, 0, [0, 1, 0])[0].columns[0]
+                for key in range(64))
+    assert total == committed
+    assert not table.glb_locks and not table.lock_holders
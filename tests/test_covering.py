@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from lstore.db import Database
+from lstore.query import Query
+from lstore.table import Table
+
+
+def check(table, ref):
+    for value in range(0, 100, 7):
+        got = sorted(tuple(r.columns)
+                     for r in table.select(value, 2, [0, 0, 1, 1, 0]))
+        assert got == sorted((r[2], r[3]) for r in ref.values()
+                             if r[2] == value)
+    got = sorted(tuple(r.columns)
+                 for r in table.select_range(10, 20, 2, [0, 0, 1, 1, 0]))
+    assert got == sorted((r[2], r[3]) for r in ref.values()
+                         if 10 <= r[2] < 20)
+    # not covered; the records are read
+    got = sorted(tuple(r.columns)
+                 for r in table.select_range(10, 20, 2, [1, 0, 1, 0, 0]))
+    assert got == sorted((r[0], r[2]) for r in ref.values()
+                         if 10 <= r[2] < 20)
+
+
+@pytest.fixture
+def covered(path):
+    db = Database()
+    db.open(path)
+    table = db.create_table('t', 5, 0)
+    q = Query(table)
+    rand = random.Random(1)
+    ref = {}
+    for key in range(500):
+        ref[key] = [key] + [rand.randrange(100) for _ in range(4)]
+        q.insert(*ref[key])
+    table.index.create_index(2, include=(3,))
+    return db, table, q, ref, rand
+
+
+def test_covered_selects_read_no_records(covered, monkeypatch):
+    db, table, _, ref, _ = covered
+
+    def fail(*args):
+        raise AssertionError('records were read')
+    monkeypatch.setattr(Table, '_Table__read_rids', fail)
+    for value in range(0, 100, 7):
+        assert len(table.select(value, 2, [0, 0, 1, 1, 0])) == \
+            sum(r[2] == value for r in ref.values())
+    with pytest.raises(AssertionError):
+        table.select(7, 2, [1, 0, 1, 0, 0])
+    db.close()
+
+
+def test_covering_index_follows_writes(covered, path):
+    db, table, q, ref, rand = covered
+    check(table, ref)
+    for _ in range(1500):
+        key = rand.choice(list(ref))
+        op = rand.random()
+        if op < .5:
+            columns = [None, None,
+                       rand.randrange(100) if rand.random() < .5 else None,
+                       rand.randrange(100), None]
+            q.update(key, *columns)
+            ref[key] = [o if n is None else n
+                        for o, n in zip(ref[key], columns)]
+        elif op < .7:
+            q.increment(key, 3)
+            ref[key][3] += 1
+        elif op < .8:
+            q.delete(key)
+            del ref[key]
+        else:
+            new_key = max(ref) + 1 + rand.randrange(5)
+            q.update(key, new_key, None, None, None, None)
+            ref[new_key] = ref.pop(key)
+            ref[new_key][0] = new_key
+    check(table, ref)
+    assert len(table.select_range(0, 100, 2, [0, 0, 1, 1, 0],
+                                  columnar=True)) == len(ref)
+    table.vacuum()
+    check(table, ref)
+    db.close()
+    db = Database()
+    db.open(path)
+    check(db.get_table('t'), ref)
+    db.close()
@@ -0,0 +1,143 @@
+import random
+
+import pytest
+
+from lstore.btree import DiskBTree
+from lstore.config import Config
+from lstore.db import Database
+from lstore.query import Query
+
+BUDGET = 300000
+
+
+def open_db(path):
+    db = Database(buffer_size=BUDGET)
+    db.open(path)
+    return db
+
+
+def check(table, ref, rand):
+    q = Query(table)
+    for key in rand.sample(list(ref), 100):
+        assert [r.columns for r in q.select(key, 0, [1, 1, 1, 1])] == \
+            [ref[key]]
+    for value in rand.sample(range(100), 10):
+        got = sorted(r.columns[0] for r in table.select(value, 1, [1, 0, 0, 0]))
+        assert got == sorted(k for k, row in ref.items() if row[1] == value)
+    begin = rand.randrange(10**6)
+    got = sorted(r.columns[0] for r in
+                 table.select_range(begin, begin + 50000, 0, [1, 0, 0, 0]))
+    assert got == sorted(k for k in ref if begin <= k < begin + 50000)
+
+
+@pytest.fixture
+def filled(path, monkeypatch):
+    monkeypatch.setattr(Config, 'DISK_INDEX', True)
+    monkeypatch.setattr(Config, 'INDEX_BATCH', 16)
+    db = open_db(path)
+    table = db.create_table('t', 4, 0)
+    q = Query(table)
+    rand = random.Random(3)
+    ref = {}
+    for key in rand.sample(range(10**6), 3000):
+        ref[key] = [key, rand.randrange(100), 0, 0]
+        q.insert(*ref[key])
+    table.index.create_index(1, on_disk=True)
+    return db, table, ref, rand
+
+
+def write(q, ref, rand, n):
+    for _ in range(n):
+        key = rand.choice(list(ref))
+        op = rand.random()
+        if op < .6:
+            ref[key][1] = rand.randrange(100)
+            q.update(key, None, ref[key][1], None, None)
+        elif op < .8:
+            q.delete(key)
+            del ref[key]
+        else:
+            new_key = rand.randrange(10**6, 2 * 10**6)
+            if new_key in ref:
+                continue
+            q.update(key, new_key, None, None, None)
+            ref[new_key] = ref.pop(key)
+            ref[new_key][0] = new_key
+
+
+def test_nodes_are_paged_through_the_buffer(filled, path):
+    db, table, ref, rand = filled
+    tree = table.index.I[0]
+    assert isinstance(tree, DiskBTree)
+    check(table, ref, rand)
+    write(Query(table), ref, rand, 1000)
+    check(table, ref, rand)
+    # the tree doesn't fit in the budget
+    assert tree.n_writes and tree.n_loads
+    assert len(tree.nodes) < tree.n_pages
+    db.close()
+    db = open_db(path)
+    table = db.get_table('t')
+    assert isinstance(table.index.I[1], DiskBTree)
+    assert not table.index.to_be_indexed
+    check(table, ref, rand)
+    table.vacuum()
+    check(table, ref, rand)
+    db.close()
+
+
+def crash_n_reopen(path, monkeypatch):
+    """ Reopen the database without closing it first
+    Returns:
+        (db, table, whether each tree file was usable upon reopening)
+    """
+    attached = []
+    attach = DiskBTree.attach
+
+    def recording(tree, *args):
+        attached.append(attach(tree, *args))
+        return attached[-1]
+    monkeypatch.setattr(DiskBTree, 'attach', recording)
+    db = open_db(path)
+    table = db.get_table('t')
+    monkeypatch.setattr(DiskBTree, 'attach', attach)
+    return db, table, attached
+
+
+def test_recovered_from_the_checkpoint_after_a_crash(filled, path,
+                                                     monkeypatch):
+    db, table, ref, rand = filled
+    for _ in range(2):
+        table.checkpoint()
+        write(Query(table), ref, rand, 500)
+        table.index.flush()
+        # the tree files get nodes written after the checkpoint
+        db.buffer.flush()
+        db, table, attached = crash_n_reopen(path, monkeypatch)
+        assert attached and all(attached)
+        assert not table.index.to_be_indexed
+        check(table, ref, rand)
+    db.close()
+
+
+def test_recovery_only_reads_the_partitions_written(filled, path,
+                                                    monkeypatch):
+    db, table, ref, rand = filled
+    # index column 1 before the checkpoint
+    check(table, ref, rand)
+    table.checkpoint()
+    n_parts = len(table.buffer.partitions)
+    q = Query(table)
+    # records of the 1st partition only
+    for rid in range(1, 200):
+        key = table[rid][Config.N_META_COLS]
+        ref[key][1] = rand.randrange(100)
+        q.update(key, None, ref[key][1], None, None)
+    table.index.flush()
+    db.buffer.flush()
+    db, table, attached = crash_n_reopen(path, monkeypatch)
+    assert attached and all(attached)
+    # the 1st partition & the last one for the number of records
+    assert table.buffer.n_loads <= 2 < n_parts
+    check(table, ref, rand)
+    db.close()
@@ -0,0 +1,34 @@
+from lstore.db import Database
+from lstore.query import Query
+
+
+def test_records_per_partition_is_per_table(db):
+    small = db.create_table('small', 2, 0, max_records=16)
+    large = db.create_table('large', 2, 0)
+    for table in (small, large):
+        q = Query(table)
+        for key in range(100):
+            q.insert(key, key + 1)
+    assert len(small.buffer.partitions) == 7
+    assert len(large.buffer.partitions) == 1
+    assert Query(small).select(99, 0, [1, 1])[0].columns == [99, 100]
+
+
+def test_geometry_survives_reopening(path):
+    db = Database()
+    db.open(path)
+    q = Query(db.create_table('t', 2, 0, max_records=16))
+    for key in range(40):
+        q.insert(key, key)
+    db.close()
+
+    db = Database()
+    db.open(path)
+    t = db.get_table('t')
+    assert t.MAX_RECORDS == 16
+    q = Query(t)
+    q.insert(40, 40)
+    assert q.select(40, 0, [1, 1])[0].rid == 41
+    assert [q.select(k, 0, [1, 1])[0].columns for k in (0, 17, 39)] == \
+        [[0, 0], [17, 17], [39, 39]]
+    db.close()
@@ -0,0 +1,29 @@
+import threading
+
+from lstore.query import Query
+
+
+def test_add_and_increment(db):
+    q = Query(db.create_table('t', 3, 0))
+    q.insert(1, 10, 100)
+    assert q.increment(1, 1)
+    assert q.add(1, 2, 5)
+    assert not q.add(2, 1, 1)
+    assert q.select(1, 0, [1, 1, 1])[0].columns == [1, 11, 105]
+    assert q.add_batch([(1, [None, 1, None]), (1, [None, 1, 2])]) == 2
+    assert q.select(1, 0, [1, 1, 1])[0].columns == [1, 13, 107]
+
+
+def test_concurrent_increments_are_not_lost(db):
+    q = Query(db.create_table('t', 2, 0))
+    q.insert(1, 0)
+
+    def work():
+        for _ in range(500):
+            q.increment(1, 1)
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert q.select(1, 0, [0, 1])[0].columns == [2000]
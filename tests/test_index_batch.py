@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from lstore.db import Database
+from lstore.query import Query
+
+
+def expected(ref, column, value):
+    return sorted(key for key, row in ref.items() if row[column] == value)
+
+
+def check(table, ref):
+    for value in range(20):
+        keys = sorted(r.columns[0]
+                      for r in table.select(value, 2, [1, 0, 0, 0]))
+        assert keys == expected(ref, 2, value)
+    got = sorted(tuple(r.columns)
+                 for r in table.select_range(5, 12, 2, [1, 0, 1, 0]))
+    assert got == sorted((key, row[2]) for key, row in ref.items()
+                         if 5 <= row[2] < 12)
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 10**6])
+def test_locate_sees_buffered_changes(path, batch_size):
+    db = Database()
+    db.open(path)
+    table = db.create_table('t', 4, 0)
+    q = Query(table)
+    rand = random.Random(batch_size)
+    ref = {}
+    for key in range(400):
+        ref[key] = [key, 0, rand.randrange(20), 0]
+        q.insert(*ref[key])
+    table.index.create_index(2)
+    table.index.batch_size = batch_size
+    for i in range(1000):
+        key = rand.choice(list(ref))
+        op = rand.random()
+        if op < .6:
+            ref[key][2] = rand.randrange(20)
+            q.update(key, None, None, ref[key][2], None)
+        elif op < .7:
+            ref[key][2] += 1
+            q.increment(key, 2)
+        elif op < .8:
+            q.delete(key)
+            del ref[key]
+        else:
+            new_key = max(ref) + 1
+            ref[new_key] = [new_key, 0, rand.randrange(20), 0]
+            q.insert(*ref[new_key])
+        if i % 100 == 0:
+            check(table, ref)
+    if batch_size > 1000:
+        # nothing was applied to the tree yet
+        assert table.index.pending[2]
+    check(table, ref)
+    db.close()
+    db = Database()
+    db.open(path)
+    table = db.get_table('t')
+    check(table, ref)
+    table.index.flush()
+    assert not table.index.pending[2]
+    check(table, ref)
+    db.close()
@@ -0,0 +1,65 @@
+import threading
+
+from lstore.query import Query
+from lstore.transaction import Transaction
+
+
+def occ(*queries):
+    t = Transaction('occ')
+    for query, *args in queries:
+        t.add_query(query, *args)
+    return t
+
+
+def test_writes_after_an_insert_run_under_its_lock(db):
+    table = db.create_table('t', 3, 0)
+    q = Query(table)
+    locked = []
+    update = q.update
+
+    def checking_update(key, *columns):
+        locked.append(table.is_locked(table.index.locate(0, key)))
+        update(key, *columns)
+    checking_update.__name__ = 'update'
+    t = occ((q.insert, 5, 1, 1), (checking_update, 5, None, 2, None),
+            (q.increment, 5, 2))
+    assert t.run()
+    assert locked == [True]
+    assert q.select(5, 0, [1, 1, 1])[0].columns == [5, 2, 2]
+    assert not table.glb_locks
+
+
+def test_write_on_a_missing_key_aborts(db):
+    table = db.create_table('t', 3, 0)
+    q = Query(table)
+    q.insert(1, 1, 1)
+    t = occ((q.insert, 7, 0, 0), (q.update, 1, None, 5, None),
+            (q.update, 99, None, 5, None))
+    assert not t.run()
+    # none of the writes is installed
+    assert q.select(7, 0, [1, 1, 1]) == []
+    assert q.select(1, 0, [1, 1, 1])[0].columns == [1, 1, 1]
+    assert not occ((q.delete, 99)).run()
+    assert not occ((q.increment, 99, 1)).run()
+
+
+def test_insert_waits_for_a_lock_on_its_new_record(db):
+    table = db.create_table('t', 3, 0)
+    q = Query(table)
+    q.insert(1, 1, 1)
+    # a pessimistic insert locks the next RID in advance
+    table.glb_locks[table.get_num_rec() + 1] = 'X'
+    result = []
+    t = threading.Thread(
+        target=lambda: result.append(occ((q.insert, 2, 2, 2),
+                                          (q.update, 2, None, 3, None)).run()),
+        daemon=True)
+    t.start()
+    t.join(0.2)
+    # the record can't be located before it's locked
+    assert t.is_alive()
+    assert q.select(2, 0, [1, 1, 1]) == []
+    del table.glb_locks[table.get_num_rec()]
+    t.join(5)
+    assert result == [True]
+    assert q.select(2, 0, [1, 1, 1])[0].columns == [2, 3, 2]
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from lstore import parallel
+from lstore.query import Query
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self):
+        super().__init__(2)
+        self.n_tasks = 0
+
+    def submit(self, *args, **kwargs):
+        self.n_tasks += 1
+        return super().submit(*args, **kwargs)
+
+
+def make(db):
+    table = db.create_table('t', 3, 0, max_records=64)
+    q = Query(table)
+    for key in range(1000):
+        q.insert(key, key % 10, key * 2)
+    for key in range(0, 1000, 7):
+        q.update(key, None, 100, None)
+    for key in range(0, 1000, 11):
+        q.delete(key)
+    return q
+
+
+def test_parallel_matches_serial(db):
+    q = make(db)
+    try:
+        for op in ('sum', 'count', 'min', 'max'):
+            assert getattr(q, op)(10, 900, 1, parallel=True) == \
+                getattr(q, op)(10, 900, 1)
+        serial = q.scan([1, 1, 0], columnar=True)
+        scanned = q.scan([1, 1, 0], columnar=True, parallel=True)
+        assert list(scanned.rids) == list(serial.rids)
+        assert [list(c) for c in scanned.columns] == \
+            [list(c) for c in serial.columns]
+    finally:
+        parallel.shutdown()
+
+
+def test_buffered_partitions_go_to_the_workers(db, monkeypatch):
+    q = make(db)
+    table = q.table
+    n_parts = len(table.buffer.partitions)
+    assert all(p is not None for p in table.buffer.partitions)
+    pool = CountingExecutor()
+    monkeypatch.setattr(parallel, '_executor', pool)
+    assert q.count(0, 999, 2, parallel=True) == 1000 - 91
+    assert pool.n_tasks == n_parts
+    pool.n_tasks = 0
+    q.count(0, 999, 2)
+    assert pool.n_tasks == 0
+    pool.shutdown()
@@ -0,0 +1,137 @@
+import os
+import pickle
+import threading
+
+import pytest
+
+from lstore.config import Config
+from lstore.db import Database
+from lstore.query import Query
+
+N_RECORDS = 64 * 32
+
+
+def open_table(path):
+    """ Reopen the table written by make_table with none of it in memory
+    """
+    db = Database()
+    db.open(path)
+    return db, db.get_table('t')
+
+
+@pytest.fixture
+def table_path(path):
+    db = Database()
+    db.open(path)
+    table = db.create_table('t', 3, 0, max_records=64)
+    q = Query(table)
+    for key in range(N_RECORDS):
+        q.insert(key, key * 2, key * 3)
+    db.close()
+    return path
+
+
+def io_threads(table):
+    return [t for t in threading.enumerate()
+            if t.name == 'prefetch %s' % table.buffer.PATH]
+
+
+def test_corrupt_partition_does_not_hang_readers(table_path):
+    db, table = open_table(table_path)
+    with open(os.path.join(table.buffer.PATH, '3'), 'r+b') as f:
+        f.truncate(10)
+    table.buffer.prefetch([3])
+    errors = []
+
+    def read():
+        try:
+            table.buffer[3]
+        except Exception as e:
+            errors.append(e)
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    reader.join(5)
+    assert not reader.is_alive()
+    assert len(errors) == 1
+    # the I/O thread survived the bad file
+    table.buffer.prefetch([4])
+    assert table.buffer[4].count_base_rec == 64
+    assert len(io_threads(table)) == 1
+    db.close()
+
+
+def test_io_thread_stops_on_close(table_path):
+    db, table = open_table(table_path)
+    table.buffer.prefetch([1, 2])
+    threads = io_threads(table)
+    assert len(threads) == 1
+    db.close()
+    threads[0].join(5)
+    assert not threads[0].is_alive()
+
+
+def test_io_thread_stops_on_drop(table_path):
+    db, table = open_table(table_path)
+    table.buffer.prefetch([1, 2])
+    threads = io_threads(table)
+    db.drop_table('t')
+    threads[0].join(5)
+    assert not threads[0].is_alive()
+    db.close()
+
+
+def test_readahead_is_requested_once_per_window(table_path, monkeypatch):
+    db, table = open_table(table_path)
+    requests = []
+    prefetch = type(table.buffer).prefetch
+
+    def counting(self, idx_parts):
+        idx_parts = list(idx_parts)
+        requests.append(idx_parts)
+        return prefetch(self, idx_parts)
+    monkeypatch.setattr(type(table.buffer), 'prefetch', counting)
+    n_parts = len(table.buffer.partitions)
+    for idx_part in range(n_parts):
+        table.buffer[idx_part]
+    requested = [idx for idx_parts in requests for idx in idx_parts]
+    # every partition is requested at most once, in about one call per
+    #   half window
+    assert len(requested) == len(set(requested))
+    assert len(requests) <= n_parts // (Config.READAHEAD // 2) + 1
+    assert table.buffer.n_prefetched > 0
+    db.close()
+
+
+def test_miss_does_not_hold_up_other_tables(table_path, monkeypatch):
+    db, table = open_table(table_path)
+    other = db.create_table('u', 3, 0, max_records=64)
+    fill = Query(other)
+    for key in range(N_RECORDS):
+        fill.insert(key, key * 2, key * 3)
+    other.buffer.flush()
+    # reads of the files of table t hang until released
+    release = threading.Event()
+    load = pickle.load
+
+    def slow_load(f):
+        if os.path.dirname(f.name) == table.buffer.PATH:
+            assert release.wait(5)
+        return load(f)
+    monkeypatch.setattr(pickle, 'load', slow_load)
+    stuck = threading.Thread(target=lambda: table.buffer[0], daemon=True)
+    stuck.start()
+    waiting = threading.Thread(target=lambda: table.buffer[0], daemon=True)
+    waiting.start()
+    reader = threading.Thread(
+        target=lambda: [other.buffer[i] for i in range(4)], daemon=True)
+    reader.start()
+    reader.join(2)
+    assert not reader.is_alive()
+    assert stuck.is_alive() and waiting.is_alive()
+    release.set()
+    stuck.join(5)
+    waiting.join(5)
+    assert not stuck.is_alive() and not waiting.is_alive()
+    # read once for both
+    assert table.buffer.n_loads == 2
+    db.close()
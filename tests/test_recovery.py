@@ -0,0 +1,172 @@
+import os
+import threading
+
+from lstore.config import Config
+from lstore.db import Database
+from lstore.partition import Partition
+from lstore.query import Query
+
+# small enough that the partitions keep getting evicted
+BUDGET = 8 * (3 + Config.N_META_COLS) * 64 * Config.SIZE_INT
+
+
+def open_db(path, budget=BUDGET):
+    db = Database(budget)
+    db.open(path)
+    return db
+
+
+def check_consistent(table, keys):
+    """ Every record of @keys is found through the key index & the secondary
+        index on column 2, and no other record is indexed
+    """
+    q = Query(table)
+    for key, columns in keys.items():
+        records = q.select(key, 0, [1, 1, 1])
+        assert [r.columns for r in records] == [columns]
+        assert records[0].rid in table.index.locate(2, columns[2])
+    for column in (0, 2):
+        n_indexed = sum(len(rids) for rids in table.index.I[column].values())
+        assert n_indexed == len(keys)
+
+
+def test_recovery_after_crash_between_checkpoints(path):
+    db = open_db(path)
+    table = db.create_table('t', 3, 0, max_records=64)
+    q = Query(table)
+    for key in range(1000):
+        q.insert(key, key, 0)
+    table.index.create_index(2)
+    db.checkpoint()
+    for key in range(1000, 2000):
+        q.insert(key, key, 0)
+    for key in range(0, 2000, 4):
+        q.update(key, key + 100000, None, 7)
+    for key in range(1, 2000, 9):
+        q.delete(key)
+    # crash: the partitions in memory are lost, those evicted are not
+    table.buffer.flush()
+    del db, table, q
+
+    db = open_db(path)
+    table = db.get_table('t')
+    keys = {}
+    for key in range(2000):
+        if key % 4 == 0:
+            # updated to a new key before the delete of the old one
+            keys[key + 100000] = [key + 100000, key, 7]
+        elif key % 9 != 1:
+            keys[key] = [key, key, 0]
+    check_consistent(table, keys)
+    Query(table).insert(5000, 1, 1)
+    assert Query(table).select(5000, 0, [1, 1, 1])[0].rid == 2001
+    db.close()
+
+
+def test_writes_after_reopening_are_recovered(path):
+    db = open_db(path)
+    q = Query(db.create_table('t', 3, 0, max_records=64))
+    for key in range(1000):
+        q.insert(key, key, 0)
+    # the checkpoint upon close trims the log of partition writes
+    db.close()
+
+    db = open_db(path)
+    table = db.get_table('t')
+    q = Query(table)
+    for key in range(0, 1000, 3):
+        q.update(key, key + 100000, None, None)
+    table.buffer.flush()
+    del db, table, q
+
+    db = open_db(path)
+    q = Query(db.get_table('t'))
+    for key in range(0, 1000, 3):
+        assert q.select(key, 0, [1, 1, 1]) == []
+        assert q.select(key + 100000, 0, [1, 1, 1])[0].columns == \
+            [key + 100000, key, 0]
+    db.close()
+
+
+def test_checkpoints_during_updates(path):
+    db = open_db(path, budget=Config.SIZE_BUFFER)
+    table = db.create_table('t', 3, 0, max_records=64)
+    table.index.create_index(2)
+    q = Query(table)
+    for key in range(2000):
+        q.insert(key, 0, 0)
+    done = threading.Event()
+
+    def checkpoints():
+        while not done.is_set():
+            db.checkpoint()
+    thread = threading.Thread(target=checkpoints)
+    thread.start()
+    for i in range(20):
+        q.update_batch([(key, [None, i + 1, None]) for key in range(2000)])
+    done.set()
+    thread.join()
+    db.checkpoint()
+    del db, table, q
+
+    db = open_db(path, budget=Config.SIZE_BUFFER)
+    table = db.get_table('t')
+    check_consistent(table, {key: [key, 20, 0] for key in range(2000)})
+    db.close()
+
+
+def test_checkpoint_waits_for_a_write_in_progress(path, monkeypatch):
+    db = open_db(path)
+    q = Query(db.create_table('t', 3, 0))
+    q.insert(1, 0, 0)
+    db.checkpoint()
+
+    # pause the update after it marked the partition dirty, before its tail
+    #   record is written
+    paused, resume = threading.Event(), threading.Event()
+    widen = Partition._Partition__widen
+
+    def pausing_widen(self, columns):
+        paused.set()
+        resume.wait()
+        widen(self, columns)
+    monkeypatch.setattr(Partition, '_Partition__widen', pausing_widen)
+    update = threading.Thread(target=q.update, args=(1, None, 5, None))
+    update.start()
+    paused.wait()
+    checkpoint = threading.Thread(target=db.checkpoint)
+    checkpoint.start()
+    checkpoint.join(0.2)
+    try:
+        assert checkpoint.is_alive()
+    finally:
+        resume.set()
+    update.join()
+    checkpoint.join()
+    monkeypatch.undo()
+    del db, q
+
+    db = open_db(path)
+    assert Query(db.get_table('t')).select(1, 0, [1, 1, 1])[0].columns == \
+        [1, 5, 0]
+    db.close()
+
+
+def test_missing_partition_file(path):
+    db = open_db(path)
+    table = db.create_table('t', 3, 0, max_records=64)
+    q = Query(table)
+    for key in range(200):
+        q.insert(key, key, 0)
+    db.close()
+    # as if partition 1 had never made it to the disk
+    os.remove(os.path.join(path, 't', '1'))
+
+    db = open_db(path)
+    table = db.get_table('t')
+    q = Query(table)
+    assert len(table.buffer.partitions) == 4
+    assert q.select(199, 0, [1, 1, 1])[0].columns == [199, 199, 0]
+    q.insert(200, 0, 0)
+    assert q.select(200, 0, [1, 1, 1])[0].rid == 201
+    db.close()
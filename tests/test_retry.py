@@ -0,0 +1,60 @@
+import threading
+
+from lstore.query import Query
+from lstore.transaction import Transaction
+from lstore.transaction_worker import TransactionWorker
+
+
+def update(q, key, value):
+    t = Transaction()
+    t.add_query(q.update, key, None, value, None)
+    return t
+
+
+def setup(db):
+    table = db.create_table('t', 3, 0)
+    q = Query(table)
+    for key in range(10):
+        q.insert(key, 0, 0)
+    return table, q
+
+
+def test_retried_until_the_lock_is_released(db):
+    table, q = setup(db)
+    rid = table.index.locate(0, 3)[0]
+    table.glb_locks[rid] = 'X'
+    release = threading.Timer(0.05, table.release_lock, [{rid: 'X'}])
+    release.start()
+    worker = TransactionWorker([update(q, 3, 30), update(q, 4, 40)],
+                               max_attempts=10, backoff=0.001,
+                               max_backoff=0.1)
+    worker.run()
+    release.join()
+    assert worker.stats == [True, True]
+    assert worker.result == 2
+    assert worker.n_retries >= 1 and worker.n_aborts == 0
+    assert q.select(3, 0, [0, 1, 0])[0].columns == [30]
+    assert q.select(4, 0, [0, 1, 0])[0].columns == [40]
+
+
+def test_given_up_after_max_attempts(db):
+    table, q = setup(db)
+    rid = table.index.locate(0, 3)[0]
+    table.glb_locks[rid] = 'X'
+    worker = TransactionWorker([update(q, 3, 30), update(q, 4, 40)],
+                               max_attempts=3, backoff=0.001,
+                               max_backoff=0.005)
+    worker.run()
+    assert worker.stats == [False, True]
+    assert worker.n_retries == 2 and worker.n_aborts == 1
+    assert worker.transactions[0].conflicts == [rid]
+    assert q.select(3, 0, [0, 1, 0])[0].columns == [0]
+
+
+def test_no_retries(db):
+    table, q = setup(db)
+    table.glb_locks[table.index.locate(0, 3)[0]] = 'X'
+    worker = TransactionWorker([update(q, 3, 30)], max_attempts=1)
+    worker.run()
+    assert worker.stats == [False]
+    assert worker.n_retries == 0 and worker.n_aborts == 1
@@ -0,0 +1,26 @@
+from lstore.query import Query
+
+
+def test_columnar_matches_records(db):
+    q = Query(db.create_table('t', 3, 0))
+    for key in range(50):
+        q.insert(key, key % 5, key * 10)
+    q.update(7, None, None, 1)
+    table = q.table
+    table.index.create_index(1)
+
+    records = q.select(2, 1, [1, 0, 1])
+    columnar = q.select(2, 1, [1, 0, 1], columnar=True)
+    assert len(columnar) == len(records) == 10
+    assert list(columnar.rids) == [r.rid for r in records]
+    assert [list(c) for c in columnar.columns] == \
+        [list(c) for c in zip(*[r.columns for r in records])]
+    assert list(q.select(7, 0, [0, 0, 1], columnar=True).columns[0]) == [1]
+
+
+def test_records_have_no_dict(db):
+    q = Query(db.create_table('t', 2, 0))
+    q.insert(1, 2)
+    record = q.select(1, 0, [1, 1])[0]
+    assert not hasattr(record, '__dict__')
+    assert (record.rid, record.key, record.columns) == (1, 1, [1, 2])
@@ -0,0 +1,58 @@
+import pytest
+
+from lstore.db import Database
+from lstore.query import Query
+from lstore.shard import ShardedDatabase, ShardedQuery
+
+N_RECORDS = 500
+
+
+def run(q):
+    """ The same workload on a sharded or a single table
+    """
+    for key in range(N_RECORDS):
+        rid = q.insert(key, key % 7, 1)
+        assert q.select(key, 0, [1, 0, 0])[0].rid == rid
+    q.update(5, None, 50, None)
+    # moves the record to another shard
+    q.update(6, 10006, None, None)
+    q.increment(7, 2)
+    q.update_batch([(8, [None, 0, None]), (9, [10009, None, None])])
+    q.upsert([(3000, [None, 1, 1]), (10, [None, 99, None])])
+    q.add_batch([(11, [None, 3, None])])
+    q.delete(100)
+
+
+def snapshot(q):
+    rows = sorted(tuple(r.columns) for r in q.scan([1, 1, 1]))
+    aggregates = [f(0, 20000, 1) for f in (q.sum, q.count, q.min, q.max)]
+    return rows, aggregates
+
+
+@pytest.mark.parametrize('transport', ['pipe', 'unix'])
+def test_same_results_as_one_table(tmp_path, transport):
+    expected = Database()
+    expected.open(str(tmp_path / 'single'))
+    q = Query(expected.create_table('t', 3, 0))
+    run(q)
+    expected_rows, expected_aggs = snapshot(q)
+    expected.close()
+
+    db = ShardedDatabase(2, transport=transport)
+    db.open(str(tmp_path / 'sharded'))
+    table = db.create_table('t', 3, 0)
+    q = ShardedQuery(table)
+    run(q)
+    assert snapshot(q) == (expected_rows, expected_aggs)
+    assert q.select(6, 0, [1, 1, 1]) == []
+    assert q.select(10006, 0, [1, 1, 1])[0].columns == [10006, 6, 1]
+    assert q.select(100, 0, [1, 1, 1]) == []
+    # both shards got records
+    assert {table.shard_of(key) for key in range(N_RECORDS)} == {0, 1}
+    db.close()
+
+    db = ShardedDatabase(2, transport=transport)
+    db.open(str(tmp_path / 'sharded'))
+    q = ShardedQuery(db.get_table('t'))
+    assert snapshot(q) == (expected_rows, expected_aggs)
+    db.close()
@@ -0,0 +1,63 @@
+import random
+
+import lstore.partition
+from lstore.db import Database
+from lstore.query import Query
+
+N_RECORDS = 1000
+
+
+def run(path, sparse):
+    """ Random updates & adds on a table with the tail layout @sparse
+    Returns:
+        The rows after the updates, the rows after reopening the table, and
+            the bytes held by the partitions.
+    """
+    db = Database()
+    db.open(path)
+    table = db.create_table('t', 8, 0, max_records=256, sparse_tails=sparse)
+    q = Query(table)
+    rand = random.Random(3)
+    for key in range(N_RECORDS):
+        q.insert(key, *[key * c for c in range(1, 8)])
+    for _ in range(5000):
+        key, column = rand.randrange(N_RECORDS), rand.randrange(1, 8)
+        if rand.random() < .5:
+            columns = [None] * 8
+            columns[column] = rand.randrange(10**6)
+            q.update(key, *columns)
+        else:
+            q.add(key, column, 3)
+    for key in range(0, N_RECORDS, 13):
+        q.delete(key)
+    size = sum(p.size() for p in table.buffer.partitions)
+    rows = [r.columns for r in q.scan([1] * 8)]
+    db.close()
+    db = Database()
+    db.open(path)
+    reopened = [r.columns for r in Query(db.get_table('t')).scan([1] * 8)]
+    db.close()
+    return rows, reopened, size
+
+
+def test_same_rows_as_full_tails_in_less_space(tmp_path):
+    dense, dense_reopened, dense_size = run(str(tmp_path / 'dense'), False)
+    sparse, sparse_reopened, sparse_size = run(str(tmp_path / 'sparse'), True)
+    assert sparse == dense == dense_reopened == sparse_reopened
+    assert sparse_size < dense_size
+
+
+def test_tail_map_widens_when_positions_grow(db, monkeypatch):
+    # start from 1-byte items so a few hundred updates need wider ones
+    monkeypatch.setattr(lstore.partition, 'MAP_TYPECODES', 'BHIQ')
+    table = db.create_table('t', 3, 0, max_records=16, sparse_tails=True)
+    q = Query(table)
+    for key in range(16):
+        q.insert(key, 0, 0)
+    p = table.buffer[0]
+    assert p.tail_map.typecode == 'B'
+    for i in range(400):
+        q.update(i % 16, None, i, None)
+    assert p.tail_map.typecode == 'H'
+    assert [r.columns for r in q.scan([1, 1, 1])] == \
+        [[key, 384 + key, 0] for key in range(16)]
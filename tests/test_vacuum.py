@@ -0,0 +1,36 @@
+from lstore.db import Database
+from lstore.query import Query
+
+
+def test_vacuum_reclaims_deleted_records(path):
+    db = Database()
+    db.open(path)
+    table = db.create_table('t', 2, 0, max_records=16)
+    q = Query(table)
+    for key in range(160):
+        q.insert(key, key * 2)
+    table.index.create_index(1)
+    for key in range(0, 160, 2):
+        q.delete(key)
+    q.update(1, None, 7)
+
+    reclaimed = table.vacuum()
+    assert reclaimed['records'] == 80
+    assert reclaimed['partitions'] == 5
+    assert len(table.buffer.partitions) == 5
+    assert table.fsm == {}
+    for key in range(1, 160, 2):
+        expected = 7 if key == 1 else key * 2
+        assert q.select(key, 0, [1, 1])[0].columns == [key, expected]
+    assert q.select(0, 0, [1, 1]) == []
+    assert [r.columns[0] for r in q.select(7, 1, [1, 0])] == [1]
+    q.insert(1000, 1)
+    assert q.select(1000, 0, [1, 1])[0].rid == 81
+    db.close()
+
+    db = Database()
+    db.open(path)
+    q = Query(db.get_table('t'))
+    assert q.select(159, 0, [1, 1])[0].columns == [159, 318]
+    assert q.select(1000, 0, [1, 1])[0].rid == 81
+    db.close()
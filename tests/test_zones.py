@@ -0,0 +1,65 @@
+from lstore.config import Config
+from lstore.db import Database
+from lstore.query import Query
+
+MAX_RECORDS = 128
+N_RECORDS = 5000
+
+
+def open_db(path):
+    db = Database(buffer_size=200000)
+    db.open(path)
+    return db
+
+
+def fill(path):
+    db = open_db(path)
+    table = db.create_table('t', 3, 0, max_records=MAX_RECORDS)
+    q = Query(table)
+    for key in range(N_RECORDS):
+        q.insert(key, key // 10, 7)
+    q.update(3, None, 100000, None)
+    q.delete(4)
+    return db, table, q
+
+
+def test_scans_only_load_partitions_that_may_match(path):
+    db, table, q = fill(path)
+    n_loads = table.buffer.n_loads
+    # column 1 has no index
+    result = q.select_range(200, 210, 1, [1, 1, 1])
+    assert sorted(r.columns[0] for r in result) == list(range(2000, 2100))
+    assert table.buffer.n_loads - n_loads <= 2
+    assert [r.columns for r in q.scan([1, 1, 1], where=(1, 100000, 100000))] \
+        == [[3, 100000, 7]]
+    assert len(q.scan([1, 0, 0], columnar=True, where=(2, 8, 9))) == 0
+    assert sorted(r.columns[0] for r in q.scan([1, 0, 0], where=(0, 0, 10))) \
+        == [0, 1, 2, 3, 5, 6, 7, 8, 9, 10]
+    db.close()
+
+
+def test_zone_maps_survive_reopen(path):
+    db, _, _ = fill(path)
+    db.close()
+    db = open_db(path)
+    table = db.get_table('t')
+    n_loads = table.buffer.n_loads
+    assert len(Query(table).select_range(200, 210, 1, [1, 1, 1])) == 100
+    # the 2 partitions of the range, and the 1st one whose zone was widened
+    #   by the update to 100000
+    assert table.buffer.n_loads - n_loads == 3
+    db.close()
+
+
+def test_merge_narrows_the_zone(db):
+    table = db.create_table('t', 3, 0, max_records=MAX_RECORDS)
+    q = Query(table)
+    for key in range(MAX_RECORDS):
+        q.insert(key, 1, 1)
+    column = 1 + Config.N_META_COLS
+    q.update(0, None, 1000, None)
+    assert table.buffer.may_hold(0, column, 1000, 1000)
+    q.update(0, None, 1, None)
+    table.buffer[0].merge()
+    assert not table.buffer.may_hold(0, column, 1000, 1000)
+    assert table.buffer.may_hold(0, column, 1, 1)